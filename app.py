@@ -65,6 +65,10 @@ def run():
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
 
+        if conf().get("preload_tokenizer"):
+            from bot.chatgpt.chat_gpt_session import preload_tokenizers
+            threading.Thread(target=preload_tokenizers, daemon=True).start()
+
         channel_name = conf().get("channel_type", "wx")
         if "--cmd" in sys.argv:
             channel_name = "terminal"
@@ -0,0 +1,134 @@
+"""
+压测入口，在项目根目录运行：
+    python -m benchmark --channels chat,web --users 20 --turns 5 --latency 0.5
+    python -m benchmark --stream --output bench.json
+    python -m benchmark --baseline bench.json   # 与之前的结果比较，有退化时退出码为1
+bot请求发往本地桩服务(benchmark.stub_llm)，不调用真实接口
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from benchmark import report, stub_llm
+from benchmark.load import DRIVERS, _free_port, run_load, synthetic_conversation
+
+
+def _configure(stub_url, args):
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    from common import const
+    from config import conf, load_config
+
+    load_config()
+    conf()["open_ai_api_base"] = stub_url
+    conf()["bot_type"] = const.CHATGPT
+    # 限流和缓存会掩盖链路本身的耗时
+    conf()["rate_limit_chatgpt"] = 0
+    conf()["rate_limit_chatgpt_tpm"] = 0
+    conf()["reply_cache_enabled"] = False
+    if args.pool_size:
+        conf()["handler_pool_size"] = args.pool_size
+
+    from common.log import logger
+
+    logger.setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    if args.plugins:
+        from plugins import PluginManager
+
+        PluginManager().load_plugins()
+
+
+def _bench(name, args):
+    driver = DRIVERS[name](stream=args.stream)
+    try:
+        driver.setup()
+    except Exception as e:
+        print("{:<8} skipped, {}: {}".format(name, type(e).__name__, e))
+        return None
+    try:
+        # 预热：创建bot和连接，不计入结果
+        run_load(driver, 1, 1, seed="warmup")
+        rss_before = report.memory_usage().get("rss_mb")
+        recorder = run_load(driver, args.users, args.turns, args.think_time, args.ramp_up, args.seed)
+        result = report.summarize(
+            recorder,
+            channel=name,
+            mode="stream" if args.stream else "block",
+            users=args.users,
+            turns=args.turns,
+            think_time=args.think_time,
+            stub_latency=args.latency,
+        )
+        memory = report.memory_usage()
+        memory["rss_before_mb"] = rss_before
+        result["memory"] = memory
+        result["dispatch"] = driver.stats()
+        return result
+    finally:
+        driver.teardown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="chatgpt-on-wechat pipeline benchmark")
+    parser.add_argument("--channels", default="chat,web", help="逗号分隔: {}".format(",".join(DRIVERS)))
+    parser.add_argument("--users", type=int, default=20, help="同时对话的用户数")
+    parser.add_argument("--turns", type=int, default=5, help="每个用户发送的消息数")
+    parser.add_argument("--think-time", type=float, default=0.0, help="用户收到回复后到发送下一条的间隔秒数")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="所有用户在该秒数内均匀开始")
+    parser.add_argument("--stream", action="store_true", help="使用流式回复")
+    parser.add_argument("--plugins", action="store_true", help="加载插件，与正常启动一样会写入plugins/plugins.json")
+    parser.add_argument("--pool-size", type=int, default=0, help="覆盖handler_pool_size")
+    parser.add_argument("--output", help="结果保存为json文件")
+    parser.add_argument("--baseline", help="与之前保存的结果比较")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="比较时允许的退化比例")
+    stub_llm.add_arguments(parser)
+    args = parser.parse_args()
+    names = [name.strip() for name in args.channels.split(",") if name.strip()]
+    unknown = [name for name in names if name not in DRIVERS]
+    if unknown:
+        parser.error("unknown channels: {}".format(",".join(unknown)))
+
+    port = _free_port()
+    stub = stub_llm.start_process(port, stub_llm.options_from_args(args))
+    stub_url = "http://127.0.0.1:{}/v1".format(port)
+    try:
+        _configure(stub_url, args)
+        print(
+            "{} users x {} turns, stub latency {}s±{}s, {} chunks, error rate {}, example: {}".format(
+                args.users, args.turns, args.latency, args.jitter, args.chunks, args.error_rate, synthetic_conversation(0, 1, args.seed)[0]
+            )
+        )
+        results = []
+        for name in names:
+            result = _bench(name, args)
+            if result:
+                report.print_report(result)
+                results.append(result)
+        import requests
+
+        print("stub server", requests.get(stub_url + "/stats").json())
+    finally:
+        stub.terminate()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        baseline = report.load_results(args.baseline)
+        regressed = False
+        for result in results:
+            old = baseline.get(report.result_key(result))
+            if old is None:
+                continue
+            regressions = report.compare(result, old, args.tolerance)
+            if regressions:
+                regressed = True
+                print("REGRESSION {}: {}".format(report.result_key(result), "; ".join(regressions)))
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
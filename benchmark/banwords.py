@@ -0,0 +1,101 @@
+"""
+Banwords插件敏感词匹配的压测，比较原实现WordsSearch和ArrayWordsSearch的构建、加载和扫描耗时，并校验两者结果一致
+    python -m benchmark.banwords --words 50000
+    python -m benchmark.banwords --wordlist plugins/banwords/banwords.txt
+不指定词库时随机生成，文本为随机的中英文混合内容
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+_LIB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "banwords", "lib")
+
+
+def _engines():
+    # 直接从lib目录导入，避免导入plugins.banwords时注册插件
+    sys.path.insert(0, _LIB)
+    try:
+        from ArrayWordsSearch import ArrayWordsSearch
+        from WordsSearch import WordsSearch
+    finally:
+        sys.path.remove(_LIB)
+    return WordsSearch, ArrayWordsSearch
+
+
+def synthetic_words(count, rand):
+    common = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    words = set()
+    while len(words) < count:
+        if rand.random() < 0.1:
+            words.add("".join(rand.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rand.randint(3, 8))))
+        else:
+            words.add("".join(rand.choice(common) for _ in range(rand.randint(2, 6))))
+    return sorted(words)
+
+
+def synthetic_text(length, rand):
+    common = [chr(c) for c in range(0x4E00, 0x4E00 + 6000)]
+    parts = []
+    while sum(len(part) for part in parts) < length:
+        if rand.random() < 0.3:
+            parts.append(" {} ".format("".join(rand.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rand.randint(2, 10)))))
+        else:
+            parts.append("".join(rand.choice(common) for _ in range(rand.randint(2, 12))) + rand.choice("，。！？"))
+    return "".join(parts)[:length]
+
+
+def _timed(func, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="banwords matcher benchmark")
+    parser.add_argument("--wordlist", help="词库文件，每行一个词")
+    parser.add_argument("--words", type=int, default=20000, help="不指定词库时随机生成的词数")
+    parser.add_argument("--texts", type=int, default=200, help="扫描的文本数")
+    parser.add_argument("--length", type=int, default=300, help="每段文本的字数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rand = random.Random(args.seed)
+    if args.wordlist:
+        with open(args.wordlist, encoding="utf-8") as f:
+            words = [line.strip() for line in f if line.strip()]
+    else:
+        words = synthetic_words(args.words, rand)
+    texts = [synthetic_text(args.length, rand) for _ in range(args.texts)]
+    WordsSearch, ArrayWordsSearch = _engines()
+
+    old = WordsSearch()
+    _, old_build = _timed(lambda: old.SetKeywords(words))
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, "banwords.automaton")
+        new = ArrayWordsSearch()
+        _, new_build = _timed(lambda: new.SetKeywords(words, cache_path=cache_path))
+        cache_size = os.path.getsize(cache_path)
+        new = ArrayWordsSearch()
+        loaded, new_load = _timed(lambda: new.SetKeywords(words, cache_path=cache_path))
+    print("{} words, {} texts x {} chars".format(len(words), len(texts), args.length))
+    print("build  WordsSearch {:8.3f}s  ArrayWordsSearch {:8.3f}s  load from cache {:.3f}s ({}, {:.1f}MB)".format(
+        old_build, new_build, new_load, "hit" if loaded else "miss", cache_size / 1024 / 1024))
+
+    mismatches = 0
+    for text in texts:
+        if old.FindAll(text) != new.FindAll(text) or old.Replace(text) != new.Replace(text):
+            mismatches += 1
+    for name in ("FindFirst", "ContainsAny", "FindAll", "Replace"):
+        _, old_time = _timed(lambda: [getattr(old, name)(text) for text in texts], 3)
+        _, new_time = _timed(lambda: [getattr(new, name)(text) for text in texts], 3)
+        print("{:<12} WordsSearch {:8.1f}us  ArrayWordsSearch {:8.1f}us  x{:.1f}".format(
+            name, old_time / len(texts) * 1e6, new_time / len(texts) * 1e6, old_time / new_time if new_time else 0))
+    print("results {}".format("identical" if not mismatches else "DIFFER on {} texts".format(mismatches)))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
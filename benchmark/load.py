@@ -0,0 +1,276 @@
+"""
+压测负载生成：模拟多个用户的多轮对话，经由通道走完整条处理链路
+(通道 -> PluginManager.emit_event -> Bridge -> bot -> 发送)
+
+每个用户一个线程，按顺序发送自己的消息，收到回复后间隔think_time秒再发下一条；
+用户在ramp_up秒内均匀开始。不同通道的驱动见DRIVERS。
+"""
+import json
+import queue
+import random
+import socket
+import threading
+import time
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply
+from channel.chat_message import ChatMessage
+
+# 桩服务的回复都以此开头
+STUB_MARK = "stub reply"
+
+_TOPICS = ["天气", "翻译", "写一首诗", "python", "旅行计划", "菜谱", "数学题", "新闻摘要", "code review", "健身"]
+_TEMPLATES = [
+    "帮我看看{topic}相关的问题，第{turn}轮",
+    "继续刚才说的{topic}，再详细一点 ({turn})",
+    "用一句话总结{topic} #{turn}",
+    "Please explain {topic} in detail, turn {turn}",
+]
+
+
+def synthetic_conversation(user, turns, seed=None) -> list:
+    """生成一个用户的多轮对话，同一seed和用户生成的内容相同"""
+    rand = random.Random("{}-{}".format(seed, user))
+    topic = rand.choice(_TOPICS)
+    return [rand.choice(_TEMPLATES).format(topic=topic, turn=turn + 1) for turn in range(turns)]
+
+
+class Recorder(object):
+    """记录每条消息的耗时，线程安全"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []  # 从发出消息到收到完整回复的秒数
+        self.first_chunk = []  # 流式回复收到首个片段的秒数
+        self.errors = {}  # 错误类型 -> 次数
+        self.started = None
+        self.finished = None
+
+    def record(self, latency, first_chunk=None):
+        with self.lock:
+            self.latencies.append(latency)
+            if first_chunk is not None:
+                self.first_chunk.append(first_chunk)
+
+    def record_error(self, kind):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def record_reply(self, text, latency, first_chunk=None):
+        """bot出错时回复的是错误提示而不是桩服务的内容，按错误计数"""
+        if not text:
+            self.record_error("empty_reply")
+        elif STUB_MARK not in text:
+            self.record_error("bot_error")
+        else:
+            self.record(latency, first_chunk)
+
+
+def _bench_context(user, prompt) -> Context:
+    session_id = "bench-{}".format(user)
+    msg = ChatMessage({"content": prompt})
+    msg.content = prompt
+    msg.from_user_id = msg.actual_user_id = msg.other_user_id = session_id
+    msg.from_user_nickname = msg.actual_user_nickname = session_id
+    msg.to_user_id = "bench-bot"
+    msg.is_group = False
+    context = Context(ContextType.TEXT, content=prompt)
+    context["session_id"] = session_id
+    context["isgroup"] = False
+    context["receiver"] = session_id
+    context["msg"] = msg
+    return context
+
+
+class ChatChannelDriver(object):
+    """直接调用ChatChannel.produce，不经过网络"""
+
+    name = "chat"
+
+    def __init__(self, stream=False):
+        self.stream = stream
+        self.channel = None
+
+    def setup(self):
+        from channel.chat_channel import ChatChannel
+
+        self.channel = ChatChannel()
+
+    def send(self, user, prompt, recorder):
+        context = _bench_context(user, prompt)
+        start = time.monotonic()
+        if not self.stream:
+            reply = self.channel.produce(context).result()
+            recorder.record_reply(str(reply.content) if isinstance(reply, Reply) and reply.content else "", time.monotonic() - start)
+            return
+        text, first_chunk = "", None
+        for chunk in self.channel.produce_stream(context):
+            if first_chunk is None:
+                first_chunk = time.monotonic() - start
+            text += chunk
+        recorder.record_reply(text, time.monotonic() - start, first_chunk)
+
+    def teardown(self):
+        self.channel.dispatcher.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return self.channel.get_dispatch_stats()
+
+
+class WebChannelDriver(object):
+    """在本进程启动WebChannel的服务，每个用户用自己的keep-alive连接和会话ID请求/chat或/chat/stream"""
+
+    name = "web"
+
+    def __init__(self, stream=False):
+        self.stream = stream
+        self.channel = None
+        self.url = None
+        self.sessions = {}
+
+    def setup(self):
+        from channel.web.web_channel import WebChannel
+
+        self.channel = WebChannel()
+        self.channel.port = _free_port()
+        self.url = "http://127.0.0.1:{}".format(self.channel.port)
+        threading.Thread(target=self.channel.startup, name="bench_web", daemon=True).start()
+        _wait_port(self.channel.port)
+
+    def send(self, user, prompt, recorder):
+        import requests
+
+        session = self.sessions.get(user)
+        if session is None:
+            session = self.sessions[user] = requests.Session()
+            session.headers["X-Session-Id"] = "bench-{}".format(user)
+        start = time.monotonic()
+        if not self.stream:
+            response = session.post(self.url + "/chat", json={"message": prompt})
+            if response.status_code != 200:
+                recorder.record_error("http_{}".format(response.status_code))
+                return
+            recorder.record_reply(response.json().get("reply"), time.monotonic() - start)
+            return
+        text, first_chunk = "", None
+        with session.post(self.url + "/chat/stream", json={"message": prompt}, stream=True) as response:
+            if response.status_code != 200:
+                recorder.record_error("http_{}".format(response.status_code))
+                return
+            for line in response.iter_lines():
+                if line.startswith(b"event: error"):
+                    recorder.record_error("stream_error")
+                    return
+                if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                    continue
+                if first_chunk is None:
+                    first_chunk = time.monotonic() - start
+                text += json.loads(line[6:].decode("utf-8")).get("delta", "")
+        recorder.record_reply(text, time.monotonic() - start, first_chunk)
+
+    def teardown(self):
+        for session in self.sessions.values():
+            session.close()
+
+    def stats(self) -> dict:
+        stats = self.channel.get_dispatch_stats()
+        stats.update({"shedder_" + k: v for k, v in self.channel.shedder.stats().items()})
+        return stats
+
+
+class TerminalChannelDriver(object):
+    """
+    用输入队列代替标准输入运行TerminalChannel.startup，send记录收到回复的时间而不打印
+    终端只有一个用户，多个用户的消息排队依次输入
+    """
+
+    name = "terminal"
+
+    def __init__(self, stream=False):
+        self.channel = None
+        self.lock = threading.Lock()
+
+    def setup(self):
+        from channel.terminal.terminal_channel import TerminalChannel
+
+        inputs = queue.Queue()
+        replies = queue.Queue()
+
+        class BenchTerminalChannel(TerminalChannel):
+            def get_input(self):
+                prompt = inputs.get()
+                if prompt is None:
+                    raise KeyboardInterrupt()
+                return prompt
+
+            def send(self, reply, context):
+                replies.put(reply)
+
+        self.inputs, self.replies = inputs, replies
+        self.channel = BenchTerminalChannel()
+        self.thread = threading.Thread(target=self.channel.startup, name="bench_terminal", daemon=True)
+        self.thread.start()
+
+    def send(self, user, prompt, recorder):
+        with self.lock:
+            start = time.monotonic()
+            self.inputs.put(prompt)
+            try:
+                reply = self.replies.get(timeout=600)
+            except queue.Empty:
+                recorder.record_error("no_reply")
+                return
+            recorder.record_reply(str(reply.content) if reply and reply.content else "", time.monotonic() - start)
+
+    def teardown(self):
+        self.inputs.put(None)
+
+    def stats(self) -> dict:
+        return self.channel.get_dispatch_stats()
+
+
+DRIVERS = {driver.name: driver for driver in (ChatChannelDriver, WebChannelDriver, TerminalChannelDriver)}
+
+
+def run_load(driver, users, turns, think_time=0.0, ramp_up=0.0, seed=None) -> Recorder:
+    """
+    运行负载直到所有用户发送完毕
+    :param driver: DRIVERS中的驱动实例，需已调用setup
+    """
+    recorder = Recorder()
+
+    def run_user(user):
+        time.sleep(ramp_up * user / max(1, users))
+        for prompt in synthetic_conversation(user, turns, seed):
+            try:
+                driver.send(user, prompt, recorder)
+            except Exception as e:
+                recorder.record_error(type(e).__name__)
+            if think_time:
+                time.sleep(think_time)
+
+    threads = [threading.Thread(target=run_user, args=(user,), name="bench_user_{}".format(user), daemon=True) for user in range(users)]
+    recorder.started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.finished = time.monotonic()
+    return recorder
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("web channel did not start on port {}".format(port))
@@ -0,0 +1,107 @@
+"""
+压测结果统计：延迟分位数、吞吐量和内存，以及与基线结果的比较
+"""
+import json
+import os
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def memory_usage() -> dict:
+    """当前进程的常驻内存和峰值，单位MB"""
+    usage = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key = "rss_mb" if line.startswith("VmRSS:") else "peak_rss_mb"
+                    usage[key] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if "peak_rss_mb" not in usage and resource is not None:
+        # linux下ru_maxrss单位为KB，macOS下为字节
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage["peak_rss_mb"] = round(peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+    return usage
+
+
+def summarize(recorder, **meta) -> dict:
+    """
+    :param meta: 压测参数，原样写入结果，例如通道、用户数
+    """
+    latencies = sorted(recorder.latencies)
+    first_chunk = sorted(recorder.first_chunk)
+    duration = (recorder.finished or 0) - (recorder.started or 0)
+    result = dict(meta)
+    result.update(
+        {
+            "replies": len(latencies),
+            "errors": sum(recorder.errors.values()),
+            "error_kinds": dict(recorder.errors),
+            "duration_s": round(duration, 2),
+            "throughput_rps": round(len(latencies) / duration, 2) if duration > 0 else 0.0,
+        }
+    )
+    for name, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        result["latency_{}_ms".format(name)] = round(percentile(latencies, p) * 1000, 1)
+    result["latency_max_ms"] = round(latencies[-1] * 1000, 1) if latencies else 0.0
+    if first_chunk:
+        result["first_chunk_p50_ms"] = round(percentile(first_chunk, 0.5) * 1000, 1)
+        result["first_chunk_p95_ms"] = round(percentile(first_chunk, 0.95) * 1000, 1)
+    return result
+
+
+def print_report(result):
+    print(
+        "{channel:<8} {mode:<6} users {users:<4} replies {replies:<6} errors {errors:<4} "
+        "{throughput_rps:>8.2f} msg/s  p50 {latency_p50_ms:>8.1f}ms  p95 {latency_p95_ms:>8.1f}ms  "
+        "p99 {latency_p99_ms:>8.1f}ms  max {latency_max_ms:>8.1f}ms".format(**result)
+    )
+    if "first_chunk_p50_ms" in result:
+        print("{:<15} first chunk p50 {first_chunk_p50_ms:.1f}ms  p95 {first_chunk_p95_ms:.1f}ms".format("", **result))
+    if result["error_kinds"]:
+        print("{:<15} errors {}".format("", result["error_kinds"]))
+    memory = result.get("memory") or {}
+    if memory:
+        print("{:<15} rss {} -> {}MB, peak {}MB".format("", memory.get("rss_before_mb"), memory.get("rss_mb"), memory.get("peak_rss_mb")))
+
+
+# 越大越差的指标和越小越差的指标
+_HIGHER_IS_WORSE = ("latency_p50_ms", "latency_p95_ms", "latency_p99_ms", "first_chunk_p95_ms")
+_LOWER_IS_WORSE = ("throughput_rps",)
+
+
+def compare(result, baseline, tolerance=0.2) -> list:
+    """
+    与基线结果比较，返回超出容差的指标说明，为空表示没有退化
+    错误数增加也视为退化
+    """
+    regressions = []
+    for key in _HIGHER_IS_WORSE:
+        if baseline.get(key) and key in result and result[key] > baseline[key] * (1 + tolerance):
+            regressions.append("{} {} -> {}".format(key, baseline[key], result[key]))
+    for key in _LOWER_IS_WORSE:
+        if baseline.get(key) and key in result and result[key] < baseline[key] * (1 - tolerance):
+            regressions.append("{} {} -> {}".format(key, baseline[key], result[key]))
+    if result.get("errors", 0) > baseline.get("errors", 0):
+        regressions.append("errors {} -> {}".format(baseline.get("errors", 0), result["errors"]))
+    return regressions
+
+
+def load_results(path) -> dict:
+    """读取之前保存的结果，按 通道/模式 索引"""
+    with open(path, encoding="utf-8") as f:
+        return {result_key(result): result for result in json.load(f)}
+
+
+def result_key(result):
+    return "{}/{}".format(result["channel"], result["mode"])
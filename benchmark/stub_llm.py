@@ -0,0 +1,208 @@
+"""
+兼容OpenAI chat completions接口的本地桩服务，压测时代替真实模型，不产生任何费用
+
+python -m benchmark.stub_llm --port 18080 --latency 0.5 --jitter 0.1 --chunks 8 --error-rate 0.01
+    latency: 首个字节前的等待秒数，jitter为随机增减的秒数
+    chunks/chunk_interval: 流式响应的片段数和片段间隔秒数，非流式响应等待全部片段的时间后一次返回
+    error_rate: 随机返回500或429的比例，openai客户端会按自身策略重试
+GET /stats 返回收到的请求数、流式请求数和注入的错误数
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOptions(object):
+    def __init__(self, latency=0.5, jitter=0.0, chunks=8, chunk_interval=0.05, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunks = max(1, int(chunks))
+        self.chunk_interval = chunk_interval
+        self.error_rate = error_rate
+        self.seed = seed
+
+
+class _Stats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+
+    def to_dict(self):
+        with self.lock:
+            return {"requests": self.requests, "streams": self.streams, "errors": self.errors}
+
+
+def _reply_chunks(query, count):
+    # 回复内容与提问相关，便于在日志中对照
+    words = ["stub", "reply", "to", query[:24]] + ["token{}".format(i) for i in range(count * 3)]
+    size = len(words) // count
+    return [" ".join(words[i * size : (i + 1) * size if i < count - 1 else len(words)]) + " " for i in range(count)]
+
+
+def _count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _make_handler(options, stats, rand):
+    rand_lock = threading.Lock()
+
+    def random_value():
+        with rand_lock:
+            return rand.random()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, stats.to_dict())
+            else:
+                self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                return
+            request = json.loads(body.decode("utf-8") or "{}")
+            stream = bool(request.get("stream"))
+            with stats.lock:
+                stats.requests += 1
+                stats.streams += stream
+            time.sleep(max(0.0, options.latency + (random_value() * 2 - 1) * options.jitter))
+            if options.error_rate and random_value() < options.error_rate:
+                with stats.lock:
+                    stats.errors += 1
+                if random_value() < 0.5:
+                    self._send_json(429, {"error": {"message": "stub rate limit", "type": "rate_limit_error"}})
+                else:
+                    self._send_json(500, {"error": {"message": "stub server error", "type": "server_error"}})
+                return
+
+            messages = request.get("messages") or [{}]
+            query = str(messages[-1].get("content", ""))
+            model = request.get("model", "gpt-3.5-turbo")
+            chunks = _reply_chunks(query, options.chunks)
+            prompt_tokens = sum(_count_tokens(str(m.get("content", ""))) for m in messages)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": _count_tokens("".join(chunks)),
+                "total_tokens": prompt_tokens + _count_tokens("".join(chunks)),
+            }
+            completion_id = "chatcmpl-" + uuid.uuid4().hex
+            if stream:
+                include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+                self._send_stream(completion_id, model, chunks, usage if include_usage else None)
+                return
+            time.sleep(options.chunk_interval * (len(chunks) - 1))
+            self._send_json(
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(chunks)}, "finish_reason": "stop"}],
+                    "usage": usage,
+                },
+            )
+
+        def _send_json(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, completion_id, model, chunks, usage):
+            # 事件流长度未知，发送完毕后关闭连接
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            created = int(time.time())
+
+            def event(choices, extra=None):
+                data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": choices}
+                data.update(extra or {})
+                self.wfile.write("data: {}\n\n".format(json.dumps(data)).encode("utf-8"))
+                self.wfile.flush()
+
+            event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for i, chunk in enumerate(chunks):
+                if i:
+                    time.sleep(options.chunk_interval)
+                event([{"index": 0, "delta": {"content": chunk}, "finish_reason": None}])
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if usage:
+                event([], {"usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def serve(port, options: StubOptions, ready=None, host="127.0.0.1"):
+    """启动桩服务，阻塞直到进程结束"""
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer((host, port), _make_handler(options, _Stats(), random.Random(options.seed)))
+    if ready is not None:
+        ready.set()
+    server.serve_forever()
+
+
+def start_process(port, options: StubOptions) -> multiprocessing.Process:
+    """
+    在子进程中启动桩服务，避免与被测进程争用GIL
+    :return: 子进程，压测结束后调用terminate()
+    """
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=serve, args=(port, options, ready), daemon=True)
+    process.start()
+    if not ready.wait(10):
+        process.terminate()
+        raise RuntimeError("stub llm server failed to start on port {}".format(port))
+    return process
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.5, help="首个字节前的等待秒数")
+    parser.add_argument("--jitter", type=float, default=0.1, help="等待时间随机增减的秒数")
+    parser.add_argument("--chunks", type=int, default=8, help="流式响应的片段数")
+    parser.add_argument("--chunk-interval", type=float, default=0.05, help="流式响应的片段间隔秒数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回500/429的比例")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，便于复现")
+
+
+def options_from_args(args) -> StubOptions:
+    return StubOptions(
+        latency=args.latency,
+        jitter=args.jitter,
+        chunks=args.chunks,
+        chunk_interval=args.chunk_interval,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI chat completions stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    print("stub llm serving on http://{}:{}/v1".format(args.host, args.port))
+    serve(args.port, options_from_args(args), host=args.host)
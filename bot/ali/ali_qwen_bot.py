@@ -14,14 +14,17 @@ from bot.ali.ali_qwen_session import AliQwenSession
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.credential_cache import get_credential
 from common.log import logger
 from common import const
 from config import conf, load_config
 
 class AliQwenBot(Bot):
+    session_history = True
+
     def __init__(self):
         super().__init__()
-        self.api_key_expired_time = self.set_api_key()
+        self.set_api_key()
         self.sessions = SessionManager(AliQwenSession, model=conf().get("model", const.QWEN))
 
     def api_key_client(self):
@@ -146,13 +149,16 @@ class AliQwenBot(Bot):
                 return result
 
     def set_api_key(self):
+        # api_key有效期内复用缓存，过期前由后台提前刷新
+        app = "{}:{}".format(self.access_key_id(), self.agent_key())
+        broadscope_bailian.api_key = get_credential("qwen", app, self.create_api_key)
+
+    def create_api_key(self):
         api_key, expired_time = self.api_key_client().create_token(agent_key=self.agent_key())
-        broadscope_bailian.api_key = api_key
-        return expired_time
+        return api_key, expired_time - time.time()
 
     def update_api_key_if_expired(self):
-        if time.time() > self.api_key_expired_time:
-            self.api_key_expired_time = self.set_api_key()
+        self.set_api_key()
 
     def convert_messages_format(self, messages) -> Tuple[str, List[ChatQaMessage]]:
         history = []
@@ -1,9 +1,9 @@
 # encoding:utf-8
 
-import requests
-
 from bot.bot import Bot
 from bridge.reply import Reply, ReplyType
+from common.credential_cache import get_credential
+from common.http_client import get_session
 
 
 # Baidu Unit对话接口 (可用, 但能力较弱)
@@ -18,7 +18,7 @@ class BaiduUnitBot(Bot):
         )
         print(post_data)
         headers = {"content-type": "application/x-www-form-urlencoded"}
-        response = requests.post(url, data=post_data.encode(), headers=headers)
+        response = get_session(url).post(url, data=post_data.encode(), headers=headers)
         if response:
             reply = Reply(
                 ReplyType.TEXT,
@@ -28,9 +28,11 @@ class BaiduUnitBot(Bot):
 
     def get_token(self):
         access_key = "YOUR_ACCESS_KEY"
+        return get_credential("baidu_unit", access_key, lambda: self._fetch_token(access_key))
+
+    def _fetch_token(self, access_key):
         secret_key = "YOUR_SECRET_KEY"
         host = "https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id=" + access_key + "&client_secret=" + secret_key
-        response = requests.get(host)
-        if response:
-            print(response.json())
-            return response.json()["access_token"]
+        response = get_session(host).get(host)
+        res = response.json()
+        return res["access_token"], res.get("expires_in", 2592000)
@@ -1,12 +1,13 @@
 # encoding:utf-8
 
-import requests
 import json
 from common import const
 from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.credential_cache import get_credential, invalidate_credential
+from common.http_client import get_session
 from common.log import logger
 from config import conf
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
@@ -15,6 +16,7 @@ BAIDU_API_KEY = conf().get("baidu_wenxin_api_key")
 BAIDU_SECRET_KEY = conf().get("baidu_wenxin_secret_key")
 
 class BaiduWenxinBot(Bot):
+    session_history = True
 
     def __init__(self):
         super().__init__()
@@ -90,9 +92,12 @@ class BaiduWenxinBot(Bot):
                 'Content-Type': 'application/json'
             }
             payload = {'messages': session.messages, 'system': self.prompt} if self.prompt_enabled else {'messages': session.messages}
-            response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+            response = get_session(url).post(url, headers=headers, data=json.dumps(payload))
             response_text = json.loads(response.text)
             logger.info(f"[BAIDU] response text={response_text}")
+            if response_text.get("error_code") in (110, 111):
+                # access token无效或已过期，丢弃缓存，下次重新获取
+                invalidate_credential("baidu_wenxin", BAIDU_API_KEY)
             res_content = response_text["result"]
             total_tokens = response_text["usage"]["total_tokens"]
             completion_tokens = response_text["usage"]["completion_tokens"]
@@ -112,9 +117,19 @@ class BaiduWenxinBot(Bot):
 
     def get_access_token(self):
         """
-        使用 AK，SK 生成鉴权签名（Access Token）
+        使用 AK，SK 生成鉴权签名（Access Token），有效期内复用缓存
         :return: access_token，或是None(如果错误)
         """
+        try:
+            return get_credential("baidu_wenxin", BAIDU_API_KEY, self._fetch_access_token)
+        except Exception as e:
+            logger.warn("[BAIDU] fetch access token failed: {}".format(e))
+            return "None"
+
+    def _fetch_access_token(self):
         url = "https://aip.baidubce.com/oauth/2.0/token"
         params = {"grant_type": "client_credentials", "client_id": BAIDU_API_KEY, "client_secret": BAIDU_SECRET_KEY}
-        return str(requests.post(url, params=params).json().get("access_token"))
+        res = get_session(url).post(url, params=params).json()
+        if not res.get("access_token"):
+            raise Exception(res.get("error_description") or res)
+        return res["access_token"], res.get("expires_in", 2592000)
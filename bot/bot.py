@@ -6,6 +6,17 @@ from bridge.context import Context
 from bridge.reply import Reply
 
 class Bot(object):
+    # reply()是否按self.sessions(SessionManager)中的会话记录构建提示词；
+    # 为True时回复缓存按会话记录生成缓存键，命中时补写会话记录
+    session_history = False
+
+    def reply_cache_scope(self, context: Context):
+        """
+        影响回复、但不在会话记录和请求参数中的内容(如LinkAI按群选择的应用)，回复缓存将其加入缓存键
+        :return: 可序列化为JSON的值；返回False表示本次请求不能缓存
+        """
+        return None
+
     def reply(self, query, context: Context = None) -> Reply:
         """
         bot auto-reply content
@@ -14,3 +25,15 @@ class Bot(object):
         :return: reply content (Reply object)
         """
         raise NotImplementedError("子類別必須實作 reply 方法")
+
+    def reply_stream(self, query, context: Context = None):
+        """
+        bot streaming reply, yields incremental text chunks
+        the default implementation falls back to reply() and yields the whole content at once
+        :param query: received message
+        :param context: extra context info
+        :return: generator of str
+        """
+        reply = self.reply(query, context)
+        if reply and reply.content:
+            yield reply.content if isinstance(reply.content, str) else str(reply.content)
@@ -11,7 +11,7 @@ from bot.session_manager import SessionManager
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
-from common.token_bucket import TokenBucket
+from common.token_bucket import get_rate_limiter
 from config import conf
 
 class ChatGPTBot(Bot, OpenAIImage):
@@ -26,12 +26,17 @@ class ChatGPTBot(Bot, OpenAIImage):
         # 代理设置 (新版 SDK 格式)
         if conf().get("proxy"):
             self.client.proxy = {"http": conf().get("proxy"), "https": conf().get("proxy")}
-        # 限流配置
-        self.tb4chatgpt = None
-        if conf().get("rate_limit_chatgpt"):
-            self.tb4chatgpt = TokenBucket(conf().get("rate_limit_chatgpt", 20))
         # 模型配置
         conf_model = conf().get("model", "gpt-3.5-turbo")
+        # 限流配置，同一模型在进程内共享额度
+        self.tb4chatgpt = None
+        if conf().get("rate_limit_chatgpt") or conf().get("rate_limit_chatgpt_tpm"):
+            self.tb4chatgpt = get_rate_limiter(
+                "chatgpt:{}".format(conf_model),
+                rpm=conf().get("rate_limit_chatgpt"),
+                tpm=conf().get("rate_limit_chatgpt_tpm"),
+                timeout=conf().get("request_timeout"),
+            )
         self.sessions = SessionManager(ChatGPTSession, model=conf_model)
         # 请求参数模板
         self.args = {
@@ -48,41 +53,100 @@ class ChatGPTBot(Bot, OpenAIImage):
         覆蓋 Bot.reply，返回 Reply 物件
         """
         try:
-            # 構建對話歷史
-            messages = []
-            if context and hasattr(context, "history"):
-                messages = context.history
-            else:
-                messages = [{"role": "user", "content": query}]
+            if self.tb4chatgpt and not self.tb4chatgpt.acquire():
+                return Reply(ReplyType.ERROR, "请求过于频繁，请稍后再试")
+            messages = self._build_messages(query, context)
             # 合并请求参数
-            request_args = self.args.copy()
+            request_args = self._request_args(context)
             # 調用 OpenAI ChatCompletion
             response = self.client.chat.completions.create(
                 messages=messages,
                 **request_args
             )
+            self._record_usage(response)
             content = response.choices[0].message.content
             return Reply(ReplyType.TEXT, content)
-        except RateLimitError as e:
+        except Exception as e:
+            return Reply(ReplyType.ERROR, self._error_message(e))
+
+    def reply_stream(self, query, context: Context = None):
+        """
+        流式回复，逐段产出模型返回的增量文本
+        """
+        try:
+            if self.tb4chatgpt and not self.tb4chatgpt.acquire():
+                self._mark_error(context)
+                yield "请求过于频繁，请稍后再试"
+                return
+            messages = self._build_messages(query, context)
+            request_args = self._request_args(context)
+            if self.tb4chatgpt and self.tb4chatgpt.token_bucket:
+                # 流式响应默认不返回usage，限制TPM时需要显式请求
+                request_args["stream_options"] = {"include_usage": True}
+            response = self.client.chat.completions.create(
+                messages=messages,
+                stream=True,
+                **request_args
+            )
+            for chunk in response:
+                self._record_usage(chunk)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            self._mark_error(context)
+            yield self._error_message(e)
+
+    @staticmethod
+    def _mark_error(context: Context = None):
+        # 流式回复的错误提示和正常内容一样是文本片段，标记在context上，拼接成的回复不能写入回复缓存
+        if context is not None:
+            context["reply_error"] = True
+
+    def _record_usage(self, response):
+        # 按实际消耗的token扣除TPM额度
+        usage = getattr(response, "usage", None)
+        if self.tb4chatgpt and usage:
+            self.tb4chatgpt.record_usage(usage.total_tokens)
+
+    def _request_args(self, context: Context = None) -> dict:
+        # 插件或截止时间策略可以通过context指定模型和最大回复长度
+        request_args = self.args.copy()
+        if context:
+            if context.get("gpt_model"):
+                request_args["model"] = context.get("gpt_model")
+            if context.get("max_tokens"):
+                request_args["max_tokens"] = context.get("max_tokens")
+        return request_args
+
+    def _build_messages(self, query, context: Context = None) -> list:
+        # 構建對話歷史
+        if context and hasattr(context, "history"):
+            return context.history
+        return [{"role": "user", "content": query}]
+
+    def _error_message(self, e: Exception) -> str:
+        if isinstance(e, RateLimitError):
             logger.warning(f"[CHATGPT] 速率限制: {str(e)}")
-            return Reply(ReplyType.TEXT, "请求过于频繁，请稍后再试")
-        except APITimeoutError as e:
+            return "请求过于频繁，请稍后再试"
+        if isinstance(e, APITimeoutError):
             logger.warning(f"[CHATGPT] 请求超时: {str(e)}")
-            return Reply(ReplyType.TEXT, "请求超时，请重试")
-        except APIConnectionError as e:
+            return "请求超时，请重试"
+        if isinstance(e, APIConnectionError):
             logger.warning(f"[CHATGPT] 连接错误: {str(e)}")
-            return Reply(ReplyType.TEXT, "网络连接异常")
-        except APIError as e:
+            return "网络连接异常"
+        if isinstance(e, APIError):
             logger.error(f"[CHATGPT] API 错误: {str(e)}")
-            return Reply(ReplyType.TEXT, f"API 错误: {e.message}")
-        except Exception as e:
-            logger.exception(f"[CHATGPT] 未预期错误: {str(e)}")
-            return Reply(ReplyType.TEXT, "系统暂时不可用，请稍后再试")
+            return f"API 错误: {e.message}"
+        logger.exception(f"[CHATGPT] 未预期错误: {str(e)}")
+        return "系统暂时不可用，请稍后再试"
 
     def reply_text(self, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
         """（保留原本方法，供其他地方調用）"""
         try:
-            if self.tb4chatgpt and not self.tb4chatgpt.get_token():
+            if self.tb4chatgpt and not self.tb4chatgpt.acquire():
                 raise RateLimitError("Rate limit exceeded")
             request_args = self.args.copy()
             if args:
@@ -92,6 +156,7 @@ class ChatGPTBot(Bot, OpenAIImage):
                 messages=session.messages,
                 **request_args
             )
+            self._record_usage(response)
             return {
                 "total_tokens": response.usage.total_tokens,
                 "completion_tokens": response.usage.completion_tokens,
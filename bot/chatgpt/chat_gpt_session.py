@@ -1,3 +1,5 @@
+import threading
+
 from bot.session_manager import Session
 from common.log import logger
 from common import const
@@ -18,80 +20,114 @@ class ChatGPTSession(Session):
         self.model = model
         self.reset()
 
-    def discard_exceeding(self, max_tokens, cur_tokens=None):
-        precise = True
-        try:
-            cur_tokens = self.calc_tokens()
-        except Exception as e:
-            precise = False
-            if cur_tokens is None:
-                raise e
-            logger.debug("Exception when counting tokens precisely for query: {}".format(e))
-        while cur_tokens > max_tokens:
-            if len(self.messages) > 2:
-                self.messages.pop(1)
-            elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
-                if precise:
-                    cur_tokens = self.calc_tokens()
-                else:
-                    cur_tokens = cur_tokens - max_tokens
-                break
-            elif len(self.messages) == 2 and self.messages[1]["role"] == "user":
-                logger.warn("user message exceed max_tokens. total_tokens={}".format(cur_tokens))
-                break
-            else:
-                logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
-                break
-            if precise:
-                cur_tokens = self.calc_tokens()
-            else:
-                cur_tokens = cur_tokens - max_tokens
-        return cur_tokens
-
-    def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+    def count_tokens(self, messages):
+        return num_tokens_from_messages(messages, self.model)
 
 
-# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-def num_tokens_from_messages(messages, model):
-    """Returns the number of tokens used by a list of messages."""
+# 按字数粗略估算token数的模型
+CHARACTER_COUNT_MODELS = ["wenxin", "xunfei"]
+# 以下模型按 gpt-3.5-turbo 的规则计算token
+GPT35_TOKENIZER_MODELS = ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]
+# 以下模型按 gpt-4 的规则计算token
+GPT4_TOKENIZER_MODELS = ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
+                         "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
+                         "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
+                         const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO]
+
+
+class TokenizerSpec(object):
+    """模型对应的token计算规则，encoding为None时按字数估算"""
+
+    __slots__ = ("encoding", "tokens_per_message", "tokens_per_name")
+
+    def __init__(self, encoding=None, tokens_per_message=0, tokens_per_name=0):
+        self.encoding = encoding
+        self.tokens_per_message = tokens_per_message
+        self.tokens_per_name = tokens_per_name
+
+
+CHARACTER_SPEC = TokenizerSpec()
+
+# 进程内共享的编码器与模型规则缓存，避免每次计算token时重新加载
+_model_encodings = {}  # model -> tiktoken.Encoding
+_model_specs = {}  # model -> TokenizerSpec
+_registry_lock = threading.Lock()
 
-    if model in ["wenxin", "xunfei"] or model.startswith(const.GEMINI):
-        return num_tokens_by_character(messages)
 
+def get_encoding_for_model(model):
+    encoding = _model_encodings.get(model)
+    if encoding is not None:
+        return encoding
     import tiktoken
 
-    if model in ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    elif model in ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
-                   "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
-                   "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
-                   const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO]:
-        return num_tokens_from_messages(messages, model="gpt-4")
-    elif model.startswith("claude-3"):
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        logger.debug("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model == "gpt-3.5-turbo":
-        tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_name = -1  # if there's a name, the role is omitted
+    with _registry_lock:
+        encoding = _model_encodings.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                logger.debug("Warning: model not found. Using cl100k_base encoding.")
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _model_encodings[model] = encoding
+    return encoding
+
+
+def resolve_tokenizer(model) -> TokenizerSpec:
+    """解析模型对应的token计算规则，每个模型只解析一次"""
+    spec = _model_specs.get(model)
+    if spec is not None:
+        return spec
+    if model in CHARACTER_COUNT_MODELS or model.startswith(const.GEMINI):
+        spec = CHARACTER_SPEC
+    elif model in GPT35_TOKENIZER_MODELS or model.startswith("claude-3"):
+        spec = resolve_tokenizer("gpt-3.5-turbo")
+    elif model in GPT4_TOKENIZER_MODELS:
+        spec = resolve_tokenizer("gpt-4")
+    elif model == "gpt-3.5-turbo":
+        # every message follows <|start|>{role/name}\n{content}<|end|>\n
+        # if there's a name, the role is omitted
+        spec = TokenizerSpec(get_encoding_for_model(model), tokens_per_message=4, tokens_per_name=-1)
     elif model == "gpt-4":
-        tokens_per_message = 3
-        tokens_per_name = 1
+        spec = TokenizerSpec(get_encoding_for_model(model), tokens_per_message=3, tokens_per_name=1)
     else:
         logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        spec = resolve_tokenizer("gpt-3.5-turbo")
+    _model_specs[model] = spec
+    return spec
+
+
+def preload_tokenizers(models=None):
+    """
+    预加载模型对应的BPE编码文件，避免首条消息时才下载/解析
+    :param models: 需要预加载的模型列表，默认为配置中的模型
+    """
+    from config import conf
+
+    models = models or [conf().get("model") or const.GPT35]
+    for model in models:
+        try:
+            spec = resolve_tokenizer(model)
+            if spec.encoding is not None:
+                spec.encoding.encode("")
+            logger.info("[ChatGPTSession] tokenizer preloaded for model {}".format(model))
+        except Exception as e:
+            logger.warn("[ChatGPTSession] preload tokenizer failed, model={}, error={}".format(model, e))
+
+
+# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+def num_tokens_from_messages(messages, model):
+    """Returns the number of tokens used by a list of messages."""
+    spec = resolve_tokenizer(model)
+    if spec.encoding is None:
+        return num_tokens_by_character(messages)
+    encode = spec.encoding.encode
     num_tokens = 0
     for message in messages:
-        num_tokens += tokens_per_message
+        num_tokens += spec.tokens_per_message
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            num_tokens += len(encode(value))
             if key == "name":
-                num_tokens += tokens_per_name
+                num_tokens += spec.tokens_per_name
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
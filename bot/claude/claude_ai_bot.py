@@ -14,6 +14,8 @@ from config import conf
 
 
 class ClaudeAIBot(Bot, OpenAIImage):
+    session_history = True
+
     def __init__(self):
         super().__init__()
         self.sessions = SessionManager(ClaudeAiSession, model=conf().get("model") or "gpt-3.5-turbo")
@@ -21,6 +21,8 @@ user_session = dict()
 
 # OpenAI对话模型API (可用)
 class ClaudeAPIBot(Bot, OpenAIImage):
+    session_history = True
+
     def __init__(self):
         super().__init__()
         proxy = conf().get("proxy", None)
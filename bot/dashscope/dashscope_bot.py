@@ -21,6 +21,8 @@ dashscope_models = {
 }
 # ZhipuAI对话模型API
 class DashscopeBot(Bot):
+    session_history = True
+
     def __init__(self):
         super().__init__()
         self.sessions = SessionManager(DashscopeSession, model=conf().get("model") or "qwen-plus")
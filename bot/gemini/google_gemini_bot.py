@@ -20,6 +20,7 @@ from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
 # OpenAI对话模型API (可用)
 class GoogleGeminiBot(Bot):
+    session_history = True
 
     def __init__(self):
         super().__init__()
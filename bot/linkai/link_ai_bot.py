@@ -3,13 +3,13 @@
 
 import re
 import time
-import requests
 import config
 from bot.bot import Bot
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
 from bot.session_manager import SessionManager
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
+from common.http_client import get_session
 from common.log import logger
 from config import conf, pconf
 import threading
@@ -21,6 +21,7 @@ class LinkAIBot(Bot):
     # authentication failed
     AUTH_FAILED_CODE = 401
     NO_QUOTA_CODE = 406
+    session_history = True
 
     def __init__(self):
         super().__init__()
@@ -55,16 +56,13 @@ class LinkAIBot(Bot):
         if retry_count > 2:
             # exit from retry 2 times
             logger.warn("[LINKAI] failed after maximum number of retry times")
-            return Reply(ReplyType.TEXT, "请再问我一次吧")
+            return Reply(ReplyType.ERROR, "请再问我一次吧")
 
         try:
             # load config
             if context.get("generate_breaked_by"):
                 logger.info(f"[LINKAI] won't set appcode because a plugin ({context['generate_breaked_by']}) affected the context")
-                app_code = None
-            else:
-                plugin_app_code = self._find_group_mapping_code(context)
-                app_code = context.kwargs.get("app_code") or plugin_app_code or conf().get("linkai_app_code")
+            app_code = self._app_code(context)
             linkai_api_key = conf().get("linkai_api_key")
 
             session_id = context["session_id"]
@@ -123,8 +121,8 @@ class LinkAIBot(Bot):
 
             # do http request
             base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
-            res = requests.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
-                                timeout=conf().get("request_timeout", 180))
+            res = get_session(base_url).post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
+                                             timeout=conf().get("request_timeout", 180))
             if res.status_code == 200:
                 # execute success
                 response = res.json()
@@ -134,6 +132,8 @@ class LinkAIBot(Bot):
                 logger.info(f"[LINKAI] reply={reply_content}, total_tokens={total_tokens}, res_code={res_code}")
                 if res_code == 429:
                     logger.warn(f"[LINKAI] 用户访问超出限流配置，sender_id={body.get('sender_id')}")
+                    # 限流提示不能写入回复缓存
+                    context["reply_error"] = True
                 else:
                     self.sessions.session_reply(reply_content, session_id, total_tokens, query=query)
                 agent_suffix = self._fetch_agent_suffix(response)
@@ -167,7 +167,7 @@ class LinkAIBot(Bot):
                 error_reply = "提问太快啦，请休息一下再问我吧"
                 if res.status_code == 409:
                     error_reply = "这个问题我还没有学会，请问我其它问题吧"
-                return Reply(ReplyType.TEXT, error_reply)
+                return Reply(ReplyType.ERROR, error_reply)
 
         except Exception as e:
             logger.exception(e)
@@ -199,6 +199,19 @@ class LinkAIBot(Bot):
         except Exception as e:
             logger.exception(e)
 
+    def reply_cache_scope(self, context: Context):
+        if memory.USER_IMAGE_CACHE.get(context.get("session_id")):
+            # 本次提问会带上用户刚发的图片，回复不能复用
+            return False
+        # 不同群可能对应不同的应用
+        return self._app_code(context)
+
+    def _app_code(self, context: Context):
+        if context.get("generate_breaked_by"):
+            return None
+        plugin_app_code = self._find_group_mapping_code(context)
+        return context.kwargs.get("app_code") or plugin_app_code or conf().get("linkai_app_code")
+
     def _find_group_mapping_code(self, context):
         try:
             if context.kwargs.get("isgroup"):
@@ -262,8 +275,8 @@ class LinkAIBot(Bot):
 
             # do http request
             base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
-            res = requests.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
-                                timeout=conf().get("request_timeout", 180))
+            res = get_session(base_url).post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
+                                             timeout=conf().get("request_timeout", 180))
             if res.status_code == 200:
                 # execute success
                 response = res.json()
@@ -306,7 +319,7 @@ class LinkAIBot(Bot):
         # do http request
         base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
         params = {"app_code": app_code}
-        res = requests.get(url=base_url + "/v1/app/info", params=params, headers=headers, timeout=(5, 10))
+        res = get_session(base_url).get(url=base_url + "/v1/app/info", params=params, headers=headers, timeout=(5, 10))
         if res.status_code == 200:
             return res.json()
         else:
@@ -327,7 +340,7 @@ class LinkAIBot(Bot):
                 "img_proxy": conf().get("image_proxy")
             }
             url = conf().get("linkai_api_base", "https://api.link-ai.tech") + "/v1/images/generations"
-            res = requests.post(url, headers=headers, json=data, timeout=(5, 90))
+            res = get_session(url).post(url, headers=headers, json=data, timeout=(5, 90))
             t2 = time.time()
             image_url = res.json()["data"][0]["url"]
             logger.info("[OPEN_AI] image_url={}".format(image_url))
@@ -430,7 +443,7 @@ def _download_file(url: str):
             os.makedirs(file_path)
         file_name = url.split("/")[-1]  # 获取文件名
         file_path = os.path.join(file_path, file_name)
-        response = requests.get(url)
+        response = get_session().get(url)
         with open(file_path, "wb") as f:
             f.write(response.content)
         return file_path
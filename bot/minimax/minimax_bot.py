@@ -9,15 +9,17 @@ from bot.minimax.minimax_session import MinimaxSession
 from bot.session_manager import SessionManager
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
+from common.http_client import get_session
 from common.log import logger
 from config import conf, load_config
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
-import requests
 from common import const
 
 
 # ZhipuAI对话模型API
 class MinimaxBot(Bot):
+    session_history = True
+
     def __init__(self):
         super().__init__()
         self.args = {
@@ -107,7 +109,7 @@ class MinimaxBot(Bot):
             self.request_body["messages"].extend(session.messages)
             logger.info("[Minimax_AI] request_body={}".format(self.request_body))
             # logger.info("[Minimax_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(self.base_url, headers=headers, json=self.request_body)
+            res = get_session(self.base_url).post(self.base_url, headers=headers, json=self.request_body)
 
             # self.request_body["messages"].extend(response.json()["choices"][0]["messages"])
             if res.status_code == 200:
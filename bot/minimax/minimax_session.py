@@ -1,5 +1,4 @@
 from bot.session_manager import Session
-from common.log import logger
 
 """
     e.g.
@@ -26,39 +25,11 @@ class MinimaxSession(Session):
         assistant_item = {"sender_type": "BOT", "sender_name": "MM智能助理", "text": reply}
         self.messages.append(assistant_item)
 
-    def discard_exceeding(self, max_tokens, cur_tokens=None):
-        precise = True
-        try:
-            cur_tokens = self.calc_tokens()
-        except Exception as e:
-            precise = False
-            if cur_tokens is None:
-                raise e
-            logger.debug("Exception when counting tokens precisely for query: {}".format(e))
-        while cur_tokens > max_tokens:
-            if len(self.messages) > 2:
-                self.messages.pop(1)
-            elif len(self.messages) == 2 and self.messages[1]["sender_type"] == "BOT":
-                self.messages.pop(1)
-                if precise:
-                    cur_tokens = self.calc_tokens()
-                else:
-                    cur_tokens = cur_tokens - max_tokens
-                break
-            elif len(self.messages) == 2 and self.messages[1]["sender_type"] == "USER":
-                logger.warn("user message exceed max_tokens. total_tokens={}".format(cur_tokens))
-                break
-            else:
-                logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
-                break
-            if precise:
-                cur_tokens = self.calc_tokens()
-            else:
-                cur_tokens = cur_tokens - max_tokens
-        return cur_tokens
+    def message_role(self, message):
+        return {"USER": "user", "BOT": "assistant"}.get(message.get("sender_type"))
 
-    def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+    def count_tokens(self, messages):
+        return num_tokens_from_messages(messages, self.model)
 
 
 def num_tokens_from_messages(messages, model):
@@ -8,14 +8,17 @@ from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.http_client import get_session
 from common.log import logger
+from common.utils import iter_sse_chat_deltas
 from config import conf, load_config
 from .modelscope_session import ModelScopeSession
-import requests
 
 
 # ModelScope对话模型API
 class ModelScopeBot(Bot):
+    session_history = True
+
     def __init__(self):
         super().__init__()
         self.sessions = SessionManager(ModelScopeSession, model=conf().get("model") or "Qwen/Qwen2.5-7B-Instruct")
@@ -99,6 +102,42 @@ class ModelScopeBot(Bot):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    def reply_stream(self, query, context=None):
+        """
+        流式回复，逐段产出增量文本；清除记忆等指令和非文本消息退化为非流式处理
+        """
+        if context.type != ContextType.TEXT or query.startswith("#"):
+            yield from super().reply_stream(query, context)
+            return
+        session_id = context["session_id"]
+        session = self.sessions.session_query(query, session_id)
+        body = self.args.copy()
+        model = context.get("modelscope_model")
+        if model:
+            body["model"] = model
+        body["messages"] = session.messages
+        body["stream"] = True
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + self.api_key
+        }
+        try:
+            res = get_session(self.base_url).post(self.base_url, headers=headers, data=json.dumps(body), stream=True)
+        except Exception as e:
+            logger.exception(e)
+            yield "我现在有点累了，等会再来吧"
+            return
+        if res.status_code != 200:
+            logger.error(f"[MODELSCOPE_AI] chat stream failed, status_code={res.status_code}, body={res.text}")
+            yield "授权失败，请检查API Key是否正确" if res.status_code == 401 else "提问太快啦，请休息一下再问我吧"
+            return
+        content = ""
+        for delta in iter_sse_chat_deltas(res):
+            content += delta
+            yield delta
+        if content:
+            self.sessions.session_reply(content, session_id)
+
     def reply_text(self, session: ModelScopeSession, args=None, retry_count=0) -> dict:
         """
         call openai's ChatCompletion to get the answer
@@ -115,7 +154,7 @@ class ModelScopeBot(Bot):
             
             body = args
             body["messages"] = session.messages
-            res = requests.post(
+            res = get_session(self.base_url).post(
                 self.base_url,
                 headers=headers,
                 data=json.dumps(body)
@@ -185,25 +224,14 @@ class ModelScopeBot(Bot):
             body["messages"] = session.messages
             body["stream"] = True  # 启用流式响应
 
-            res = requests.post(
+            res = get_session(self.base_url).post(
                 self.base_url,
                 headers=headers,
                 data=json.dumps(body),
                 stream=True
             )
             if res.status_code == 200:
-                content = ""
-                for line in res.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith("data: "):
-                            try:
-                                json_data = json.loads(decoded_line[6:])
-                                delta_content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                                if delta_content:
-                                    content += delta_content
-                            except json.JSONDecodeError as e:
-                                pass
+                content = "".join(iter_sse_chat_deltas(res))
                 return {
                     "total_tokens": 1,  # 流式响应通常不返回token使用情况
                     "completion_tokens": 1,
@@ -265,7 +293,7 @@ class ModelScopeBot(Bot):
             json_payload = json.dumps(payload, ensure_ascii=False).encode('utf-8')
             
             # 使用 data 参数发送原始字符串（requests 会自动处理编码）
-            res = requests.post(url, headers=headers, data=json_payload)
+            res = get_session(url).post(url, headers=headers, data=json_payload)
             
             response_data = res.json()
             image_url = response_data['images'][0]['url']
@@ -8,14 +8,16 @@ from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.http_client import get_session
 from common.log import logger
 from config import conf, load_config
 from .moonshot_session import MoonshotSession
-import requests
 
 
 # ZhipuAI对话模型API
 class MoonshotBot(Bot):
+    session_history = True
+
     def __init__(self):
         super().__init__()
         self.sessions = SessionManager(MoonshotSession, model=conf().get("model") or "moonshot-v1-128k")
@@ -99,7 +101,7 @@ class MoonshotBot(Bot):
             body["messages"] = session.messages
             # logger.debug("[MOONSHOT_AI] response={}".format(response))
             # logger.info("[MOONSHOT_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(
+            res = get_session(self.base_url).post(
                 self.base_url,
                 headers=headers,
                 json=body
@@ -19,6 +19,8 @@ user_session = dict()
 
 # OpenAI对话模型API (可用)
 class OpenAIBot(Bot, OpenAIImage):
+    session_history = True
+
     def __init__(self):
         super().__init__()
         openai.api_key = conf().get("open_ai_api_key")
@@ -5,7 +5,7 @@ import time
 import requests
 from openai import OpenAI, APIError, APITimeoutError, APIConnectionError, RateLimitError
 from common.log import logger
-from common.token_bucket import TokenBucket
+from common.token_bucket import get_rate_limiter
 from config import conf
 
 class OpenAIImage:
@@ -19,11 +19,13 @@ class OpenAIImage:
         if conf().get("proxy"):
             self.client.proxy = conf().get("proxy")
 
-        self.tb4image = TokenBucket(conf().get("rate_limit_dalle", 50)) if conf().get("rate_limit_dalle") else None
+        self.tb4image = None
+        if conf().get("rate_limit_dalle"):
+            self.tb4image = get_rate_limiter("dalle", rpm=conf().get("rate_limit_dalle", 50), timeout=conf().get("request_timeout"))
 
     def create_img(self, query, retry_count=0):
         try:
-            if self.tb4image and not self.tb4image.get_token():
+            if self.tb4image and not self.tb4image.acquire():
                 raise RateLimitError("DALL-E API rate limit exceeded")
 
             response = self.client.images.generate(
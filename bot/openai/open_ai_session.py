@@ -66,8 +66,8 @@ class OpenAISession(Session):
 # refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 def num_tokens_from_string(string: str, model: str) -> int:
     """Returns the number of tokens in a text string."""
-    import tiktoken
+    from bot.chatgpt.chat_gpt_session import get_encoding_for_model
 
-    encoding = tiktoken.encoding_for_model(model)
+    encoding = get_encoding_for_model(model)
     num_tokens = len(encoding.encode(string, disallowed_special=()))
     return num_tokens
@@ -7,6 +7,9 @@ class Session(object):
     def __init__(self, session_id, system_prompt=None):
         self.session_id = session_id
         self.messages = []
+        # 单条消息的token数缓存，id(message) -> (message, 消息内容快照, token数)
+        self._token_cache = {}
+        self._base_tokens = None
         if system_prompt is None:
             self.system_prompt = conf().get("character_desc", "")
         else:
@@ -16,6 +19,7 @@ class Session(object):
     def reset(self):
         system_item = {"role": "system", "content": self.system_prompt}
         self.messages = [system_item]
+        self._token_cache.clear()
 
     def set_system_prompt(self, system_prompt):
         self.system_prompt = system_prompt
@@ -29,10 +33,74 @@ class Session(object):
         assistant_item = {"role": "assistant", "content": reply}
         self.messages.append(assistant_item)
 
-    def discard_exceeding(self, max_tokens=None, cur_tokens=None):
-        raise NotImplementedError
+    def message_role(self, message) -> str:
+        return message.get("role")
+
+    def discard_exceeding(self, max_tokens, cur_tokens=None):
+        """
+        丢弃最早的历史消息(保留第一条)，直到token数不超过max_tokens
+        token数按消息缓存，丢弃时直接减去被丢弃消息的token数，不需要重新编码整个会话
+        """
+        precise = True
+        try:
+            cur_tokens = self.calc_tokens()
+        except Exception as e:
+            precise = False
+            if cur_tokens is None:
+                raise e
+            logger.debug("Exception when counting tokens precisely for query: {}".format(e))
+        while cur_tokens > max_tokens:
+            if len(self.messages) > 2:
+                removed = self.messages.pop(1)
+            elif len(self.messages) == 2 and self.message_role(self.messages[1]) == "assistant":
+                removed = self.messages.pop(1)
+                cur_tokens = self._discount(cur_tokens, removed, max_tokens, precise)
+                break
+            elif len(self.messages) == 2 and self.message_role(self.messages[1]) == "user":
+                logger.warn("user message exceed max_tokens. total_tokens={}".format(cur_tokens))
+                break
+            else:
+                logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
+                break
+            cur_tokens = self._discount(cur_tokens, removed, max_tokens, precise)
+        return cur_tokens
+
+    def _discount(self, cur_tokens, removed, max_tokens, precise):
+        if not precise:
+            return cur_tokens - max_tokens
+        cached = self._token_cache.pop(id(removed), None)
+        if cached is not None and cached[0] is removed:
+            return cur_tokens - cached[2]
+        return cur_tokens - self.count_tokens([removed]) + self.base_tokens()
 
     def calc_tokens(self):
+        if len(self._token_cache) > 2 * len(self.messages) + 8:
+            # 消息被外部直接修改过，清理已不在会话中的缓存
+            alive = {id(message) for message in self.messages}
+            self._token_cache = {k: v for k, v in self._token_cache.items() if k in alive}
+        return self.base_tokens() + sum(self.message_tokens(message) for message in self.messages)
+
+    def message_tokens(self, message) -> int:
+        """单条消息的token数，首次计算后缓存，消息内容被修改时重新计算"""
+        snapshot = tuple(message.values())
+        cached = self._token_cache.get(id(message))
+        if cached is not None and cached[0] is message and cached[1] == snapshot:
+            return cached[2]
+        tokens = self.count_tokens([message]) - self.base_tokens()
+        self._token_cache[id(message)] = (message, snapshot, tokens)
+        return tokens
+
+    def base_tokens(self) -> int:
+        """与消息数量无关的固定token开销"""
+        if self._base_tokens is None:
+            self._base_tokens = self.count_tokens([])
+        return self._base_tokens
+
+    def count_tokens(self, messages) -> int:
+        """
+        按模型规则计算一组消息的token数，由子类实现
+        :param messages: 消息列表
+        """
         raise NotImplementedError
 
 
@@ -0,0 +1,122 @@
+# encoding:utf-8
+"""
+本地模拟的星火websocket服务，按星火协议分帧返回固定内容，用于在不调用真实接口的情况下验证XunFeiBot
+
+用法:
+    python -m bot.xunfei.spark_stub_server --port 8765 --chunks 5 --delay 0.05
+然后在config.json中设置:
+    "xunfei_spark_url": "ws://127.0.0.1:8765/v3.5/chat"
+    "xunfei_app_id"、"xunfei_api_key"、"xunfei_api_secret" 填任意非空值
+"""
+import argparse
+import base64
+import hashlib
+import json
+import socketserver
+import struct
+import time
+
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _recv_exact(rfile, n):
+    data = rfile.read(n)
+    if len(data) < n:
+        raise ConnectionError("connection closed")
+    return data
+
+
+def _read_frame(rfile):
+    b1, b2 = _recv_exact(rfile, 2)
+    opcode = b1 & 0x0F
+    length = b2 & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", _recv_exact(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", _recv_exact(rfile, 8))[0]
+    mask = _recv_exact(rfile, 4) if b2 & 0x80 else None
+    payload = _recv_exact(rfile, length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+def _write_frame(wfile, payload: bytes, opcode=0x1):
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack(">H", length)
+    else:
+        header += bytes([127]) + struct.pack(">Q", length)
+    wfile.write(header + payload)
+    wfile.flush()
+
+
+def _spark_frame(sid, content, seq, status, usage=None):
+    data = {
+        "header": {"code": 0, "message": "Success", "sid": sid, "status": status},
+        "payload": {"choices": {"status": status, "seq": seq, "text": [{"content": content, "role": "assistant", "index": 0}]}},
+    }
+    if usage:
+        data["payload"]["usage"] = {"text": usage}
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+class SparkStubHandler(socketserver.StreamRequestHandler):
+    chunks = 5
+    delay = 0.05
+
+    def handle(self):
+        headers = {}
+        self.rfile.readline()
+        while True:
+            line = self.rfile.readline().decode("latin-1").strip()
+            if not line:
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + _GUID).encode()).digest()).decode()
+        self.wfile.write(
+            ("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+             "Sec-WebSocket-Accept: {}\r\n\r\n").format(accept).encode()
+        )
+        self.wfile.flush()
+        opcode, payload = _read_frame(self.rfile)
+        if opcode != 0x1:
+            return
+        request = json.loads(payload)
+        messages = request["payload"]["message"]["text"]
+        question = messages[-1]["content"] if messages else ""
+        sid = "stub{}".format(int(time.time() * 1000))
+        for seq in range(self.chunks):
+            time.sleep(self.delay)
+            status = 0 if seq == 0 else 1
+            usage = None
+            if seq == self.chunks - 1:
+                status = 2
+                prompt_tokens = sum(len(m.get("content", "")) for m in messages)
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": self.chunks,
+                         "total_tokens": prompt_tokens + self.chunks}
+            _write_frame(self.wfile, _spark_frame(sid, "[{}:{}]".format(question, seq), seq, status, usage))
+        _write_frame(self.wfile, struct.pack(">H", 1000), opcode=0x8)
+
+
+class SparkStubServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="local stand-in for the XunFei Spark websocket API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chunks", type=int, default=5, help="每个回复拆分的帧数")
+    parser.add_argument("--delay", type=float, default=0.05, help="每帧之间的间隔，单位秒")
+    args = parser.parse_args()
+    SparkStubHandler.chunks = args.chunks
+    SparkStubHandler.delay = args.delay
+    with SparkStubServer((args.host, args.port), SparkStubHandler) as server:
+        print("spark stub listening on ws://{}:{}/v3.5/chat".format(args.host, args.port))
+        server.serve_forever()
@@ -1,6 +1,5 @@
 # encoding:utf-8
 
-import requests, json
 from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
@@ -10,8 +9,6 @@ from common.log import logger
 from config import conf
 from common import const
 import time
-import _thread as thread
-import datetime
 from datetime import datetime
 from wsgiref.handlers import format_date_time
 from urllib.parse import urlencode
@@ -23,18 +20,12 @@ import json
 from time import mktime
 from urllib.parse import urlparse
 import websocket
-import queue
 import threading
-import random
-
-# 消息队列 map
-queue_map = dict()
-
-# 响应队列 map
-reply_map = dict()
 
 
 class XunFeiBot(Bot):
+    session_history = True
+
     def __init__(self):
         super().__init__()
         self.app_id = conf().get("xunfei_app_id")
@@ -54,76 +45,93 @@ class XunFeiBot(Bot):
         self.path = urlparse(self.spark_url).path
         # 和wenxin使用相同的session机制
         self.sessions = SessionManager(ChatGPTSession, model=const.XUNFEI)
+        self.timeout = conf().get("request_timeout", 180)
+        # 同时打开的websocket会话数上限
+        self.session_limit = threading.BoundedSemaphore(conf().get("xunfei_max_sessions", 8))
 
     def reply(self, query, context: Context = None) -> Reply:
         if context.type == ContextType.TEXT:
             logger.info("[XunFei] query={}".format(query))
             session_id = context["session_id"]
-            request_id = self.gen_request_id(session_id)
-            reply_map[request_id] = ""
             session = self.sessions.session_query(query, session_id)
-            threading.Thread(target=self.create_web_socket,
-                             args=(session.messages, request_id)).start()
-            depth = 0
-            time.sleep(0.1)
             t1 = time.time()
+            content = ""
             usage = {}
-            while depth <= 300:
-                try:
-                    data_queue = queue_map.get(request_id)
-                    if not data_queue:
-                        depth += 1
-                        time.sleep(0.1)
-                        continue
-                    data_item = data_queue.get(block=True, timeout=0.1)
-                    if data_item.is_end:
-                        # 请求结束
-                        del queue_map[request_id]
-                        if data_item.reply:
-                            reply_map[request_id] += data_item.reply
-                        usage = data_item.usage
-                        break
-
-                    reply_map[request_id] += data_item.reply
-                    depth += 1
-                except Exception as e:
-                    depth += 1
-                    continue
+            try:
+                for item in self.stream_chat(session.messages):
+                    content += item.reply
+                    if item.is_end:
+                        usage = item.usage
+            except Exception as e:
+                logger.error("[XunFei] chat failed: {}".format(e))
+                if not content:
+                    return Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
             t2 = time.time()
-            logger.info(
-                f"[XunFei-API] response={reply_map[request_id]}, time={t2 - t1}s, usage={usage}"
-            )
-            self.sessions.session_reply(reply_map[request_id], session_id,
-                                        usage.get("total_tokens"))
-            reply = Reply(ReplyType.TEXT, reply_map[request_id])
-            del reply_map[request_id]
-            return reply
+            logger.info(f"[XunFei-API] response={content}, time={t2 - t1}s, usage={usage}")
+            self.sessions.session_reply(content, session_id, usage.get("total_tokens"))
+            return Reply(ReplyType.TEXT, content)
         else:
             reply = Reply(ReplyType.ERROR,
                           "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def create_web_socket(self, prompt, session_id, temperature=0.5):
-        logger.info(f"[XunFei] start connect, prompt={prompt}")
-        websocket.enableTrace(False)
-        wsUrl = self.create_url()
-        ws = websocket.WebSocketApp(wsUrl,
-                                    on_message=on_message,
-                                    on_error=on_error,
-                                    on_close=on_close,
-                                    on_open=on_open)
-        data_queue = queue.Queue(1000)
-        queue_map[session_id] = data_queue
-        ws.appid = self.app_id
-        ws.question = prompt
-        ws.domain = self.domain
-        ws.session_id = session_id
-        ws.temperature = temperature
-        ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
-
-    def gen_request_id(self, session_id: str):
-        return session_id + "_" + str(int(time.time())) + "" + str(
-            random.randint(0, 100))
+    def reply_stream(self, query, context: Context = None):
+        """
+        流式回复，星火每返回一帧就产出一段增量文本
+        """
+        if context.type != ContextType.TEXT or query.startswith("#"):
+            yield from super().reply_stream(query, context)
+            return
+        session_id = context["session_id"]
+        session = self.sessions.session_query(query, session_id)
+        content = ""
+        usage = {}
+        try:
+            for item in self.stream_chat(session.messages):
+                if item.is_end:
+                    usage = item.usage
+                if item.reply:
+                    content += item.reply
+                    yield item.reply
+        except Exception as e:
+            logger.error("[XunFei] chat stream failed: {}".format(e))
+            if not content:
+                yield "我现在有点累了，等会再来吧"
+                return
+        if content:
+            self.sessions.session_reply(content, session_id, usage.get("total_tokens"))
+
+    def stream_chat(self, messages, temperature=0.5):
+        """
+        建立一次websocket会话，按到达顺序产出ReplyItem，收到结束帧(status=2)后返回
+        在调用方线程上阻塞读取，不再为每个请求单独起线程轮询结果队列
+        同时进行的会话数受xunfei_max_sessions限制，超出时等待其他会话结束
+        """
+        if not self.session_limit.acquire(timeout=self.timeout):
+            raise Exception("too many concurrent websocket sessions")
+        ws = None
+        try:
+            logger.debug(f"[XunFei] start connect, prompt={messages}")
+            ws = websocket.create_connection(self.create_url(), timeout=self.timeout,
+                                             sslopt={"cert_reqs": ssl.CERT_NONE})
+            ws.send(json.dumps(gen_params(appid=self.app_id, domain=self.domain,
+                                          question=messages, temperature=temperature)))
+            while True:
+                data = json.loads(ws.recv())
+                code = data["header"]["code"]
+                if code != 0:
+                    raise Exception(f"请求错误: {code}, {data}")
+                choices = data["payload"]["choices"]
+                content = choices["text"][0]["content"]
+                if choices["status"] == 2:
+                    usage = data["payload"].get("usage") or {}
+                    yield ReplyItem(content, usage.get("text", usage), is_end=True)
+                    return
+                yield ReplyItem(content)
+        finally:
+            if ws is not None:
+                ws.close()
+            self.session_limit.release()
 
     # 生成url
     def create_url(self):
@@ -157,89 +165,12 @@ class XunFeiBot(Bot):
         # 此处打印出建立连接时候的url,参考本demo的时候可取消上方打印的注释，比对相同参数时生成的url与自己代码生成的url是否一致
         return url
 
-    def gen_params(self, appid, domain, question):
-        """
-        通过appid和用户的提问来生成请参数
-        """
-        data = {
-            "header": {
-                "app_id": appid,
-                "uid": "1234"
-            },
-            "parameter": {
-                "chat": {
-                    "domain": domain,
-                    "random_threshold": 0.5,
-                    "max_tokens": 2048,
-                    "auditing": "default"
-                }
-            },
-            "payload": {
-                "message": {
-                    "text": question
-                }
-            }
-        }
-        return data
-
 
 class ReplyItem:
     def __init__(self, reply, usage=None, is_end=False):
         self.is_end = is_end
         self.reply = reply
-        self.usage = usage
-
-
-# 收到websocket错误的处理
-def on_error(ws, error):
-    logger.error(f"[XunFei] error: {str(error)}")
-
-
-# 收到websocket关闭的处理
-def on_close(ws, one, two):
-    data_queue = queue_map.get(ws.session_id)
-    data_queue.put("END")
-
-
-# 收到websocket连接建立的处理
-def on_open(ws):
-    logger.info(f"[XunFei] Start websocket, session_id={ws.session_id}")
-    thread.start_new_thread(run, (ws, ))
-
-
-def run(ws, *args):
-    data = json.dumps(
-        gen_params(appid=ws.appid,
-                   domain=ws.domain,
-                   question=ws.question,
-                   temperature=ws.temperature))
-    ws.send(data)
-
-
-# Websocket 操作
-# 收到websocket消息的处理
-def on_message(ws, message):
-    data = json.loads(message)
-    code = data['header']['code']
-    if code != 0:
-        logger.error(f'请求错误: {code}, {data}')
-        ws.close()
-    else:
-        choices = data["payload"]["choices"]
-        status = choices["status"]
-        content = choices["text"][0]["content"]
-        data_queue = queue_map.get(ws.session_id)
-        if not data_queue:
-            logger.error(
-                f"[XunFei] can't find data queue, session_id={ws.session_id}")
-            return
-        reply_item = ReplyItem(content)
-        if status == 2:
-            usage = data["payload"].get("usage")
-            reply_item = ReplyItem(content, usage)
-            reply_item.is_end = True
-            ws.close()
-        data_queue.put(reply_item)
+        self.usage = usage or {}
 
 
 def gen_params(appid, domain, question, temperature=0.5):
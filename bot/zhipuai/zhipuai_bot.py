@@ -17,6 +17,8 @@ from zhipuai import ZhipuAI
 
 # ZhipuAI对话模型API
 class ZHIPUAIBot(Bot, ZhipuAIImage):
+    session_history = True
+
     def __init__(self):
         super().__init__()
         self.sessions = SessionManager(ZhipuAISession, model=conf().get("model") or "ZHIPU_AI")
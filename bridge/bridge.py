@@ -1,6 +1,8 @@
 from bot.bot_factory import create_bot
 from bridge.context import Context
+from bridge.deadline_policy import get_deadline_policy
 from bridge.reply import Reply
+from bridge.reply_cache import get_reply_cache
 from common import const
 from common.log import logger
 from common.singleton import singleton
@@ -83,7 +85,21 @@ class Bridge(object):
         return self.btype[typename]
 
     def fetch_reply_content(self, query, context: Context) -> Reply:
-        return self.get_bot("chat").reply(query, context)
+        bot = self.get_bot("chat")
+        # 通道设置了截止时间时，按剩余时间选择模型，必要时先返回部分回复
+        deadline_policy = get_deadline_policy()
+        deadline_policy.apply(context)
+        reply_cache = get_reply_cache()
+        if reply_cache is None:
+            return deadline_policy.reply(bot, query, context)
+        return reply_cache.fetch(self.btype["chat"], bot, query, context, lambda: deadline_policy.reply(bot, query, context))
+
+    def fetch_reply_stream(self, query, context: Context):
+        """
+        流式获取回复，返回逐段产出文本片段的生成器
+        不支持流式的bot会退化为一次性产出完整回复
+        """
+        return self.get_bot("chat").reply_stream(query, context)
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
         return self.get_bot("voice_to_text").voiceToText(voiceFile)
@@ -24,10 +24,11 @@ class ContextType(Enum):
 
 
 class Context:
-    def __init__(self, type: ContextType = None, content=None, kwargs=dict()):
+    def __init__(self, type: ContextType = None, content=None, kwargs=None):
         self.type = type
         self.content = content
-        self.kwargs = kwargs
+        # 默认值不能是共享的dict，否则并发处理的消息会互相覆盖session_id等属性
+        self.kwargs = kwargs if kwargs is not None else {}
 
     def __contains__(self, key):
         if key == "type":
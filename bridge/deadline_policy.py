@@ -0,0 +1,159 @@
+"""
+按截止时间调整模型请求
+
+有些通道必须在固定时间内给出回复，例如公众号被动回复只有微信服务器3次重试(每次5秒)的时间，
+超时后用户只能看到“正在思考中”并需要再发一条消息。通道可以在context中设置:
+    context["deadline"]: 回复必须产出的时间点(time.time()的绝对时间)
+    context["continuation"]: 可选，接收一个Future的回调，用于接收超时后剩余的回复内容
+
+剩余时间不足 deadline_fast_model_seconds 时改用 deadline_fast_model，并按 deadline_max_tokens 限制回复长度。
+设置了continuation且bot支持流式回复时，到达截止时间仍未生成完的回复会先返回已生成的部分，
+剩余部分生成完后通过Future交给通道作为续篇发送。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from bot.bot import Bot
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from common.log import logger
+from config import conf
+
+# 部分回复优先在这些字符之后截断，避免断在句子中间
+_BREAK_CHARS = "\n。！？；.!?;"
+
+_DONE = object()
+
+
+class DeadlinePolicy(object):
+    """
+    :param fast_model: 剩余时间不足时改用的模型，为空则不切换
+    :param fast_model_seconds: 剩余时间低于该值时切换模型并限制max_tokens
+    :param max_tokens: 剩余时间不足时的最大回复token数，0表示不限制
+    :param partial_reply: 到达截止时间时是否先返回已生成的部分回复
+    :param reserve_seconds: 截止时间前预留给通道发送回复的时间
+    """
+
+    def __init__(self, fast_model="", fast_model_seconds=8, max_tokens=0, partial_reply=True, reserve_seconds=1):
+        self.fast_model = fast_model
+        self.fast_model_seconds = fast_model_seconds
+        self.max_tokens = max_tokens
+        self.partial_reply = partial_reply
+        self.reserve_seconds = reserve_seconds
+
+    def remaining(self, context: Context):
+        """距离截止时间的剩余秒数，没有截止时间时返回None"""
+        deadline = context.get("deadline") if context else None
+        if not deadline:
+            return None
+        return deadline - self.reserve_seconds - time.time()
+
+    def apply(self, context: Context):
+        """
+        根据剩余时间设置context中的gpt_model和max_tokens，需要在查询回复缓存之前调用，保证缓存键使用实际的模型
+        """
+        remaining = self.remaining(context)
+        if remaining is None or remaining >= self.fast_model_seconds:
+            return
+        # 插件指定的模型优先
+        if self.fast_model and not context.get("gpt_model"):
+            context["gpt_model"] = self.fast_model
+        if self.max_tokens:
+            context["max_tokens"] = min(context.get("max_tokens") or self.max_tokens, self.max_tokens)
+        logger.info(
+            "[DeadlinePolicy] {:.1f}s left, model={}, max_tokens={}".format(remaining, context.get("gpt_model"), context.get("max_tokens"))
+        )
+
+    def reply(self, bot: Bot, query, context: Context) -> Reply:
+        """获取回复，需要且能够返回部分回复时改为流式请求"""
+        remaining = self.remaining(context)
+        if (
+            remaining is None
+            or not self.partial_reply
+            or context.type != ContextType.TEXT
+            or not callable(context.get("continuation"))
+            or query.startswith("#")
+            or type(bot).reply_stream is Bot.reply_stream
+        ):
+            return bot.reply(query, context)
+        return self._reply_before_deadline(bot, query, context, time.time() + remaining)
+
+    def _reply_before_deadline(self, bot: Bot, query, context: Context, cutoff) -> Reply:
+        chunks = queue.Queue()
+
+        def consume():
+            try:
+                for chunk in bot.reply_stream(query, context):
+                    chunks.put(chunk)
+            except Exception as e:
+                logger.exception("[DeadlinePolicy] stream reply failed: {}".format(e))
+            finally:
+                chunks.put(_DONE)
+
+        threading.Thread(target=consume, name="deadline_stream", daemon=True).start()
+
+        parts = []
+        while True:
+            timeout = None
+            if cutoff is not None:
+                timeout = cutoff - time.time()
+                if timeout <= 0:
+                    if parts:
+                        break
+                    # 截止前没有任何输出，部分回复已经没有意义，等待完整回复
+                    cutoff, timeout = None, None
+            try:
+                chunk = chunks.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            if chunk is _DONE:
+                return Reply(ReplyType.TEXT, "".join(parts))
+            parts.append(chunk)
+
+        partial, head = self._split_partial("".join(parts))
+        rest = Future()
+        threading.Thread(target=self._collect_rest, args=(chunks, head, rest), name="deadline_rest", daemon=True).start()
+        # 部分回复不能写入回复缓存
+        context["partial_reply"] = True
+        context["continuation"](rest)
+        logger.info("[DeadlinePolicy] deadline reached, reply {} chars first, the rest is continued".format(len(partial)))
+        return Reply(ReplyType.TEXT, partial)
+
+    @staticmethod
+    def _split_partial(text):
+        """在后半段最后一个断句处截断，返回(部分回复, 移到续篇开头的内容)"""
+        pos = max(text.rfind(c) for c in _BREAK_CHARS)
+        if pos < len(text) // 2:
+            return text, ""
+        return text[: pos + 1], text[pos + 1 :].lstrip()
+
+    @staticmethod
+    def _collect_rest(chunks: queue.Queue, head, rest: Future):
+        parts = [head]
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                break
+            parts.append(chunk)
+        rest.set_result("".join(parts))
+
+
+_deadline_policy = None
+_deadline_policy_lock = threading.Lock()
+
+
+def get_deadline_policy() -> DeadlinePolicy:
+    global _deadline_policy
+    if _deadline_policy is None:
+        with _deadline_policy_lock:
+            if _deadline_policy is None:
+                _deadline_policy = DeadlinePolicy(
+                    fast_model=conf().get("deadline_fast_model", ""),
+                    fast_model_seconds=conf().get("deadline_fast_model_seconds", 8),
+                    max_tokens=conf().get("deadline_max_tokens", 0),
+                    partial_reply=conf().get("deadline_partial_reply", True),
+                    reserve_seconds=conf().get("deadline_reserve_seconds", 1),
+                )
+    return _deadline_policy
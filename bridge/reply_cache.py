@@ -0,0 +1,251 @@
+"""
+模型回复的精确匹配缓存
+
+群聊中经常有重复的问题，插件(如Hello的拍一拍、入群欢迎)也会反复生成相同的提示词，
+这些请求每次都以完整的延迟和费用发给模型。对于低温度或确定性的提示词，
+相同的(bot类型, 模型, 温度, 会话内容)得到的回复可以直接复用。
+
+缓存分两级：内存中的ExpiredDict(TTL + LRU，条目数和单条长度都有上限)，
+以及可选的SQLite文件，进程重启后仍然有效。
+默认关闭，开启后只缓存温度不高于 reply_cache_max_temperature 的请求；
+插件可以设置 context["reply_cache"] = True 声明提示词是确定性的，或设置为False跳过缓存。
+只缓存TEXT回复；bot应以ReplyType.ERROR返回错误提示，无法区分回复类型时(如流式回复)设置context["reply_error"] = True。
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from bot.session_manager import SessionManager
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from config import conf
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(text) -> str:
+    if not isinstance(text, str):
+        return json.dumps(text, ensure_ascii=False, sort_keys=True)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class _SqliteTier(object):
+    def __init__(self, path, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS reply_cache (key TEXT PRIMARY KEY, reply_type TEXT, content TEXT, created_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_reply_cache_created_at ON reply_cache (created_at)")
+        self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT reply_type, content FROM reply_cache WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        return row
+
+    def put(self, key, reply_type, content):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO reply_cache (key, reply_type, content, created_at) VALUES (?, ?, ?, ?)",
+                (key, reply_type, content, time.time()),
+            )
+            self.writes += 1
+            if self.writes % 100 == 0:
+                self._prune()
+            self.conn.commit()
+
+    def _prune(self):
+        # 删除过期数据，并只保留最新的max_entries条
+        self.conn.execute("DELETE FROM reply_cache WHERE created_at <= ?", (time.time() - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM reply_cache WHERE key NOT IN (SELECT key FROM reply_cache ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM reply_cache")
+            self.conn.commit()
+
+
+class ReplyCache(object):
+    """
+    :param ttl: 缓存有效期，单位秒
+    :param max_entries: 内存中最多缓存的回复数，超出后按LRU淘汰
+    :param max_reply_length: 超过该长度的回复不缓存，限制内存占用
+    :param max_temperature: 温度不高于该值的请求才会缓存
+    :param sqlite_path: SQLite文件路径，为空则只使用内存缓存
+    """
+
+    def __init__(self, ttl=3600, max_entries=1000, max_reply_length=4000, max_temperature=0, sqlite_path=None):
+        self.max_reply_length = max_reply_length
+        self.max_temperature = max_temperature
+        self.memory = ExpiredDict(ttl, max_size=max_entries)
+        self.disk = None
+        if sqlite_path:
+            try:
+                self.disk = _SqliteTier(sqlite_path, ttl, max_entries * 10)
+            except Exception as e:
+                logger.warn("[ReplyCache] open sqlite failed, use memory only, path={}, error={}".format(sqlite_path, e))
+        self._stats_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypassed": 0}
+
+    def fetch(self, bot_type, bot, query, context: Context, compute) -> Reply:
+        """
+        先查缓存，未命中时调用compute()获取回复并写入缓存
+        """
+        temperature, model = self._request_params(bot, context)
+        if not self._cacheable(query, context, temperature):
+            self._count("bypassed")
+            return compute()
+        scope = bot.reply_cache_scope(context) if hasattr(bot, "reply_cache_scope") else None
+        if scope is False:
+            self._count("bypassed")
+            return compute()
+        # 只有按会话记录构建提示词的bot，缓存键才包含会话记录，命中时才补写会话记录
+        sessions = getattr(bot, "sessions", None) if getattr(bot, "session_history", False) else None
+        if not isinstance(sessions, SessionManager):
+            sessions = None
+        key = self._make_key(bot_type, model, temperature, scope, self._conversation(sessions, query, context))
+
+        cached = self._lookup(key)
+        if cached is not None:
+            reply_type, content = cached
+            logger.debug("[ReplyCache] hit, bot={}, model={}, key={}".format(bot_type, model, key[:12]))
+            if sessions is not None:
+                # 命中时没有经过bot，需要补上会话记录，保证后续对话的上下文一致
+                session_id = context.get("session_id")
+                sessions.session_query(query, session_id)
+                sessions.session_reply(content, session_id)
+            # 返回新的Reply对象，通道装饰回复时会修改reply.content
+            return Reply(ReplyType[reply_type], content)
+
+        self._count("misses")
+        reply = compute()
+        # 错误提示(ReplyType.ERROR，或bot在context上标记了reply_error)和按截止时间截断的部分回复不缓存
+        if reply and reply.type == ReplyType.TEXT and isinstance(reply.content, str) \
+                and not context.get("reply_error") and not context.get("partial_reply") \
+                and 0 < len(reply.content) <= self.max_reply_length:
+            self._store(key, reply.type.name, reply.content)
+        return reply
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        return stats
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk:
+            self.disk.clear()
+
+    def _cacheable(self, query, context: Context, temperature) -> bool:
+        if context is None or context.type != ContextType.TEXT or not isinstance(query, str):
+            return False
+        flag = context.get("reply_cache")
+        if flag is False:
+            return False
+        # 清除记忆等指令由bot处理，不能缓存
+        if query.startswith("#") or query in conf().get("clear_memory_commands", []):
+            return False
+        if flag is True:
+            return True
+        try:
+            return float(temperature) <= self.max_temperature
+        except (TypeError, ValueError):
+            return False
+
+    def _request_params(self, bot, context: Context):
+        args = getattr(bot, "args", None) or {}
+        temperature = args.get("temperature", conf().get("temperature"))
+        model = context.get("gpt_model") or context.get("modelscope_model") or args.get("model") or conf().get("model")
+        return temperature, model
+
+    def _conversation(self, sessions, query, context: Context) -> list:
+        """
+        缓存键中的对话内容，应与bot实际发送的消息一致
+        """
+        messages = None
+        if sessions is not None:
+            session = sessions.sessions.get(context.get("session_id"))
+            if session is not None:
+                messages = session.messages
+        elif isinstance(getattr(context, "history", None), list):
+            # 由调用方提供完整对话的bot(如ChatGPTBot)
+            messages = context.history
+        if messages is None:
+            messages = [{"role": "system", "content": conf().get("character_desc", "")}]
+        conversation = [(message.get("role"), _normalize(message.get("content"))) for message in messages]
+        conversation.append(("user", _normalize(query)))
+        return conversation
+
+    def _make_key(self, bot_type, model, temperature, scope, conversation) -> str:
+        raw = json.dumps([bot_type, model, temperature, scope, conversation], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key):
+        cached = self.memory.get(key)
+        if cached is not None:
+            self._count("memory_hits")
+            return cached
+        if self.disk is None:
+            return None
+        try:
+            cached = self.disk.get(key)
+        except Exception as e:
+            logger.warn("[ReplyCache] sqlite read failed: {}".format(e))
+            return None
+        if cached is not None:
+            self._count("disk_hits")
+            self.memory[key] = tuple(cached)
+        return cached
+
+    def _store(self, key, reply_type, content):
+        self.memory[key] = (reply_type, content)
+        self._count("stores")
+        if self.disk is not None:
+            try:
+                self.disk.put(key, reply_type, content)
+            except Exception as e:
+                logger.warn("[ReplyCache] sqlite write failed: {}".format(e))
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+
+_reply_cache = None
+_reply_cache_lock = threading.Lock()
+
+
+def get_reply_cache():
+    """获取进程内共享的回复缓存，未开启时返回None"""
+    global _reply_cache
+    if not conf().get("reply_cache_enabled"):
+        return None
+    if _reply_cache is None:
+        with _reply_cache_lock:
+            if _reply_cache is None:
+                _reply_cache = ReplyCache(
+                    ttl=conf().get("reply_cache_ttl", 3600),
+                    max_entries=conf().get("reply_cache_max_entries", 1000),
+                    max_reply_length=conf().get("reply_cache_max_reply_length", 4000),
+                    max_temperature=conf().get("reply_cache_max_temperature", 0),
+                    sqlite_path=conf().get("reply_cache_sqlite_path"),
+                )
+    return _reply_cache
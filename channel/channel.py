@@ -9,7 +9,7 @@ from bridge.reply import *
 
 class Channel(object):
     channel_type = ""
-    NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE, ReplyType.IMAGE]
+    NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE, ReplyType.IMAGE, ReplyType.VIDEO]
 
     def startup(self):
         """
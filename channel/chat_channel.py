@@ -1,22 +1,29 @@
 import os
+import queue
 import time
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import CancelledError, Future
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
 from common import memory
 from common.log import logger
 from config import conf
-from plugins import PluginManager
+from plugins import Event, EventContext, PluginManager
 from channel.channel import Channel
 from bridge.bridge import Bridge
 from common import utils
 from common.tmp_dir import TmpDir
 from common.audio_convert import any_to_wav
+from common.session_dispatcher import SessionDispatcher
 
 class ChatChannel(Channel):
     def __init__(self):
         super().__init__()
-        self.pool = ThreadPoolExecutor(max_workers=8)
+        # 同一会话内按顺序处理，不同会话在共享线程池中并行处理
+        self.dispatcher = SessionDispatcher(
+            self._handle,
+            max_workers=conf().get("handler_pool_size", 8),
+            concurrency_in_session=conf().get("concurrency_in_session", 1),
+        )
         self.users = {}
         self.plugin_manager = PluginManager()
 
@@ -37,6 +44,7 @@ class ChatChannel(Channel):
             logger.error(f"Error handling message: {str(e)}", exc_info=True)
             reply = Reply(ReplyType.TEXT, f"處理訊息時發生錯誤: {str(e)}")
             self.send(reply, context)
+        return reply
 
     def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
         try:
@@ -74,6 +82,73 @@ class ChatChannel(Channel):
             logger.error("Unhandled exception in _generate_reply", exc_info=True)
             return Reply(ReplyType.TEXT, f"系統處理異常: {str(e)}")
 
+    def _generate_reply_stream(self, context: Context):
+        """
+        流式生成回复，逐段产出文本片段
+        插件已处理或非文本消息时，退化为一次性产出完整回复
+        """
+        if context.type != ContextType.TEXT:
+            reply = self._generate_reply(context)
+            if reply and reply.content:
+                yield str(reply.content)
+            return
+        e_context = self.plugin_manager.emit_event(
+            EventContext(
+                Event.ON_HANDLE_CONTEXT,
+                {"channel": self, "context": context, "reply": Reply()}
+            )
+        )
+        if e_context.is_pass():
+            reply = e_context["reply"]
+            if reply and reply.content:
+                yield str(reply.content)
+            return
+        e_context = self.plugin_manager.emit_event(
+            EventContext(
+                Event.ON_DECORATE_STREAM,
+                {"channel": self, "context": context, "filters": []}
+            )
+        )
+        stream = Bridge().fetch_reply_stream(context.content, context)
+        filters = list(e_context["filters"])
+        if not filters:
+            yield from stream
+            return
+        try:
+            for chunk in stream:
+                chunk, stopped = self._filter_chunk(chunk, filters)
+                if chunk:
+                    yield chunk
+                if stopped:
+                    logger.info("[CHAT] Stream stopped by filter, session_id={}".format(context["session_id"]))
+                    return
+            chunk, _ = self._filter_chunk("", filters, final=True)
+            if chunk:
+                yield chunk
+        finally:
+            # 提前结束时关闭bot的流，释放连接
+            if hasattr(stream, "close"):
+                stream.close()
+
+    @staticmethod
+    def _filter_chunk(chunk, filters, final=False):
+        """
+        片段依次经过ON_DECORATE_STREAM中插件加入的过滤器
+        :param final: 回复已结束，取出每个过滤器保留的内容交给后面的过滤器；
+            某个过滤器停止时同样处理其后的过滤器
+        :return: (过滤后的片段, 是否停止)
+        """
+        for i, f in enumerate(filters):
+            chunk = f.feed(chunk) if chunk else ""
+            if final:
+                chunk += f.flush()
+            if f.stopped:
+                # 已放行的内容仍要经过后面的过滤器，并取出它们保留的内容
+                for rest in filters[i + 1:]:
+                    chunk = (rest.feed(chunk) if chunk else "") + rest.flush()
+                return chunk, True
+        return chunk, False
+
     def _handle_text(self, context: Context) -> Reply:
         try:
             bridge = Bridge()
@@ -107,14 +182,95 @@ class ChatChannel(Channel):
         # 文件處理邏輯 (需自行實現)
         pass
 
-    def produce(self, context: Context) -> Reply:
-        try:
-            # 直接同步呼叫 _generate_reply，避免 async 問題
-            reply = self._generate_reply(context)
-            return reply if reply else Reply(ReplyType.TEXT, "請求超時")
-        except Exception as e:
-            logger.error("Error in produce", exc_info=True)
-            return Reply(ReplyType.TEXT, f"請求處理失敗: {str(e)}")
+    def produce(self, context: Context) -> Future:
+        """
+        将消息放入所属会话的队列，由线程池异步处理并发送
+        :return: Future，结果为最终发送的 Reply，需要同步获取回复的通道可调用 result()
+        """
+        session_id = context["session_id"]
+        # 管理命令优先处理
+        priority = context.type == ContextType.TEXT and isinstance(context.content, str) and context.content.startswith("#")
+        future = self.dispatcher.submit(session_id, context, priority=priority)
+        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
+        return future
+
+    def produce_stream(self, context: Context):
+        """
+        流式版本的produce，仍经过会话队列保证同一会话内的顺序
+        :return: 生成器，逐段产出回复文本
+        """
+        chunks = queue.Queue()
+        done = object()
+
+        def finish(future: Future):
+            # 会话被取消时handler不会执行，需要主动结束
+            if not future.cancelled() and future.exception() is not None:
+                chunks.put(future.exception())
+            chunks.put(done)
+
+        future = self.produce_stream_async(context, chunks.put)
+        future.add_done_callback(finish)
+        while True:
+            item = chunks.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def produce_stream_async(self, context: Context, on_chunk) -> Future:
+        """
+        回调版本的produce_stream，回复片段在处理线程中交给on_chunk，调用方不需要为每条消息占用一个线程
+        :param on_chunk: 每产出一段文本时调用 on_chunk(chunk)，返回False时停止生成，例如接收方已断开
+        :return: Future，结果为完整回复的 Reply
+        """
+
+        def handler(ctx):
+            content = ""
+            try:
+                for chunk in self._generate_reply_stream(ctx):
+                    content += chunk
+                    if on_chunk(chunk) is False:
+                        logger.info("[CHAT] Stream stopped by receiver, session_id={}".format(ctx["session_id"]))
+                        break
+            except Exception:
+                logger.error("Stream handling error", exc_info=True)
+                raise
+            logger.info(f"[CHAT] Stream reply content: {content}")
+            return Reply(ReplyType.TEXT, content)
+
+        return self.dispatcher.submit(context["session_id"], context, handler=handler)
+
+    def _thread_pool_callback(self, session_id, **kwargs):
+        def func(worker: Future):
+            try:
+                worker_exception = worker.exception()
+                if worker_exception:
+                    self._fail_callback(session_id, exception=worker_exception, **kwargs)
+                else:
+                    self._success_callback(session_id, **kwargs)
+            except CancelledError:
+                logger.info("Worker cancelled, session_id = {}".format(session_id))
+            except Exception as e:
+                logger.exception("Worker raise exception: {}".format(e))
+
+        return func
+
+    def _success_callback(self, session_id, **kwargs):  # 线程正常结束时的回调函数
+        logger.debug("Worker return success, session_id = {}".format(session_id))
+
+    def _fail_callback(self, session_id, exception, **kwargs):  # 线程异常结束时的回调函数
+        logger.exception("Worker return exception: {}".format(exception))
+
+    def cancel_session(self, session_id):
+        self.dispatcher.cancel_session(session_id)
+
+    def cancel_all_session(self):
+        self.dispatcher.cancel_all_session()
+
+    def get_dispatch_stats(self) -> dict:
+        """队列深度与等待耗时统计"""
+        return self.dispatcher.stats()
 
     def send(self, reply: Reply, context: Context):
         if not reply:
@@ -127,33 +283,3 @@ class ChatChannel(Channel):
     def _create_session(self):
         # 會話管理邏輯 (需自行實現)
         return {"create_time": time.time(), "last_active_time": time.time()}
-
-# 事件類型定義
-class Event:
-    ON_HANDLE_CONTEXT = "on_handle_context"
-
-class EventAction:
-    BREAK = "break"
-    CONTINUE = "continue"
-    BREAK_PASS = "break_pass"
-
-class EventContext(dict):
-    def __init__(self, event: str, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.event = event
-        self._is_pass = False
-        self._action = EventAction.CONTINUE
-
-    def is_pass(self):
-        return self._is_pass
-
-    def set_pass(self, is_pass: bool):
-        self._is_pass = is_pass
-
-    @property
-    def action(self):
-        return self._action
-
-    @action.setter
-    def action(self, value):
-        self._action = value
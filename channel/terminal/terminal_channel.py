@@ -27,7 +27,7 @@ class TerminalMessage(ChatMessage):
 
 
 class TerminalChannel(ChatChannel):
-    NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE]
+    NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE, ReplyType.VIDEO]
 
     def send(self, reply: Reply, context: Context):
         print("\nBot:")
@@ -42,11 +42,12 @@ class TerminalChannel(ChatChannel):
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             import io
 
-            import requests
             from PIL import Image
 
+            from common.http_client import get_session
+
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
+            pic_res = get_session().get(img_url, stream=True)
             image_storage = io.BytesIO()
             for block in pic_res.iter_content(1024):
                 image_storage.write(block)
@@ -1,11 +1,27 @@
-from flask import Flask, request, jsonify, render_template
+import json
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import TimeoutError
+
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel
 from channel.chat_message import ChatMessage
+from channel.web import web_server, websocket
+from channel.web.web_server import LoadShedder
 from common.log import logger
+from config import conf
 import os
 
+# 會話ID來源：優先讀取請求頭，其次讀取 cookie
+SESSION_HEADER = "X-Session-Id"
+SESSION_COOKIE = "web_session_id"
+SESSION_COOKIE_MAX_AGE = 30 * 24 * 3600
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+
 class WebChannel(ChatChannel):
     def __init__(self):
         super().__init__()
@@ -13,31 +29,29 @@ class WebChannel(ChatChannel):
         self.app = Flask(__name__, template_folder=template_dir)
         self.port = int(os.environ.get("PORT", 10000))
         self.app.add_url_rule('/chat', 'chat', self.chat_handler, methods=['POST'])
+        self.app.add_url_rule('/chat/stream', 'chat_stream', self.chat_stream_handler, methods=['POST'])
+        self.app.add_url_rule('/chat/batch', 'chat_batch', self.chat_batch_handler, methods=['POST'])
+        # websocket=True 時只匹配 WebSocket 升級請求，普通請求由 werkzeug 回應400
+        self.app.add_url_rule('/chat/ws', 'chat_ws', self.chat_ws_handler, websocket=True)
         self.app.add_url_rule('/', 'index', self.index_handler)
         self.app.add_url_rule('/chatui', 'chatui', self.chatui_handler)
+        self.app.after_request(self._set_session_cookie)
+        # 同時處理的請求超過上限時直接回應503
+        self.shedder = LoadShedder(self.app.wsgi_app, conf().get("web_max_concurrency", 24))
+        self.app.wsgi_app = self.shedder
+        # WebSocket 連線在整個生命週期內佔用一個服務執行緒，握手後不再計入 LoadShedder，改為單獨限制連線數
+        self.max_websockets = conf().get("web_max_websockets", 4)
+        self.websockets = 0
+        self.websockets_lock = threading.Lock()
 
     def chat_handler(self):
         data = request.json
         user_msg = data.get("message", "")
         try:
-            # 模擬原始訊息並初始化 ChatMessage
-            raw_msg = {"content": user_msg}
-            msg_obj = ChatMessage(raw_msg)
-            # 手動設置必要屬性
-            msg_obj.content = user_msg
-            msg_obj.from_user_id = "web_user_001"
-            msg_obj.from_user_nickname = "Web用戶"
-            msg_obj.actual_user_id = "web_user_001"
-            msg_obj.actual_user_nickname = "Web用戶"
-            msg_obj.is_group = False
-
-            # 建立 Context
-            context = Context(ContextType.TEXT, content=user_msg)
-            context.kwargs["msg"] = msg_obj
-            context.kwargs["session_id"] = "web_user_001"
+            context = self._build_context(user_msg, self._session_id())
 
             # 處理請求
-            reply = self.produce(context)
+            reply = self.produce(context).result(timeout=conf().get("web_request_timeout", 120))
 
             # 檢查回覆有效性
             if not reply or not hasattr(reply, 'content'):
@@ -46,16 +60,225 @@ class WebChannel(ChatChannel):
 
             return jsonify({"reply": reply.content})
 
+        except TimeoutError:
+            logger.warning("[WEB] reply timeout, session_id={}".format(context["session_id"]))
+            return jsonify({"reply": "回覆逾時，請稍後再試"}), 504
         except Exception as e:
             logger.error(f"處理請求時發生錯誤: {str(e)}", exc_info=True)
             return jsonify({"reply": f"系統錯誤: {str(e)}"}), 500
 
+    def chat_stream_handler(self):
+        """
+        以 Server-Sent Events 逐段推送回覆，每個事件為 {"delta": "..."}，結束時推送 [DONE]
+        """
+        data = request.json
+        context = self._build_context(data.get("message", ""), self._session_id())
+
+        def generate():
+            try:
+                for chunk in self.produce_stream(context):
+                    yield "data: {}\n\n".format(json.dumps({"delta": chunk}, ensure_ascii=False))
+            except Exception as e:
+                logger.error(f"串流回覆時發生錯誤: {str(e)}", exc_info=True)
+                yield "event: error\ndata: {}\n\n".format(json.dumps({"error": f"系統錯誤: {str(e)}"}, ensure_ascii=False))
+            yield "data: [DONE]\n\n"
+
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+    def chat_batch_handler(self):
+        """
+        一次提交多條訊息，全部同時送入調度器處理，回覆按請求中的順序回傳
+        請求體：{"messages": ["訊息", {"message": "訊息", "conversation": "a"}, ...]}
+        指定相同 conversation 的訊息共用上下文並依序處理，未指定的訊息各自使用獨立的上下文
+        回應：{"replies": [{"status": 200, "reply": "..."}, ...]}，單條失敗不影響其他訊息
+        """
+        data = request.json or {}
+        items = data.get("messages")
+        if not isinstance(items, list) or not items:
+            return jsonify({"reply": "messages 必須為非空陣列"}), 400
+        max_size = conf().get("web_batch_max_size", 32)
+        if len(items) > max_size:
+            return jsonify({"reply": f"單次最多 {max_size} 條訊息"}), 413
+
+        session_id = self._session_id()
+        futures = []
+        for item in items:
+            if isinstance(item, str):
+                item = {"message": item}
+            conversation_id = self._conversation_id(session_id, item.get("conversation")) if isinstance(item, dict) else None
+            if not conversation_id or not isinstance(item.get("message"), str):
+                futures.append(None)
+                continue
+            futures.append(self.produce(self._build_context(item["message"], conversation_id)))
+
+        # 所有訊息共用同一個等待期限
+        deadline = time.monotonic() + conf().get("web_request_timeout", 120)
+        replies = []
+        for future in futures:
+            if future is None:
+                replies.append({"status": 400, "reply": "訊息格式錯誤"})
+                continue
+            try:
+                reply = future.result(timeout=max(0, deadline - time.monotonic()))
+                replies.append({"status": 200, "reply": reply.content})
+            except TimeoutError:
+                # 尚未開始處理的訊息不再處理
+                future.cancel()
+                replies.append({"status": 504, "reply": "回覆逾時，請稍後再試"})
+            except Exception as e:
+                logger.error(f"批量處理時發生錯誤: {str(e)}", exc_info=True)
+                replies.append({"status": 500, "reply": f"系統錯誤: {str(e)}"})
+        return jsonify({"replies": replies})
+
+    def chat_ws_handler(self):
+        """
+        WebSocket 連線數超過 web_max_websockets 時回應503
+        """
+        with self.websockets_lock:
+            full = self.websockets >= self.max_websockets
+            if not full:
+                self.websockets += 1
+        if full:
+            logger.warning("[WEB] too many websockets, max={}".format(self.max_websockets))
+            return jsonify({"reply": "WebSocket 連線數已達上限，請稍後再試"}), 503, {"Retry-After": "1"}
+        try:
+            return self._chat_ws()
+        finally:
+            with self.websockets_lock:
+                self.websockets -= 1
+
+    def _chat_ws(self):
+        """
+        WebSocket 介面，一條連線上可同時進行多個對話，回覆以串流方式推送
+        連線建立後先推送 {"session_id": "..."}
+        用戶端訊息：{"id": "1", "message": "你好", "conversation": "a"}，conversation 省略時使用會話本身的上下文
+        伺服器訊息：逐段推送 {"id": "1", "delta": "..."}，完成時推送 {"id": "1", "done": true, "reply": "完整回覆"}，
+        失敗時推送 {"id": "1", "error": "..."}
+        """
+        session_id = self._session_id()
+        try:
+            ws = websocket.WebSocket.accept(request.environ, timeout=conf().get("web_websocket_timeout", 300))
+        except websocket.WebSocketError as e:
+            return jsonify({"reply": str(e)}), 400
+        # 連線已升級，釋放 LoadShedder 名額，避免閒置的 WebSocket 讓普通請求都回應503
+        release = request.environ.get(LoadShedder.RELEASE_KEY)
+        if release:
+            release()
+
+        def send(payload):
+            try:
+                ws.send(json.dumps(payload, ensure_ascii=False))
+                return True
+            except websocket.ConnectionClosed:
+                return False
+
+        max_inflight = conf().get("web_batch_max_size", 32)
+        inflight = set()
+        lock = threading.Lock()
+
+        def finish(msg_id, future):
+            with lock:
+                inflight.discard(future)
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                send({"id": msg_id, "error": f"系統錯誤: {str(future.exception())}"})
+            else:
+                send({"id": msg_id, "done": True, "reply": future.result().content})
+
+        send({"session_id": session_id})
+        try:
+            while True:
+                try:
+                    data = json.loads(ws.receive())
+                except ValueError:
+                    data = None
+                if not isinstance(data, dict):
+                    send({"error": "訊息格式錯誤"})
+                    continue
+                msg_id = data.get("id")
+                conversation = data.get("conversation")
+                conversation_id = self._conversation_id(session_id, conversation) if conversation is not None else session_id
+                if not conversation_id or not isinstance(data.get("message"), str):
+                    send({"id": msg_id, "error": "訊息格式錯誤"})
+                    continue
+                with lock:
+                    if len(inflight) >= max_inflight:
+                        send({"id": msg_id, "error": f"同時處理的訊息不能超過 {max_inflight} 條"})
+                        continue
+                    # 連線斷開後 send 回傳 False，停止繼續生成
+                    future = self.produce_stream_async(
+                        self._build_context(data["message"], conversation_id),
+                        lambda chunk, msg_id=msg_id: send({"id": msg_id, "delta": chunk}),
+                    )
+                    inflight.add(future)
+                future.add_done_callback(lambda f, msg_id=msg_id: finish(msg_id, f))
+        except websocket.WebSocketError as e:
+            logger.debug("[WEB] websocket closed, session_id={}, reason={}".format(session_id, e))
+        finally:
+            with lock:
+                pending = list(inflight)
+            # 尚未開始處理的訊息不再處理
+            for future in pending:
+                future.cancel()
+            ws.close()
+        return websocket.ClosedResponse()
+
+    def _conversation_id(self, session_id, conversation=None):
+        """
+        批量和 WebSocket 介面中同一會話下的不同對話，各自擁有獨立的上下文
+        未指定 conversation 時生成一次性的對話ID，格式不合法時回傳 None
+        """
+        if conversation is None:
+            conversation = uuid.uuid4().hex[:12]
+        if not isinstance(conversation, str) or not _SESSION_ID_RE.match(conversation):
+            return None
+        return "{}:{}".format(session_id, conversation)
+
+    def _session_id(self):
+        """
+        取得目前請求的會話ID，不同瀏覽器或客戶端各自擁有獨立的對話上下文
+        沒有帶會話ID或格式不合法時生成新的ID，並在回應中寫入 cookie
+        """
+        session_id = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+        if not session_id or not _SESSION_ID_RE.match(session_id):
+            session_id = uuid.uuid4().hex
+            g.new_session_id = session_id
+        return session_id
+
+    def _set_session_cookie(self, response):
+        session_id = g.pop("new_session_id", None)
+        if session_id:
+            response.set_cookie(SESSION_COOKIE, session_id, max_age=SESSION_COOKIE_MAX_AGE, httponly=True, samesite="Lax")
+        return response
+
+    def _build_context(self, user_msg, session_id) -> Context:
+        # 模擬原始訊息並初始化 ChatMessage
+        raw_msg = {"content": user_msg}
+        msg_obj = ChatMessage(raw_msg)
+        # 手動設置必要屬性
+        msg_obj.content = user_msg
+        msg_obj.from_user_id = session_id
+        msg_obj.from_user_nickname = "Web用戶"
+        msg_obj.actual_user_id = session_id
+        msg_obj.actual_user_nickname = "Web用戶"
+        msg_obj.is_group = False
+
+        # 建立 Context
+        context = Context(ContextType.TEXT, content=user_msg)
+        context.kwargs["msg"] = msg_obj
+        context.kwargs["session_id"] = session_id
+        context.kwargs["receiver"] = session_id
+        context.kwargs["isgroup"] = False
+        return context
+
     def index_handler(self):
         return render_template('chat.html')
 
     def startup(self):
         logger.info(f"Starting web service on 0.0.0.0:{self.port}")
-        self.app.run(host="0.0.0.0", port=self.port)
+        web_server.serve(self.app, "0.0.0.0", self.port)
 
     def chatui_handler(self):
         return render_template('chatui.html')
@@ -0,0 +1,252 @@
+"""
+Web通道的WSGI服务
+
+web_server 配置可选:
+    threaded: 内置的线程池服务，固定 web_threads 个线程处理连接，支持HTTP/1.1 keep-alive；
+        线程都在忙时最多 web_max_pending 个连接排队，超出的连接直接返回503，有连接排队时空闲的keep-alive连接立即关闭
+    waitress: 使用waitress(需要安装)，连接由事件循环管理，空闲的keep-alive连接不占用线程
+    dev: Flask开发服务器，仅用于调试
+通道用 LoadShedder 包装应用：同时处理的请求超过 web_max_concurrency 时直接返回503，
+避免请求在线程池和会话队列中无限堆积，客户端可以按Retry-After重试。
+"""
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from common.log import logger
+from config import conf
+
+
+class LoadShedder(object):
+    """
+    限制同时处理的请求数的WSGI中间件
+    流式响应在响应体迭代结束(或客户端断开)时才释放名额；
+    长连接(如WebSocket)可以调用 environ[LoadShedder.RELEASE_KEY]() 提前释放，之后不再计入
+    """
+
+    RELEASE_KEY = "load_shedder.release"
+
+    def __init__(self, app, max_concurrency, retry_after=1):
+        self.app = app
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.active = 0
+        self.shed = 0
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            if self.active >= self.max_concurrency:
+                self.shed += 1
+                shed = True
+            else:
+                self.active += 1
+                shed = False
+        if shed:
+            body = b'{"reply": "server busy, please retry later"}'
+            start_response(
+                "503 Service Unavailable",
+                [("Content-Type", "application/json"), ("Content-Length", str(len(body))), ("Retry-After", str(self.retry_after))],
+            )
+            return [body]
+        released = []
+
+        def release():
+            # 提前释放和响应结束都会调用，只释放一次
+            with self.lock:
+                if not released:
+                    released.append(True)
+                    self.active -= 1
+
+        environ[self.RELEASE_KEY] = release
+        try:
+            result = self.app(environ, start_response)
+        except Exception:
+            release()
+            raise
+        return _ClosingIterator(result, release)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"active": self.active, "max_concurrency": self.max_concurrency, "shed": self.shed}
+
+
+class _ClosingIterator(object):
+    """迭代结束后由WSGI服务调用close，此时释放名额"""
+
+    def __init__(self, result, on_close):
+        self.result = result
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        try:
+            if hasattr(self.result, "close"):
+                self.result.close()
+        finally:
+            self.on_close()
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    用固定大小的线程池处理连接的WSGI服务
+    线程都在忙时新连接最多排队max_pending个，再多的连接直接返回503并关闭，
+    LoadShedder只能限制已经进入应用的请求，挡不住被空闲或缓慢的连接占满线程后堆积的新连接
+    """
+
+    multithread = True
+    daemon_threads = True
+
+    def __init__(self, host, port, app, threads, handler=None, max_pending=None):
+        super().__init__(host, port, app, handler=handler)
+        self.threads = threads
+        self.max_pending = threads if max_pending is None else max_pending
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="web_server")
+        self.lock = threading.Lock()
+        self.busy = 0  # 正在处理的连接数
+        self.pending = 0  # 已接受、等待线程的连接数
+        self.rejected = 0
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            full = self.busy + self.pending >= self.threads + self.max_pending
+            if full:
+                self.rejected += 1
+            else:
+                self.pending += 1
+        if full:
+            self._reject(request)
+            return
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        with self.lock:
+            self.pending -= 1
+            self.busy += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.lock:
+                self.busy -= 1
+            self.shutdown_request(request)
+
+    def _reject(self, request):
+        # 在接受连接的线程中直接回应，不读取请求
+        try:
+            request.settimeout(1)
+            request.sendall(_BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def has_waiting(self) -> bool:
+        """是否有连接在等待线程，空闲的keep-alive连接据此提前关闭"""
+        return self.pending > 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"threads": self.threads, "busy": self.busy, "pending": self.pending, "max_pending": self.max_pending, "rejected": self.rejected}
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+
+_BUSY_BODY = b'{"reply": "server busy, please retry later"}'
+_BUSY_RESPONSE = (
+    "HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+    "Retry-After: 1\r\nConnection: close\r\n\r\n".format(len(_BUSY_BODY)).encode("ascii")
+    + _BUSY_BODY
+)
+
+# 等待请求的连接每隔该秒数检查一次是否有连接在排队
+_IDLE_POLL_INTERVAL = 0.2
+# 新连接在该秒数内没有发来请求，且有连接在排队时关闭
+_FIRST_REQUEST_GRACE = 1.0
+
+
+def _keepalive_handler(timeout):
+    class KeepAliveRequestHandler(WSGIRequestHandler):
+        # HTTP/1.1 默认保持连接，空闲或读取请求超过timeout秒时关闭连接；
+        # 有其他连接在排队时，空闲的keep-alive连接和迟迟不发请求的新连接提前关闭，把线程让出来
+        # (werkzeug 2.1起每个响应都带Connection: close，连接处理完一个请求就结束)
+        protocol_version = "HTTP/1.1"
+
+        def handle_one_request(self):
+            served = getattr(self, "served", False)
+            if not self._wait_request(0 if served else _FIRST_REQUEST_GRACE):
+                self.close_connection = True
+                return
+            self.served = True
+            super().handle_one_request()
+
+        def _wait_request(self, grace) -> bool:
+            """
+            等待请求的数据，超时或有连接排队时返回False
+            :param grace: 等待不足该秒数时不因有连接排队而放弃
+            """
+            if self._buffered():
+                return True
+            has_waiting = getattr(self.server, "has_waiting", None)
+            start = time.monotonic()
+            while True:
+                elapsed = time.monotonic() - start
+                if elapsed >= grace and has_waiting is not None and has_waiting():
+                    return False
+                remaining = self.timeout - elapsed
+                if remaining <= 0:
+                    return False
+                try:
+                    readable, _, _ = select.select([self.connection], [], [], min(_IDLE_POLL_INTERVAL, remaining))
+                except (OSError, ValueError):
+                    return False
+                if readable:
+                    return True
+
+        def _buffered(self) -> bool:
+            # 已读入缓冲区的数据(如pipelining的下一个请求)，select看不到
+            self.connection.settimeout(0)
+            try:
+                return bool(self.rfile.peek(1))
+            except OSError:
+                return False
+            finally:
+                self.connection.settimeout(self.timeout)
+
+    KeepAliveRequestHandler.timeout = timeout
+    return KeepAliveRequestHandler
+
+
+def serve(app, host, port):
+    """按配置启动WSGI服务，阻塞直到服务停止"""
+    mode = conf().get("web_server", "threaded")
+    threads = conf().get("web_threads", 32)
+    keepalive_timeout = conf().get("web_keepalive_timeout", 15)
+    max_pending = conf().get("web_max_pending", threads)
+    if mode == "waitress":
+        try:
+            import waitress
+        except ImportError:
+            logger.warning("[WebServer] waitress is not installed, fallback to threaded server")
+        else:
+            logger.info("[WebServer] waitress serving on {}:{}, threads={}".format(host, port, threads))
+            waitress.serve(app, host=host, port=port, threads=threads, channel_timeout=keepalive_timeout)
+            return
+    if mode == "dev":
+        app.run(host=host, port=port, threaded=True)
+        return
+    server = PooledWSGIServer(host, port, app, threads, handler=_keepalive_handler(keepalive_timeout), max_pending=max_pending)
+    logger.info(
+        "[WebServer] threaded serving on {}:{}, threads={}, max_pending={}, keepalive={}s".format(host, port, threads, max_pending, keepalive_timeout)
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
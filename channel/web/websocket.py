@@ -0,0 +1,185 @@
+"""
+Web通道使用的最小WebSocket(RFC 6455)服务端实现
+
+只支持文本/二进制消息、分片、ping/pong和close，不支持扩展(如permessage-deflate)。
+握手后直接读写werkzeug提供的socket，所以只能在threaded和dev服务方式下使用，
+每个连接在整个生命周期内占用一个服务线程；WebChannel在握手后释放LoadShedder的名额，
+连接数由 web_max_websockets 单独限制。
+"""
+import base64
+import hashlib
+import socket
+import struct
+import threading
+
+from werkzeug.wrappers import Response
+
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class WebSocketError(Exception):
+    pass
+
+
+class ConnectionClosed(WebSocketError):
+    pass
+
+
+class WebSocket(object):
+    """
+    receive只能在一个线程中调用，send和close可以在任意线程中调用
+    """
+
+    def __init__(self, sock, max_message_size=1 << 20):
+        self.sock = sock
+        self.max_message_size = max_message_size
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    @classmethod
+    def accept(cls, environ, timeout=None, max_message_size=1 << 20):
+        """
+        完成握手并返回连接
+        :param timeout: 连接上超过该秒数没有收到任何帧时关闭，None表示不限制
+        """
+        sock = environ.get("werkzeug.socket")
+        if sock is None:
+            raise WebSocketError("websocket is not supported by this web_server")
+        key = environ.get("HTTP_SEC_WEBSOCKET_KEY")
+        if not key or environ.get("HTTP_SEC_WEBSOCKET_VERSION") != "13":
+            raise WebSocketError("bad websocket handshake")
+        accept = base64.b64encode(hashlib.sha1((key + _GUID).encode("ascii")).digest()).decode("ascii")
+        sock.sendall(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            "Sec-WebSocket-Accept: {}\r\n\r\n".format(accept).encode("ascii")
+        )
+        sock.settimeout(timeout)
+        return cls(sock, max_message_size)
+
+    def receive(self):
+        """
+        读取下一条完整消息，文本消息返回str，二进制消息返回bytes
+        对方关闭、连接断开或超时时抛出ConnectionClosed
+        """
+        parts, opcode, size = [], None, 0
+        while True:
+            fin, frame_opcode, payload = self._read_frame()
+            if frame_opcode == OP_PING:
+                self._send_frame(OP_PONG, payload)
+                continue
+            if frame_opcode == OP_PONG:
+                continue
+            if frame_opcode == OP_CLOSE:
+                self.close()
+                raise ConnectionClosed("closed by peer")
+            if frame_opcode == OP_CONTINUATION:
+                if opcode is None:
+                    self._fail("unexpected continuation frame")
+            elif opcode is not None or frame_opcode not in (OP_TEXT, OP_BINARY):
+                self._fail("unexpected opcode {}".format(frame_opcode))
+            else:
+                opcode = frame_opcode
+            size += len(payload)
+            if size > self.max_message_size:
+                self._fail("message too large", code=1009)
+            parts.append(payload)
+            if fin:
+                data = b"".join(parts)
+                return data.decode("utf-8") if opcode == OP_TEXT else data
+
+    def send(self, data):
+        """发送一条消息，str按文本发送，bytes按二进制发送；连接已关闭时抛出ConnectionClosed"""
+        if isinstance(data, str):
+            self._send_frame(OP_TEXT, data.encode("utf-8"))
+        else:
+            self._send_frame(OP_BINARY, bytes(data))
+
+    def close(self, code=1000):
+        with self.send_lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.sock.sendall(_frame(OP_CLOSE, struct.pack("!H", code)))
+                # 让werkzeug读取下一个请求时立即发现连接已结束
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _fail(self, reason, code=1002):
+        self.close(code)
+        raise WebSocketError(reason)
+
+    def _send_frame(self, opcode, payload):
+        with self.send_lock:
+            if self.closed:
+                raise ConnectionClosed("websocket is closed")
+            try:
+                self.sock.sendall(_frame(opcode, payload))
+            except OSError as e:
+                self.closed = True
+                raise ConnectionClosed(str(e))
+
+    def _read_exact(self, n):
+        buf = bytearray()
+        while len(buf) < n:
+            try:
+                chunk = self.sock.recv(n - len(buf))
+            except OSError as e:
+                # 包括socket.timeout，空闲超时也按连接断开处理
+                self.close(1001)
+                raise ConnectionClosed(str(e))
+            if not chunk:
+                self.closed = True
+                raise ConnectionClosed("connection lost")
+            buf += chunk
+        return bytes(buf)
+
+    def _read_frame(self):
+        first, second = self._read_exact(2)
+        if first & 0x70:
+            self._fail("websocket extensions are not supported")
+        if not second & 0x80:
+            self._fail("client frames must be masked")
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._read_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._read_exact(8))[0]
+        if length > self.max_message_size:
+            self._fail("message too large", code=1009)
+        mask = self._read_exact(4)
+        payload = self._read_exact(length)
+        if length:
+            # 整段异或，比逐字节处理快得多
+            key = (mask * (length // 4 + 1))[:length]
+            payload = (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+        return bool(first & 0x80), first & 0x0F, payload
+
+
+def _frame(opcode, payload):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+class ClosedResponse(Response):
+    """
+    WebSocket结束后视图函数返回的响应
+    连接已经不是HTTP连接，不能再写出响应，抛出ConnectionError让werkzeug直接放弃这个连接
+    """
+
+    def __call__(self, environ, start_response):
+        raise ConnectionError("websocket closed")
@@ -5,6 +5,7 @@ from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel
 from common.log import logger
+from config import conf
 import os
 
 class WebChannel(ChatChannel):
@@ -21,7 +22,7 @@ class WebChannel(ChatChannel):
     def chat_handler(self):
         data = request.json
         context = Context(ContextType.TEXT, content=data.get("message", ""))
-        reply = self.produce(context)
+        reply = self.produce(context).result(timeout=conf().get("request_timeout", 180))
         return jsonify({"reply": reply.content})
 
     def index_handler(self):
@@ -41,7 +42,7 @@ class WebChannel(ChatChannel):
             content=data.get("message", ""),
         )
         context.kwargs["session_id"] = "web_user_001"
-        reply = self.produce(context)
+        reply = self.produce(context).result(timeout=conf().get("request_timeout", 180))
         return jsonify({"reply": reply.content})
 def create_channel():
     return WebChannel()
@@ -0,0 +1,82 @@
+"""
+个人微信通道使用的itchat内核
+
+wechat_async_transport 为true时使用itchat的asyncio内核：所有请求共用一个aiohttp会话，
+sync_check长轮询、媒体下载和消息发送都作为同一个事件循环中的任务并发执行，不再各占一个线程。
+itchat按环境变量ITCHAT_UOS_ASYNC选择内核，所以本模块必须先于其他模块导入lib.itchat。
+"""
+import asyncio
+import inspect
+import os
+import threading
+
+from common.log import logger
+from config import conf
+
+ASYNC_TRANSPORT = bool(conf().get("wechat_async_transport", False))
+if ASYNC_TRANSPORT:
+    os.environ["ITCHAT_UOS_ASYNC"] = "1"
+
+from lib import itchat
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """运行asyncio内核的事件循环，在守护线程中运行"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="itchat_loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def call(result):
+    """
+    等待itchat调用的结果，同步内核直接返回结果，异步内核返回的协程提交到事件循环中执行并等待
+    只能在事件循环以外的线程调用，例如消息处理线程
+    """
+    if not inspect.isawaitable(result):
+        return result
+    loop = get_loop()
+    if threading.current_thread().name == "itchat_loop":
+        raise RuntimeError("itchat coroutine can not be waited in its own event loop")
+    return asyncio.run_coroutine_threadsafe(result, loop).result()
+
+
+def login_and_run(hotReload, statusStorageDir, qrCallback=None, loginCallback=None, exitCallback=None):
+    """
+    扫码登录并开始接收消息，阻塞直到退出登录
+    :param loginCallback: 登录成功的回调，无参数
+    :param exitCallback: 退出登录的回调，无参数
+    """
+    if not ASYNC_TRANSPORT:
+        itchat.auto_login(
+            enableCmdQR=2,
+            hotReload=hotReload,
+            statusStorageDir=statusStorageDir,
+            qrCallback=qrCallback,
+            exitCallback=exitCallback,
+            loginCallback=loginCallback,
+        )
+        itchat.run()
+        return
+
+    async def main():
+        await itchat.auto_login(
+            enableCmdQR=2,
+            hotReload=hotReload,
+            statusStorageDir=statusStorageDir,
+            qrCallback=qrCallback,
+            # 异步内核的回调带有userName参数
+            exitCallback=exitCallback and (lambda userName: exitCallback()),
+            loginCallback=loginCallback and (lambda userName: loginCallback()),
+        )
+        await itchat.run()
+
+    logger.info("[WX] itchat runs on asyncio transport")
+    call(main())
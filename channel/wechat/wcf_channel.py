@@ -25,11 +25,11 @@ from wcferry import Wcf, WxMsg
 
 @singleton
 class WechatfChannel(ChatChannel):
-    NOT_SUPPORT_REPLYTYPE = []
+    NOT_SUPPORT_REPLYTYPE = [ReplyType.VIDEO]
 
     def __init__(self):
         super().__init__()
-        self.NOT_SUPPORT_REPLYTYPE = []
+        self.NOT_SUPPORT_REPLYTYPE = [ReplyType.VIDEO]
         # 使用字典存储最近消息，用于去重
         self.received_msgs = {}
         # 初始化wcferry客户端
@@ -9,20 +9,21 @@ import json
 import os
 import threading
 import time
-import requests
 
 from bridge.context import *
 from bridge.reply import *
 from channel.chat_channel import ChatChannel
 from channel import chat_channel
+from channel.wechat import itchat_transport
+from channel.wechat.itchat_transport import itchat
 from channel.wechat.wechat_message import *
 from common.expired_dict import ExpiredDict
+from common.http_client import get_session
 from common.log import logger
 from common.singleton import singleton
 from common.time_check import time_checker
 from common.utils import convert_webp_to_png, remove_markdown_symbol
 from config import conf, get_appdata_dir
-from lib import itchat
 from lib.itchat.content import *
 
 
@@ -133,19 +134,14 @@ class WechatChannel(ChatChannel):
             # # login by scan QRCode
             # hotReload = conf().get("hot_reload", False)
             # status_path = os.path.join(get_appdata_dir(), "itchat.pkl")
-            # itchat.auto_login(
-            #     enableCmdQR=2,
+            # # login and start message listener, the transport is chosen by wechat_async_transport
+            # itchat_transport.login_and_run(
             #     hotReload=hotReload,
             #     statusStorageDir=status_path,
             #     qrCallback=qrCallback,
             #     exitCallback=self.exitCallback,
             #     loginCallback=self.loginCallback
             # )
-            # self.user_id = itchat.instance.storageClass.userName
-            # self.name = itchat.instance.storageClass.nickName
-            # logger.info("Wechat login success, user_id: {}, nickname: {}".format(self.user_id, self.name))
-            # # start message listener
-            # itchat.run()
         except Exception as e:
             logger.exception(e)
 
@@ -164,6 +160,9 @@ class WechatChannel(ChatChannel):
 
     def loginCallback(self):
         logger.debug("Login success")
+        self.user_id = itchat.instance.storageClass.userName
+        self.name = itchat.instance.storageClass.nickName
+        logger.info("Wechat login success, user_id: {}, nickname: {}".format(self.user_id, self.name))
         _send_login_success()
 
     # handle_* 系列函数处理收到的消息后构造Context，然后传入produce函数中处理Context和发送回复
@@ -226,19 +225,19 @@ class WechatChannel(ChatChannel):
         receiver = context["receiver"]
         if reply.type == ReplyType.TEXT:
             reply.content = remove_markdown_symbol(reply.content)
-            itchat.send(reply.content, toUserName=receiver)
+            itchat_transport.call(itchat.send(reply.content, toUserName=receiver))
             logger.info("[WX] sendMsg={}, receiver={}".format(reply, receiver))
         elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
             reply.content = remove_markdown_symbol(reply.content)
-            itchat.send(reply.content, toUserName=receiver)
+            itchat_transport.call(itchat.send(reply.content, toUserName=receiver))
             logger.info("[WX] sendMsg={}, receiver={}".format(reply, receiver))
         elif reply.type == ReplyType.VOICE:
-            itchat.send_file(reply.content, toUserName=receiver)
+            itchat_transport.call(itchat.send_file(reply.content, toUserName=receiver))
             logger.info("[WX] sendFile={}, receiver={}".format(reply.content, receiver))
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
             logger.debug(f"[WX] start download image, img_url={img_url}")
-            pic_res = requests.get(img_url, stream=True)
+            pic_res = get_session().get(img_url, stream=True)
             image_storage = io.BytesIO()
             size = 0
             for block in pic_res.iter_content(1024):
@@ -252,25 +251,25 @@ class WechatChannel(ChatChannel):
                 except Exception as e:
                     logger.error(f"Failed to convert image: {e}")
                     return
-            itchat.send_image(image_storage, toUserName=receiver)
+            itchat_transport.call(itchat.send_image(image_storage, toUserName=receiver))
             logger.info("[WX] sendImage url={}, receiver={}".format(img_url, receiver))
         elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
             image_storage = reply.content
             image_storage.seek(0)
-            itchat.send_image(image_storage, toUserName=receiver)
+            itchat_transport.call(itchat.send_image(image_storage, toUserName=receiver))
             logger.info("[WX] sendImage, receiver={}".format(receiver))
         elif reply.type == ReplyType.FILE:  # 新增文件回复类型
             file_storage = reply.content
-            itchat.send_file(file_storage, toUserName=receiver)
+            itchat_transport.call(itchat.send_file(file_storage, toUserName=receiver))
             logger.info("[WX] sendFile, receiver={}".format(receiver))
         elif reply.type == ReplyType.VIDEO:  # 新增视频回复类型
             video_storage = reply.content
-            itchat.send_video(video_storage, toUserName=receiver)
+            itchat_transport.call(itchat.send_video(video_storage, toUserName=receiver))
             logger.info("[WX] sendFile, receiver={}".format(receiver))
         elif reply.type == ReplyType.VIDEO_URL:  # 新增视频URL回复类型
             video_url = reply.content
             logger.debug(f"[WX] start download video, video_url={video_url}")
-            video_res = requests.get(video_url, stream=True)
+            video_res = get_session().get(video_url, stream=True)
             video_storage = io.BytesIO()
             size = 0
             for block in video_res.iter_content(1024):
@@ -278,7 +277,7 @@ class WechatChannel(ChatChannel):
                 video_storage.write(block)
             logger.info(f"[WX] download video success, size={size}, video_url={video_url}")
             video_storage.seek(0)
-            itchat.send_video(video_storage, toUserName=receiver)
+            itchat_transport.call(itchat.send_video(video_storage, toUserName=receiver))
             logger.info("[WX] sendVideo url={}, receiver={}".format(video_url, receiver))
 
 def _send_login_success():
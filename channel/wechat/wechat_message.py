@@ -4,7 +4,8 @@ from bridge.context import ContextType
 from channel.chat_message import ChatMessage
 from common.log import logger
 from common.tmp_dir import TmpDir
-from lib import itchat
+from channel.wechat import itchat_transport
+from channel.wechat.itchat_transport import itchat
 from lib.itchat.content import *
 
 class WechatMessage(ChatMessage):
@@ -25,11 +26,11 @@ class WechatMessage(ChatMessage):
         elif itchat_msg["Type"] == VOICE:
             self.ctype = ContextType.VOICE
             self.content = TmpDir().path() + itchat_msg["FileName"]  # content直接存临时目录路径
-            self._prepare_fn = lambda: itchat_msg.download(self.content)
+            self._prepare_fn = lambda: itchat_transport.call(itchat_msg.download(self.content))
         elif itchat_msg["Type"] == PICTURE and itchat_msg["MsgType"] == 3:
             self.ctype = ContextType.IMAGE
             self.content = TmpDir().path() + itchat_msg["FileName"]  # content直接存临时目录路径
-            self._prepare_fn = lambda: itchat_msg.download(self.content)
+            self._prepare_fn = lambda: itchat_transport.call(itchat_msg.download(self.content))
         elif itchat_msg["Type"] == NOTE and itchat_msg["MsgType"] == 10000:
             if is_group:
                 if any(note_bot_join_group in itchat_msg["Content"] for note_bot_join_group in notes_bot_join_group):  # 邀请机器人加入群聊
@@ -77,7 +78,7 @@ class WechatMessage(ChatMessage):
         elif itchat_msg["Type"] == ATTACHMENT:
             self.ctype = ContextType.FILE
             self.content = TmpDir().path() + itchat_msg["FileName"]  # content直接存临时目录路径
-            self._prepare_fn = lambda: itchat_msg.download(self.content)
+            self._prepare_fn = lambda: itchat_transport.call(itchat_msg.download(self.content))
         elif itchat_msg["Type"] == SHARING:
             self.ctype = ContextType.SHARING
             self.content = itchat_msg.get("Url")
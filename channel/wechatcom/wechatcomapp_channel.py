@@ -1,9 +1,7 @@
 # -*- coding=utf-8 -*-
-import io
+import imghdr
 import os
-import time
 
-import requests
 import web
 from wechatpy.enterprise import create_reply, parse_message
 from wechatpy.enterprise.crypto import WeChatCrypto
@@ -16,6 +14,7 @@ from channel.chat_channel import ChatChannel
 from channel.wechatcom.wechatcomapp_client import WechatComAppClient
 from channel.wechatcom.wechatcomapp_message import WechatComAppMessage
 from common.log import logger
+from common.media_pipeline import MediaPipeline, pace
 from common.singleton import singleton
 from common.utils import compress_imgfile, fsize, split_string_by_utf8_length, convert_webp_to_png, remove_markdown_symbol
 from config import conf, subscribe_msg
@@ -26,7 +25,7 @@ MAX_UTF8_LEN = 2048
 
 @singleton
 class WechatComAppChannel(ChatChannel):
-    NOT_SUPPORT_REPLYTYPE = []
+    NOT_SUPPORT_REPLYTYPE = [ReplyType.VIDEO]
 
     def __init__(self):
         super().__init__()
@@ -41,6 +40,8 @@ class WechatComAppChannel(ChatChannel):
         )
         self.crypto = WeChatCrypto(self.token, self.aes_key, self.corp_id)
         self.client = WechatComAppClient(self.corp_id, self.secret)
+        # 并行下载、转码、上传回复中的媒体，相同内容复用已上传的media_id
+        self.media_pipeline = MediaPipeline("wechatcom", self._upload_media, "media.upload", dedupe_ttl=conf().get("wechat_media_dedupe_ttl", 86400))
 
     def startup(self):
         # start message listener
@@ -56,24 +57,20 @@ class WechatComAppChannel(ChatChannel):
             texts = split_string_by_utf8_length(reply_text, MAX_UTF8_LEN)
             if len(texts) > 1:
                 logger.info("[wechatcom] text too long, split into {} parts".format(len(texts)))
-            for i, text in enumerate(texts):
+            for text in texts:
+                pace("message.send")
                 self.client.message.send_text(self.agent_id, receiver, text)
-                if i != len(texts) - 1:
-                    time.sleep(0.5)  # 休眠0.5秒，防止发送过快乱序
             logger.info("[wechatcom] Do send text to {}: {}".format(receiver, reply_text))
         elif reply.type == ReplyType.VOICE:
+            file_path = reply.content
+            amr_file = os.path.splitext(file_path)[0] + ".amr"
+            any_to_amr(file_path, amr_file)
+            duration, files = split_audio(amr_file, 60 * 1000)
+            if len(files) > 1:
+                logger.info("[wechatcom] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
             try:
-                media_ids = []
-                file_path = reply.content
-                amr_file = os.path.splitext(file_path)[0] + ".amr"
-                any_to_amr(file_path, amr_file)
-                duration, files = split_audio(amr_file, 60 * 1000)
-                if len(files) > 1:
-                    logger.info("[wechatcom] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
-                for path in files:
-                    response = self.client.media.upload("voice", open(path, "rb"))
-                    logger.debug("[wechatcom] upload voice response: {}".format(response))
-                    media_ids.append(response["media_id"])
+                futures = [self.media_pipeline.submit(path, "voice") for path in files]
+                media_ids = [future.result() for future in futures]
             except WeChatClientException as e:
                 logger.error("[wechatcom] upload voice failed: {}".format(e))
                 return
@@ -84,52 +81,40 @@ class WechatComAppChannel(ChatChannel):
             except Exception:
                 pass
             for media_id in media_ids:
+                pace("message.send")
                 self.client.message.send_voice(self.agent_id, receiver, media_id)
-                time.sleep(1)
             logger.info("[wechatcom] sendVoice={}, receiver={}".format(reply.content, receiver))
-        elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
-            img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
-            image_storage = io.BytesIO()
-            for block in pic_res.iter_content(1024):
-                image_storage.write(block)
-            sz = fsize(image_storage)
-            if sz >= 10 * 1024 * 1024:
-                logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
-                image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
-                logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
-            image_storage.seek(0)
-            if ".webp" in img_url:
-                try:
-                    image_storage = convert_webp_to_png(image_storage)
-                except Exception as e:
-                    logger.error(f"Failed to convert image: {e}")
-                    return
+        elif reply.type in [ReplyType.IMAGE_URL, ReplyType.IMAGE]:  # 从网络下载或从文件读取图片
             try:
-                response = self.client.media.upload("image", image_storage)
-                logger.debug("[wechatcom] upload image response: {}".format(response))
+                media_id = self.media_pipeline.submit(reply.content, "image", transcode=self._transcode_image).result()
             except WeChatClientException as e:
                 logger.error("[wechatcom] upload image failed: {}".format(e))
                 return
-
-            self.client.message.send_image(self.agent_id, receiver, response["media_id"])
-            logger.info("[wechatcom] sendImage url={}, receiver={}".format(img_url, receiver))
-        elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
-            image_storage = reply.content
-            sz = fsize(image_storage)
-            if sz >= 10 * 1024 * 1024:
-                logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
-                image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
-                logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
-            image_storage.seek(0)
-            try:
-                response = self.client.media.upload("image", image_storage)
-                logger.debug("[wechatcom] upload image response: {}".format(response))
-            except WeChatClientException as e:
-                logger.error("[wechatcom] upload image failed: {}".format(e))
+            except Exception as e:
+                logger.error(f"Failed to convert image: {e}")
                 return
-            self.client.message.send_image(self.agent_id, receiver, response["media_id"])
-            logger.info("[wechatcom] sendImage, receiver={}".format(receiver))
+            pace("message.send")
+            self.client.message.send_image(self.agent_id, receiver, media_id)
+            if reply.type == ReplyType.IMAGE_URL:
+                logger.info("[wechatcom] sendImage url={}, receiver={}".format(reply.content, receiver))
+            else:
+                logger.info("[wechatcom] sendImage, receiver={}".format(receiver))
+
+    def _transcode_image(self, image_storage):
+        sz = fsize(image_storage)
+        if sz >= 10 * 1024 * 1024:
+            logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
+            image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
+            logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
+        image_storage.seek(0)
+        if imghdr.what(image_storage) == "webp":
+            image_storage = convert_webp_to_png(image_storage)
+        return image_storage
+
+    def _upload_media(self, media_type, filename, storage):
+        response = self.client.media.upload(media_type, (filename, storage) if filename else storage)
+        logger.debug("[wechatcom] upload {} response: {}".format(media_type, response))
+        return response["media_id"]
 
 
 class Query:
@@ -6,6 +6,14 @@ from wechatpy.utils import check_signature
 from config import conf
 
 MAX_UTF8_LEN = 2048
+# 微信服务器等待被动回复的时间，超时后用同一message_id重试，最多请求3次
+WECHAT_REQUEST_TIMEOUT = 5
+# 每次请求最多等待回复的时间，需要为网络传输留出余量
+PASSIVE_REPLY_WAIT = 4
+# 第3次请求等待结束的时间，超过后用户只能收到“正在思考中”
+PASSIVE_REPLY_DEADLINE = 2 * WECHAT_REQUEST_TIMEOUT + PASSIVE_REPLY_WAIT
+# 语音文件扩展名对应的上传类型
+VOICE_CONTENT_TYPES = {".mp3": "audio/mpeg", ".amr": "audio/amr", ".wav": "audio/wav", ".wma": "audio/x-ms-wma"}
 
 
 class WeChatAPIException(Exception):
@@ -8,7 +8,7 @@ import textwrap
 from bridge.context import *
 from bridge.reply import *
 from channel.wechatmp.common import *
-from channel.wechatmp.wechatmp_channel import WechatMPChannel
+from channel.wechatmp.wechatmp_channel import PassiveRequest, WechatMPChannel
 from channel.wechatmp.wechatmp_message import WeChatMPMessage
 from common.log import logger
 from common.utils import split_string_by_utf8_length
@@ -48,12 +48,9 @@ class Query:
                     supported = False  # not supported, used to refresh
 
                 # New request
-                if (
-                    channel.cache_dict.get(from_user) is None
-                    and from_user not in channel.running
-                    or content.startswith("#")
-                    and message_id not in channel.request_cnt  # insert the godcmd
-                ):
+                request = channel.requests.get(message_id)
+                task = channel.tasks.get(from_user)
+                if request is None and (task is None and not channel.cache_dict.get(from_user) or content.startswith("#")):  # insert the godcmd
                     # The first query begin
                     if msg.type == "voice" and wechatmp_msg.ctype == ContextType.TEXT and conf().get("voice_reply_voice", False):
                         context = channel._compose_context(wechatmp_msg.ctype, content, isgroup=False, desire_rtype=ReplyType.VOICE, msg=wechatmp_msg)
@@ -62,8 +59,10 @@ class Query:
                     logger.debug("[wechatmp] context: {} {} {}".format(context, wechatmp_msg, supported))
 
                     if supported and context:
-                        channel.running.add(from_user)
-                        channel.produce(context)
+                        # 超过截止时间时先回复已生成的部分，剩余部分作为续篇
+                        context["deadline"] = request_time + PASSIVE_REPLY_DEADLINE
+                        context["continuation"] = lambda rest: channel.start_continuation(from_user, rest)
+                        task = channel.start_task(from_user, context)
                     else:
                         trigger_prefix = conf().get("single_chat_prefix", [""])[0]
                         if trigger_prefix or not supported:
@@ -90,43 +89,49 @@ class Query:
                         replyPost = create_reply(reply_text, msg)
                         return encrypt_func(replyPost.render())
 
+                if request is None:
+                    # Other messages while the reply is being generated are used to fetch it
+                    request = PassiveRequest(message_id, task)
+                    channel.requests[message_id] = request
+
                 # Wechat official server will request 3 times (5 seconds each), with the same message_id.
-                # Because the interval is 5 seconds, here assumed that do not have multithreading problems.
-                request_cnt = channel.request_cnt.get(message_id, 0) + 1
-                channel.request_cnt[message_id] = request_cnt
+                request.request_cnt += 1
+                request_cnt = request.request_cnt
                 logger.info(
                     "[wechatmp] Request {} from {} {} {}:{}\n{}".format(
                         request_cnt, from_user, message_id, web.ctx.env.get("REMOTE_ADDR"), web.ctx.env.get("REMOTE_PORT"), content
                     )
                 )
 
-                task_running = True
-                waiting_until = request_time + 4
-                while time.time() < waiting_until:
-                    if from_user in channel.running:
-                        time.sleep(0.1)
-                    else:
-                        task_running = False
-                        break
-
-                reply_text = ""
-                if task_running:
-                    if request_cnt < 3:
-                        # waiting for timeout (the POST request will be closed by Wechat official server)
-                        time.sleep(2)
-                        # and do nothing, waiting for the next request
-                        return "success"
-                    else:  # request_cnt == 3:
+                task = request.task
+                if task is not None and not task.done.is_set():
+                    # Each waiting request holds a web server thread, reply at once when there are too many
+                    if not channel.waiting_slots.acquire(blocking=False):
+                        channel.record_passive_reply("rejected")
+                        replyPost = create_reply("【正在思考中，回复任意文字尝试获取回复】", msg)
+                        return encrypt_func(replyPost.render())
+                    try:
+                        # Woken up by the worker as soon as the reply is cached
+                        finished = task.done.wait(max(request_time + PASSIVE_REPLY_WAIT - time.time(), 0))
+                        if not finished and request_cnt < 3:
+                            # keep the connection until it is closed by Wechat official server,
+                            # an early response would be taken as the final reply and stop the retries
+                            time.sleep(max(request_time + WECHAT_REQUEST_TIMEOUT + 1 - time.time(), 0))
+                            return "success"
+                    finally:
+                        channel.waiting_slots.release()
+                    if not finished:  # request_cnt == 3:
                         # return timeout message
+                        channel.record_passive_reply("timeout")
                         reply_text = "【正在思考中，回复任意文字尝试获取回复】"
                         replyPost = create_reply(reply_text, msg)
                         return encrypt_func(replyPost.render())
 
                 # reply is ready
-                channel.request_cnt.pop(message_id)
+                channel.requests.pop(message_id, None)
 
                 # no return because of bandwords or other reasons
-                if from_user not in channel.cache_dict and from_user not in channel.running:
+                if not channel.cache_dict.get(from_user):
                     return "success"
 
                 # Only one request can access to the cached data
@@ -134,21 +139,29 @@ class Query:
                     (reply_type, reply_content) = channel.cache_dict[from_user].pop(0)
                     if not channel.cache_dict[from_user]:  # If popping the message makes the list empty, delete the user entry from cache
                         del channel.cache_dict[from_user]
-                except IndexError:
+                except (IndexError, KeyError):
                     return "success"
 
+                if task is not None and not task.delivered:
+                    task.delivered = True
+                    channel.record_passive_reply(("first_window", "second_window", "third_window")[min(request_cnt, 3) - 1], task)
+
                 if reply_type == "text":
-                    if len(reply_content.encode("utf8")) <= MAX_UTF8_LEN:
+                    continue_text = "\n【未完待续，回复任意文字以继续】"
+                    # more cached replies, or the rest of a partial reply is still being generated
+                    to_be_continued = channel.cache_dict.get(from_user) or from_user in channel.tasks
+                    if not to_be_continued and len(reply_content.encode("utf8")) <= MAX_UTF8_LEN:
                         reply_text = reply_content
+                    elif len(reply_content.encode("utf8")) + len(continue_text.encode("utf-8")) <= MAX_UTF8_LEN:
+                        reply_text = reply_content + continue_text
                     else:
-                        continue_text = "\n【未完待续，回复任意文字以继续】"
                         splits = split_string_by_utf8_length(
                             reply_content,
                             MAX_UTF8_LEN - len(continue_text.encode("utf-8")),
                             max_split=1,
                         )
                         reply_text = splits[0] + continue_text
-                        channel.cache_dict[from_user].append(("text", splits[1]))
+                        channel.cache_dict[from_user].insert(0, ("text", splits[1]))
 
                     logger.info(
                         "[wechatmp] Request {} do send to {} {}: {}\n{}".format(
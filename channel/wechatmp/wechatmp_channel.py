@@ -1,12 +1,11 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import imghdr
-import io
 import os
 import threading
 import time
+from concurrent.futures import Future
 
-import requests
 import web
 from wechatpy.crypto import WeChatCrypto
 from wechatpy.exceptions import WeChatClientException
@@ -17,7 +16,9 @@ from bridge.reply import *
 from channel.chat_channel import ChatChannel
 from channel.wechatmp.common import *
 from channel.wechatmp.wechatmp_client import WechatMPClient
+from common.expired_dict import ExpiredDict
 from common.log import logger
+from common.media_pipeline import MediaPipeline, pace
 from common.singleton import singleton
 from common.utils import split_string_by_utf8_length, remove_markdown_symbol
 from config import conf
@@ -31,6 +32,25 @@ from voice.audio_convert import any_to_mp3, split_audio
 #         private_key='/ssl/cert.key')
 
 
+class ReplyTask(object):
+    """一次回复生成任务，处理完成(无论成功失败)后由线程池回调设置done"""
+
+    def __init__(self, from_user):
+        self.from_user = from_user
+        self.start_time = time.time()
+        self.done = threading.Event()
+        self.delivered = False  # 首条回复是否已经通过被动回复发出
+
+
+class PassiveRequest(object):
+    """用户的一条消息，微信服务器对同一message_id最多请求3次，每次等待5秒"""
+
+    def __init__(self, message_id, task=None):
+        self.message_id = message_id
+        self.task = task  # 需要等待的回复任务，回复已在缓存中时为None
+        self.request_cnt = 0
+
+
 @singleton
 class WechatMPChannel(ChatChannel):
     def __init__(self, passive_reply=True):
@@ -45,13 +65,25 @@ class WechatMPChannel(ChatChannel):
         self.crypto = None
         if aes_key:
             self.crypto = WeChatCrypto(token, aes_key, appid)
+        # Download, transcode and upload reply media in worker pools, identical media reuse the uploaded media_id
+        self.media_pipeline = MediaPipeline(
+            "wechatmp",
+            self._upload_media,
+            "material.add" if self.passive_reply else "media.upload",
+            dedupe_ttl=conf().get("wechat_media_dedupe_ttl", 86400),
+            permanent=self.passive_reply,
+        )
         if self.passive_reply:
             # Cache the reply to the user's first message
             self.cache_dict = defaultdict(list)
-            # Record whether the current message is being processed
-            self.running = set()
-            # Count the request from wechat official server by message_id
-            self.request_cnt = dict()
+            # The reply task currently being processed for each user
+            self.tasks = dict()
+            # The request from wechat official server by message_id, expires after the 15s retry window
+            self.requests = ExpiredDict(60)
+            # Bound the web server threads held while waiting for replies
+            self.waiting_slots = threading.BoundedSemaphore(conf().get("wechatmp_max_waiting_requests", 8))
+            self._stats_lock = threading.Lock()
+            self.passive_stats = {"delivered": 0, "first_window": 0, "second_window": 0, "third_window": 0, "timeout": 0, "rejected": 0}
             # The permanent media need to be deleted to avoid media number limit
             self.delete_media_loop = asyncio.new_event_loop()
             t = threading.Thread(target=self.start_loop, args=(self.delete_media_loop,))
@@ -72,6 +104,9 @@ class WechatMPChannel(ChatChannel):
         loop.run_forever()
 
     async def delete_media(self, media_id):
+        if not self.media_pipeline.release(media_id):
+            logger.debug("[wechatmp] permanent media {} is still in use".format(media_id))
+            return
         logger.debug("[wechatmp] permanent media {} will be deleted in 10s".format(media_id))
         await asyncio.sleep(10)
         self.client.material.delete(media_id)
@@ -89,92 +124,21 @@ class WechatMPChannel(ChatChannel):
                 duration, files = split_audio(voice_file_path, 60 * 1000)
                 if len(files) > 1:
                     logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
-
-                for path in files:
-                    # support: <2M, <60s, mp3/wma/wav/amr
-                    try:
-                        with open(path, "rb") as f:
-                            response = self.client.material.add("voice", f)
-                            logger.debug("[wechatmp] upload voice response: {}".format(response))
-                            f_size = os.fstat(f.fileno()).st_size
-                            time.sleep(1.0 + 2 * f_size / 1024 / 1024)
-                            # todo check media_id
-                    except WeChatClientException as e:
-                        logger.error("[wechatmp] upload voice failed: {}".format(e))
-                        return
-                    media_id = response["media_id"]
+                # support: <2M, <60s, mp3/wma/wav/amr
+                media_ids = self._upload_all([self.media_pipeline.submit(path, "voice") for path in files], "voice")
+                if media_ids is None:
+                    return
+                for media_id in media_ids:
                     logger.info("[wechatmp] voice uploaded, receiver {}, media_id {}".format(receiver, media_id))
                     self.cache_dict[receiver].append(("voice", media_id))
-
-            elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
-                img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
-                image_storage = io.BytesIO()
-                for block in pic_res.iter_content(1024):
-                    image_storage.write(block)
-                image_storage.seek(0)
-                image_type = imghdr.what(image_storage)
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
-                content_type = "image/" + image_type
-                try:
-                    response = self.client.material.add("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
-                except WeChatClientException as e:
-                    logger.error("[wechatmp] upload image failed: {}".format(e))
-                    return
-                media_id = response["media_id"]
-                logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
-            elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
-                image_storage = reply.content
-                image_storage.seek(0)
-                image_type = imghdr.what(image_storage)
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
-                content_type = "image/" + image_type
-                try:
-                    response = self.client.material.add("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
-                except WeChatClientException as e:
-                    logger.error("[wechatmp] upload image failed: {}".format(e))
-                    return
-                media_id = response["media_id"]
-                logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
-            elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
-                video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
-                video_storage = io.BytesIO()
-                for block in video_res.iter_content(1024):
-                    video_storage.write(block)
-                video_storage.seek(0)
-                video_type = 'mp4'
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
-                content_type = "video/" + video_type
-                try:
-                    response = self.client.material.add("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
-                except WeChatClientException as e:
-                    logger.error("[wechatmp] upload video failed: {}".format(e))
-                    return
-                media_id = response["media_id"]
-                logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
-
-            elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
-                video_storage = reply.content
-                video_storage.seek(0)
-                video_type = 'mp4'
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
-                content_type = "video/" + video_type
-                try:
-                    response = self.client.material.add("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
-                except WeChatClientException as e:
-                    logger.error("[wechatmp] upload video failed: {}".format(e))
+            elif reply.type in [ReplyType.IMAGE_URL, ReplyType.IMAGE, ReplyType.VIDEO_URL, ReplyType.VIDEO]:
+                # IMAGE_URL/VIDEO_URL 从网络下载，IMAGE/VIDEO 从文件读取
+                media_type = "image" if reply.type in [ReplyType.IMAGE_URL, ReplyType.IMAGE] else "video"
+                media_ids = self._upload_all([self.media_pipeline.submit(reply.content, media_type)], media_type)
+                if media_ids is None:
                     return
-                media_id = response["media_id"]
-                logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
+                logger.info("[wechatmp] {} uploaded, receiver {}, media_id {}".format(media_type, receiver, media_ids[0]))
+                self.cache_dict[receiver].append((media_type, media_ids[0]))
 
         else:
             if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
@@ -182,123 +146,131 @@ class WechatMPChannel(ChatChannel):
                 texts = split_string_by_utf8_length(reply_text, MAX_UTF8_LEN)
                 if len(texts) > 1:
                     logger.info("[wechatmp] text too long, split into {} parts".format(len(texts)))
-                for i, text in enumerate(texts):
+                for text in texts:
+                    pace("message.send")
                     self.client.message.send_text(receiver, text)
-                    if i != len(texts) - 1:
-                        time.sleep(0.5)  # 休眠0.5秒，防止发送过快乱序
                 logger.info("[wechatmp] Do send text to {}: {}".format(receiver, reply_text))
             elif reply.type == ReplyType.VOICE:
-                try:
-                    file_path = reply.content
-                    file_name = os.path.basename(file_path)
-                    file_type = os.path.splitext(file_name)[1]
-                    if file_type == ".mp3":
-                        file_type = "audio/mpeg"
-                    elif file_type == ".amr":
-                        file_type = "audio/amr"
-                    else:
-                        mp3_file = os.path.splitext(file_path)[0] + ".mp3"
-                        any_to_mp3(file_path, mp3_file)
-                        file_path = mp3_file
-                        file_name = os.path.basename(file_path)
-                        file_type = "audio/mpeg"
-                    logger.info("[wechatmp] file_name: {}, file_type: {} ".format(file_name, file_type))
-                    media_ids = []
-                    duration, files = split_audio(file_path, 60 * 1000)
-                    if len(files) > 1:
-                        logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
-                    for path in files:
-                        # support: <2M, <60s, AMR\MP3
-                        response = self.client.media.upload("voice", (os.path.basename(path), open(path, "rb"), file_type))
-                        logger.debug("[wechatcom] upload voice response: {}".format(response))
-                        media_ids.append(response["media_id"])
+                file_path = reply.content
+                if os.path.splitext(file_path)[1] not in [".mp3", ".amr"]:
+                    mp3_file = os.path.splitext(file_path)[0] + ".mp3"
+                    any_to_mp3(file_path, mp3_file)
+                    file_path = mp3_file
+                logger.info("[wechatmp] file_name: {}".format(os.path.basename(file_path)))
+                duration, files = split_audio(file_path, 60 * 1000)
+                if len(files) > 1:
+                    logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
+                # support: <2M, <60s, AMR\MP3
+                media_ids = self._upload_all([self.media_pipeline.submit(path, "voice") for path in files], "voice")
+                for path in set(files + [file_path]):
+                    try:
                         os.remove(path)
-                except WeChatClientException as e:
-                    logger.error("[wechatmp] upload voice failed: {}".format(e))
+                    except Exception:
+                        pass
+                if media_ids is None:
                     return
 
-                try:
-                    os.remove(file_path)
-                except Exception:
-                    pass
-
                 for media_id in media_ids:
+                    pace("message.send")
                     self.client.message.send_voice(receiver, media_id)
-                    time.sleep(1)
                 logger.info("[wechatmp] Do send voice to {}".format(receiver))
-            elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
-                img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
-                image_storage = io.BytesIO()
-                for block in pic_res.iter_content(1024):
-                    image_storage.write(block)
-                image_storage.seek(0)
-                image_type = imghdr.what(image_storage)
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
-                content_type = "image/" + image_type
-                try:
-                    response = self.client.media.upload("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
-                except WeChatClientException as e:
-                    logger.error("[wechatmp] upload image failed: {}".format(e))
+            elif reply.type in [ReplyType.IMAGE_URL, ReplyType.IMAGE, ReplyType.VIDEO_URL, ReplyType.VIDEO]:
+                media_type = "image" if reply.type in [ReplyType.IMAGE_URL, ReplyType.IMAGE] else "video"
+                media_ids = self._upload_all([self.media_pipeline.submit(reply.content, media_type)], media_type)
+                if media_ids is None:
                     return
-                self.client.message.send_image(receiver, response["media_id"])
-                logger.info("[wechatmp] Do send image to {}".format(receiver))
-            elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
-                image_storage = reply.content
-                image_storage.seek(0)
-                image_type = imghdr.what(image_storage)
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
-                content_type = "image/" + image_type
-                try:
-                    response = self.client.media.upload("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
-                except WeChatClientException as e:
-                    logger.error("[wechatmp] upload image failed: {}".format(e))
-                    return
-                self.client.message.send_image(receiver, response["media_id"])
-                logger.info("[wechatmp] Do send image to {}".format(receiver))
-            elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
-                video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
-                video_storage = io.BytesIO()
-                for block in video_res.iter_content(1024):
-                    video_storage.write(block)
-                video_storage.seek(0)
-                video_type = 'mp4'
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
-                content_type = "video/" + video_type
-                try:
-                    response = self.client.media.upload("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
-                except WeChatClientException as e:
-                    logger.error("[wechatmp] upload video failed: {}".format(e))
-                    return
-                self.client.message.send_video(receiver, response["media_id"])
-                logger.info("[wechatmp] Do send video to {}".format(receiver))
-            elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
-                video_storage = reply.content
-                video_storage.seek(0)
-                video_type = 'mp4'
-                filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
-                content_type = "video/" + video_type
-                try:
-                    response = self.client.media.upload("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
-                except WeChatClientException as e:
-                    logger.error("[wechatmp] upload video failed: {}".format(e))
-                    return
-                self.client.message.send_video(receiver, response["media_id"])
-                logger.info("[wechatmp] Do send video to {}".format(receiver))
+                pace("message.send")
+                if media_type == "image":
+                    self.client.message.send_image(receiver, media_ids[0])
+                else:
+                    self.client.message.send_video(receiver, media_ids[0])
+                logger.info("[wechatmp] Do send {} to {}".format(media_type, receiver))
         return
 
-    def _success_callback(self, session_id, context, **kwargs):  # 线程异常结束时的回调函数
-        logger.debug("[wechatmp] Success to generate reply, msgId={}".format(context["msg"].msg_id))
+    def _upload_all(self, futures, media_type):
+        """按顺序等待上传结果，任何一个上传失败时返回None"""
+        try:
+            return [future.result() for future in futures]
+        except WeChatClientException as e:
+            logger.error("[wechatmp] upload {} failed: {}".format(media_type, e))
+            return None
+
+    def _upload_media(self, media_type, filename, storage):
+        """被动回复需要上传永久素材，主动回复使用临时素材"""
+        if media_type == "image":
+            image_type = imghdr.what(storage)
+            filename, content_type = "image.{}".format(image_type), "image/{}".format(image_type)
+        elif media_type == "video":
+            filename, content_type = "video.mp4", "video/mp4"
+        else:
+            filename = filename or "voice.mp3"
+            content_type = VOICE_CONTENT_TYPES.get(os.path.splitext(filename)[1], "audio/mpeg")
         if self.passive_reply:
-            self.running.remove(session_id)
+            response = self.client.material.add(media_type, (filename, storage, content_type))
+        else:
+            response = self.client.media.upload(media_type, (filename, storage, content_type))
+        logger.debug("[wechatmp] upload {} response: {}".format(media_type, response))
+        return response["media_id"]
+
+    def start_task(self, from_user, context) -> ReplyTask:
+        """开始生成回复，回复通过send放入cache_dict后任务的done会被设置"""
+        task = ReplyTask(from_user)
+        self.tasks[from_user] = task
+        future = self.produce(context)
+        future.add_done_callback(lambda f: self._finish_task(task))
+        return task
+
+    def start_continuation(self, from_user, rest: Future) -> ReplyTask:
+        """
+        回复在截止时间前只生成了一部分时由Bridge调用，剩余内容生成完后放入cache_dict，
+        用户的下一条消息会等待并取走续篇，而不是开始新的回复
+        """
+        task = ReplyTask(from_user)
+        self.tasks[from_user] = task
+
+        def on_rest(f: Future):
+            text = remove_markdown_symbol(f.result())
+            if text:
+                logger.info("[wechatmp] continuation cached, receiver {}\n{}".format(from_user, text))
+                self.cache_dict[from_user].append(("text", text))
+            self._finish_task(task)
+
+        rest.add_done_callback(on_rest)
+        return task
+
+    def _finish_task(self, task: ReplyTask):
+        if self.tasks.get(task.from_user) is task:
+            del self.tasks[task.from_user]
+        task.done.set()
+
+    def record_passive_reply(self, event, task: ReplyTask = None):
+        """
+        记录被动回复的结果
+        :param event: first_window/second_window/third_window 表示首条回复在第几次请求(每次5秒)中发出，
+                      timeout 表示3次请求都没等到回复，rejected 表示等待的请求过多未等待
+        """
+        with self._stats_lock:
+            self.passive_stats[event] += 1
+            if event.endswith("_window"):
+                self.passive_stats["delivered"] += 1
+        if task is not None:
+            logger.debug("[wechatmp] reply delivered in {}, cost {:.2f}s".format(event, time.time() - task.start_time))
+
+    def get_passive_reply_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.passive_stats)
+        stats["first_window_rate"] = round(stats["first_window"] / stats["delivered"], 4) if stats["delivered"] else 0.0
+        stats["waiting_tasks"] = len(self.tasks)
+        return stats
+
+    def get_dispatch_stats(self) -> dict:
+        stats = super().get_dispatch_stats()
+        if self.passive_reply:
+            stats["passive_reply"] = self.get_passive_reply_stats()
+        return stats
+
+    def _success_callback(self, session_id, context, **kwargs):  # 线程正常结束时的回调函数
+        logger.debug("[wechatmp] Success to generate reply, msgId={}".format(context["msg"].msg_id))
 
     def _fail_callback(self, session_id, exception, context, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("[wechatmp] Fail to generate reply to user, msgId={}, exception={}".format(context["msg"].msg_id, exception))
-        if self.passive_reply:
-            assert session_id not in self.cache_dict
-            self.running.remove(session_id)
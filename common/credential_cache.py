@@ -0,0 +1,141 @@
+"""
+短期凭证(access token)缓存
+
+百度、飞书、阿里云等接口的access token有效期从几十分钟到几十天不等，
+原先各模块要么每次请求都重新获取，要么各自实现一套过期判断。
+这里按(provider, app)统一缓存，并在过期前由后台线程提前刷新，
+同一凭证的并发刷新只会发出一次请求，正常情况下回复消息时不再需要额外的网络往返。
+"""
+import threading
+import time
+
+from common.log import logger
+
+
+class _Entry(object):
+    __slots__ = ("fetcher", "state", "refresh_at", "lock")
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self.state = (None, 0.0)  # (token, 过期时间monotonic)，整体替换，读取时无需加锁
+        self.refresh_at = None  # 下次后台刷新时间，None表示不需要后台刷新
+        self.lock = threading.Lock()  # 保证同一凭证同时只有一个刷新请求
+
+
+class CredentialCache(object):
+    """
+    :param refresh_ahead: 提前多少秒在后台刷新，有效期较短的凭证最晚在有效期过半时刷新
+    :param retry_interval: 后台刷新失败后的重试间隔，单位秒
+    :param expiry_margin: 判断过期时预留的时间，避免网络延迟导致使用刚好过期的凭证
+    """
+
+    def __init__(self, refresh_ahead=300, retry_interval=30, expiry_margin=30):
+        self.refresh_ahead = refresh_ahead
+        self.retry_interval = retry_interval
+        self.expiry_margin = expiry_margin
+        self._entries = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def get(self, provider, app, fetcher):
+        """
+        获取凭证，缓存中没有或已过期时同步获取
+        :param provider: 服务提供方，如 baidu_wenxin、feishu
+        :param app: 应用标识，如 app_id、api_key，同一提供方的不同应用分别缓存
+        :param fetcher: 无参函数，返回 (token, 有效期秒数)，获取失败时应抛出异常
+        :return: token
+        """
+        entry = self._entry((provider, app), fetcher)
+        token, expire_at = entry.state
+        if token is not None and time.monotonic() < expire_at:
+            return token
+        with entry.lock:
+            # 等待锁的期间其他线程可能已经刷新完成
+            token, expire_at = entry.state
+            if token is not None and time.monotonic() < expire_at:
+                return token
+            return self._refresh(provider, app, entry)
+
+    def invalidate(self, provider, app):
+        """接口返回凭证失效时调用，下次get会重新获取"""
+        entry = self._entries.get((provider, app))
+        if entry is not None:
+            entry.state = (None, 0.0)
+
+    def _entry(self, key, fetcher):
+        entry = self._entries.get(key)
+        if entry is None:
+            with self._cond:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = _Entry(fetcher)
+                    self._entries[key] = entry
+        entry.fetcher = fetcher
+        return entry
+
+    def _refresh(self, provider, app, entry):
+        # 调用方需持有entry.lock
+        token, ttl = entry.fetcher()
+        if not token:
+            raise Exception("[CredentialCache] empty token, provider={}".format(provider))
+        ttl = max(float(ttl), 0.0)
+        now = time.monotonic()
+        entry.state = (token, now + ttl - min(self.expiry_margin, ttl / 10))
+        with self._cond:
+            entry.refresh_at = now + max(ttl - self.refresh_ahead, ttl / 2)
+            self._ensure_thread()
+            self._cond.notify()
+        logger.debug("[CredentialCache] token refreshed, provider={}, app={}, expires_in={}s".format(provider, app, int(ttl)))
+        return token
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="credential_refresher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due = self._wait_due()
+            for key, entry in due:
+                # 前台正在同步获取时跳过，避免重复请求
+                if not entry.lock.acquire(blocking=False):
+                    continue
+                try:
+                    self._refresh(key[0], key[1], entry)
+                except Exception as e:
+                    logger.warn("[CredentialCache] background refresh failed, provider={}, error={}".format(key[0], e))
+                    with self._cond:
+                        entry.refresh_at = time.monotonic() + self.retry_interval
+                finally:
+                    entry.lock.release()
+
+    def _wait_due(self):
+        # 调用方需持有self._cond
+        while True:
+            now = time.monotonic()
+            due = []
+            next_at = None
+            for key, entry in self._entries.items():
+                if entry.refresh_at is None:
+                    continue
+                if entry.refresh_at <= now:
+                    entry.refresh_at = None
+                    due.append((key, entry))
+                elif next_at is None or entry.refresh_at < next_at:
+                    next_at = entry.refresh_at
+            if due:
+                return due
+            self._cond.wait(None if next_at is None else next_at - now)
+
+
+_cache = CredentialCache()
+
+
+def get_credential(provider, app, fetcher):
+    """从进程内共享的凭证缓存中获取token，参数同CredentialCache.get"""
+    return _cache.get(provider, app, fetcher)
+
+
+def invalidate_credential(provider, app):
+    _cache.invalidate(provider, app)
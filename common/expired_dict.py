@@ -1,28 +1,70 @@
-from datetime import datetime, timedelta
+import copy
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from common.log import logger
 
 
 class ExpiredDict(dict):
-    def __init__(self, expires_in_seconds):
+    """
+    带过期时间的字典，每次读写都会刷新该key的过期时间
+
+    所有key的有效期相同，因此按最近访问顺序排列的索引同时也是按过期时间排列的索引：
+    最早过期的key总在最前面，清理过期数据时只需从头部弹出，均摊O(1)。
+    同一顺序也就是LRU顺序，设置max_size后超出容量时从头部淘汰。
+
+    :param expires_in_seconds: 有效期，单位秒
+    :param max_size: 最大条目数，None表示不限制
+    :param on_evict: 条目因过期或超出容量被移除时的回调 on_evict(key, value, reason)，reason为"expired"或"capacity"
+    :param sweep_interval: 后台清理间隔，单位秒，为0时只在读写时清理
+
+    支持copy.copy、copy.deepcopy和pickle，副本有自己的锁和过期时间索引，条目保留原来的剩余有效期
+    """
+
+    def __init__(self, expires_in_seconds, max_size=None, on_evict=None, sweep_interval=60):
         super().__init__()
         self.expires_in_seconds = expires_in_seconds
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self._deadlines = OrderedDict()  # key -> 过期时间(monotonic)
+        self.sweep_interval = sweep_interval
+        self._lock = threading.RLock()
+        if sweep_interval:
+            _sweeper.register(self, sweep_interval)
 
     def __getitem__(self, key):
-        value, expiry_time = super().__getitem__(key)
-        if datetime.now() > expiry_time:
-            del self[key]
+        with self._lock:
+            expired = self._sweep(time.monotonic())
+            if key not in self._deadlines:
+                found = False
+            else:
+                found = True
+                self._touch(key)
+                value = dict.__getitem__(self, key)
+        self._notify(expired, "expired")
+        if not found:
             raise KeyError("expired {}".format(key))
-        self.__setitem__(key, value)
         return value
 
     def __setitem__(self, key, value):
-        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
-        super().__setitem__(key, (value, expiry_time))
+        with self._lock:
+            expired = self._sweep(time.monotonic())
+            dict.__setitem__(self, key, value)
+            self._touch(key)
+            evicted = []
+            if self.max_size is not None:
+                while len(self._deadlines) > self.max_size:
+                    old_key, _ = self._deadlines.popitem(last=False)
+                    evicted.append((old_key, dict.pop(self, old_key)))
+        self._notify(expired, "expired")
+        self._notify(evicted, "capacity")
 
-    def get(self, key, default=None):
-        try:
-            return self[key]
-        except KeyError:
-            return default
+    def __delitem__(self, key):
+        with self._lock:
+            dict.__delitem__(self, key)
+            del self._deadlines[key]
 
     def __contains__(self, key):
         try:
@@ -31,12 +73,231 @@ class ExpiredDict(dict):
         except KeyError:
             return False
 
+    def __len__(self):
+        self.sweep()
+        return dict.__len__(self)
+
+    def __iter__(self):
+        return self.keys().__iter__()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        with self._lock:
+            expired = self._sweep(time.monotonic())
+            if key in self._deadlines:
+                del self._deadlines[key]
+            value = dict.pop(self, key, *default)
+        self._notify(expired, "expired")
+        return value
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            try:
+                return self[key]
+            except KeyError:
+                self[key] = default
+                return default
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        with self._lock:
+            dict.clear(self)
+            self._deadlines.clear()
+
     def keys(self):
-        keys = list(super().keys())
-        return [key for key in keys if key in self]
+        """未过期的key列表，不会刷新过期时间"""
+        self.sweep()
+        with self._lock:
+            return list(self._deadlines.keys())
+
+    def values(self):
+        self.sweep()
+        with self._lock:
+            return [dict.__getitem__(self, key) for key in self._deadlines]
 
     def items(self):
-        return [(key, self[key]) for key in self.keys()]
+        self.sweep()
+        with self._lock:
+            return [(key, dict.__getitem__(self, key)) for key in self._deadlines]
 
-    def __iter__(self):
-        return self.keys().__iter__()
+    def sweep(self):
+        """移除所有已过期的条目，返回移除的数量"""
+        with self._lock:
+            expired = self._sweep(time.monotonic())
+        self._notify(expired, "expired")
+        return len(expired)
+
+    def __copy__(self):
+        return self._copy(lambda value: value)
+
+    def __deepcopy__(self, memo):
+        return self._copy(lambda value: copy.deepcopy(value, memo), memo)
+
+    def __reduce__(self):
+        # 进程间的monotonic时钟不同，按剩余有效期序列化
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            entries = [(key, dict.__getitem__(self, key), deadline - now) for key, deadline in self._deadlines.items()]
+        return _rebuild, (type(self), self.expires_in_seconds, self.max_size, self.on_evict, self.sweep_interval, entries, self._extra_attrs())
+
+    def _copy(self, copy_value, memo=None):
+        """副本有自己的锁和过期时间索引，条目的剩余有效期和LRU顺序与原字典相同"""
+        with self._lock:
+            self._sweep(time.monotonic())
+            entries = [(key, dict.__getitem__(self, key), deadline) for key, deadline in self._deadlines.items()]
+        result = type(self).__new__(type(self))
+        if memo is not None:
+            memo[id(self)] = result
+        ExpiredDict.__init__(result, self.expires_in_seconds, self.max_size, self.on_evict, self.sweep_interval)
+        for key, value, deadline in entries:
+            dict.__setitem__(result, key, copy_value(value))
+            result._deadlines[key] = deadline
+        for name, value in self._extra_attrs().items():
+            setattr(result, name, copy_value(value))
+        return result
+
+    def _extra_attrs(self) -> dict:
+        # 子类添加的属性
+        return {name: value for name, value in vars(self).items() if name not in _OWN_ATTRS}
+
+    def _touch(self, key):
+        self._deadlines[key] = time.monotonic() + self.expires_in_seconds
+        self._deadlines.move_to_end(key)
+
+    def _sweep(self, now):
+        expired = []
+        deadlines = self._deadlines
+        while deadlines:
+            key = next(iter(deadlines))
+            if deadlines[key] >= now:
+                break
+            del deadlines[key]
+            expired.append((key, dict.pop(self, key)))
+        return expired
+
+    def _notify(self, evicted, reason):
+        if not evicted or self.on_evict is None:
+            return
+        for key, value in evicted:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                logger.warn("[ExpiredDict] on_evict callback failed, key={}, error={}".format(key, e))
+
+
+_OWN_ATTRS = frozenset(("expires_in_seconds", "max_size", "on_evict", "sweep_interval", "_deadlines", "_lock"))
+
+
+def _rebuild(cls, expires_in_seconds, max_size, on_evict, sweep_interval, entries, attrs):
+    result = cls.__new__(cls)
+    ExpiredDict.__init__(result, expires_in_seconds, max_size, on_evict, sweep_interval)
+    now = time.monotonic()
+    for key, value, remaining in entries:
+        dict.__setitem__(result, key, value)
+        result._deadlines[key] = now + remaining
+    for name, value in attrs.items():
+        setattr(result, name, value)
+    return result
+
+
+class _Sweeper(object):
+    """所有ExpiredDict共享的后台清理线程，持有弱引用，不影响字典被回收"""
+
+    def __init__(self):
+        self.refs = {}  # id(dict) -> weakref，dict不可哈希，不能使用WeakSet
+        self.interval = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, expired_dict, interval):
+        with self.lock:
+            key = id(expired_dict)
+            self.refs[key] = weakref.ref(expired_dict, lambda _, key=key: self.refs.pop(key, None))
+            self.interval = interval if self.interval is None else min(self.interval, interval)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="expired_dict_sweeper", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            for ref in list(self.refs.values()):
+                expired_dict = ref()
+                if expired_dict is None:
+                    continue
+                try:
+                    expired_dict.sweep()
+                except Exception as e:
+                    logger.warn("[ExpiredDict] sweep failed: {}".format(e))
+
+
+_sweeper = _Sweeper()
+
+
+if __name__ == "__main__":
+    # 与旧实现(datetime + 每次读取重写条目)的性能对比
+    from datetime import datetime, timedelta
+
+    class LegacyExpiredDict(dict):
+        def __init__(self, expires_in_seconds):
+            super().__init__()
+            self.expires_in_seconds = expires_in_seconds
+
+        def __getitem__(self, key):
+            value, expiry_time = super().__getitem__(key)
+            if datetime.now() > expiry_time:
+                del self[key]
+                raise KeyError("expired {}".format(key))
+            self.__setitem__(key, value)
+            return value
+
+        def __setitem__(self, key, value):
+            expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
+            super().__setitem__(key, (value, expiry_time))
+
+        def __contains__(self, key):
+            try:
+                self[key]
+                return True
+            except KeyError:
+                return False
+
+        def keys(self):
+            keys = list(super().keys())
+            return [key for key in keys if key in self]
+
+    def bench(cls, n=100000):
+        d = cls(3600)
+        start = time.perf_counter()
+        for i in range(n):
+            d[i] = True
+        set_cost = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(n):
+            _ = i in d
+        get_cost = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(10):
+            d.keys()
+        keys_cost = time.perf_counter() - start
+        print("{:<18} set {:.3f}s  contains {:.3f}s  keys()x10 {:.3f}s".format(cls.__name__, set_cost, get_cost, keys_cost))
+
+    bench(LegacyExpiredDict)
+    bench(ExpiredDict)
+
+    # 过期数据不被访问也会被清理
+    d = ExpiredDict(0.05, sweep_interval=0)
+    for i in range(1000):
+        d[i] = i
+    time.sleep(0.1)
+    d["new"] = 1
+    print("entries after expiry: {}".format(dict.__len__(d)))
@@ -0,0 +1,90 @@
+"""
+共享的HTTP连接池
+
+各个bot、语音、翻译和通道模块原先每次请求都直接调用requests.post/get，
+每条消息都要重新建立TCP+TLS连接。这里按(base_url, proxy)缓存保持长连接的requests.Session，
+同一服务的请求复用连接池中的连接，握手只在第一次请求或连接失效时发生。
+"""
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import conf
+
+
+class PooledSession(requests.Session):
+    """
+    带默认超时的Session，调用方显式传入timeout时以调用方为准
+    不保存响应中的cookie，避免共享的Session在不同用户的请求之间传递状态
+    """
+
+    def __init__(self, timeout=None, pool_size=10, max_retries=2, proxy=None):
+        super().__init__()
+        self.default_timeout = timeout
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        # 只对连接失败和网关类错误重试，读超时不重试，避免重复提交非幂等的POST请求
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            status_forcelist=(502, 503, 504),
+            backoff_factor=0.3,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        if proxy:
+            self.proxies.update({"http": proxy, "https": proxy})
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        return super().request(method, url, **kwargs)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _origin(base_url):
+    if not base_url:
+        return ""
+    parts = urlsplit(base_url)
+    return "{}://{}".format(parts.scheme, parts.netloc).lower()
+
+
+def get_session(base_url=None, proxy=None) -> requests.Session:
+    """
+    获取共享的Session，同一(base_url的协议和域名, proxy)在进程内只创建一次
+    :param base_url: 服务地址，只取协议和域名部分；为空时返回通用的Session，用于下载图片等任意地址的请求
+    :param proxy: 代理地址，为空则不设置(仍会读取环境变量中的代理)
+    """
+    key = (_origin(base_url), proxy or "")
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = PooledSession(
+                    timeout=(conf().get("http_connect_timeout", 5), conf().get("http_read_timeout", 180)),
+                    pool_size=conf().get("http_pool_size", 10),
+                    max_retries=conf().get("http_max_retries", 2),
+                    proxy=proxy,
+                )
+                _sessions[key] = session
+    return session
+
+
+def close_all_sessions():
+    """关闭所有连接池，如重新加载配置后需要按新配置重建"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
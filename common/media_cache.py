@@ -0,0 +1,188 @@
+"""
+按内容寻址的网络文件缓存
+
+同一URL只下载一次，文件按内容的sha256存放在 缓存目录/<sha256>/<文件名>，内容相同的URL共用一份；
+URL与文件的对应关系、ETag和Last-Modified记录在 缓存目录/index.json，重启后仍然有效。
+距上次确认不超过revalidate_after秒时直接使用本地文件，不发出任何请求；超过后带If-None-Match/If-Modified-Since
+重新确认，服务端返回304时继续使用本地文件，内容有变化时才重新下载；确认失败时仍使用本地文件。
+get_bytes另在内存中按LRU保留最近使用的内容，总大小不超过memory_limit字节。
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import unquote, urlparse
+
+from common.http_client import get_session
+from common.log import logger
+
+_UNSAFE_NAME = re.compile(r"[^\w.\-]+")
+
+
+def _file_name(url):
+    name = unquote(os.path.basename(urlparse(url).path))
+    name = _UNSAFE_NAME.sub("_", name).strip("._")
+    return name[-128:] or "file"
+
+
+class MediaCache(object):
+    """
+    :param cache_dir: 缓存目录，不存在时自动创建
+    :param revalidate_after: 本地文件在该秒数内视为最新，0表示每次都向服务端确认
+    :param memory_limit: get_bytes在内存中保留的内容总大小，单位字节，0表示不保留
+    """
+
+    def __init__(self, cache_dir, revalidate_after=3600, memory_limit=64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.revalidate_after = revalidate_after
+        self.memory_limit = memory_limit
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        self.url_locks = {}  # url -> 下载锁，同一URL的并发请求只下载一次
+        self.memory = OrderedDict()  # sha256 -> bytes
+        self.memory_size = 0
+        self.stats = {"hits": 0, "memory_hits": 0, "revalidated": 0, "downloads": 0, "stale": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self.entries = self._load_index()  # url -> {"digest", "name", "etag", "last_modified", "checked_at", "size"}
+
+    def get_path(self, url) -> str:
+        """
+        :return: 本地文件路径，文件名与URL中的文件名相同
+        :raise: 没有本地文件且下载失败时抛出异常
+        """
+        entry = self._fetch(url)
+        return self._path(entry)
+
+    def get_bytes(self, url) -> bytes:
+        entry = self._fetch(url)
+        digest = entry["digest"]
+        with self.lock:
+            data = self.memory.get(digest)
+            if data is not None:
+                self.memory.move_to_end(digest)
+                self.stats["memory_hits"] += 1
+                return data
+        with open(self._path(entry), "rb") as f:
+            data = f.read()
+        self._remember(digest, data)
+        return data
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+            stats["memory_bytes"] = self.memory_size
+        return stats
+
+    def _fetch(self, url) -> dict:
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry and self._fresh(entry):
+                self.stats["hits"] += 1
+                return entry
+            url_lock = self.url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            # 等锁期间其他线程可能已经下载或确认过
+            with self.lock:
+                entry = self.entries.get(url)
+                if entry and self._fresh(entry):
+                    self.stats["hits"] += 1
+                    return entry
+            try:
+                return self._download(url, entry)
+            except Exception as e:
+                if entry and os.path.exists(self._path(entry)):
+                    logger.warning("[MediaCache] revalidate failed, use cached file, url={}, error={}".format(url, e))
+                    with self.lock:
+                        self.stats["stale"] += 1
+                    return entry
+                raise
+
+    def _fresh(self, entry) -> bool:
+        return time.time() - entry["checked_at"] < self.revalidate_after and os.path.exists(self._path(entry))
+
+    def _download(self, url, entry) -> dict:
+        headers = {}
+        if entry and os.path.exists(self._path(entry)):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        with get_session().get(url, headers=headers, stream=True) as res:
+            if res.status_code == 304 and headers:
+                entry = dict(entry, checked_at=time.time())
+                with self.lock:
+                    self.stats["revalidated"] += 1
+                self._save_entry(url, entry)
+                logger.debug("[MediaCache] not modified, url={}".format(url))
+                return entry
+            res.raise_for_status()
+            digest = hashlib.sha256()
+            tmp_path = os.path.join(self.cache_dir, ".download-{}".format(uuid.uuid4().hex))
+            size = 0
+            try:
+                with open(tmp_path, "wb") as f:
+                    for block in res.iter_content(64 * 1024):
+                        digest.update(block)
+                        f.write(block)
+                        size += len(block)
+                entry = {
+                    "digest": digest.hexdigest(),
+                    "name": _file_name(url),
+                    "etag": res.headers.get("ETag"),
+                    "last_modified": res.headers.get("Last-Modified"),
+                    "checked_at": time.time(),
+                    "size": size,
+                }
+                path = self._path(entry)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        with self.lock:
+            self.stats["downloads"] += 1
+        self._save_entry(url, entry)
+        logger.info("[MediaCache] downloaded url={}, size={}, sha256={}".format(url, size, entry["digest"]))
+        return entry
+
+    def _path(self, entry) -> str:
+        return os.path.join(self.cache_dir, entry["digest"], entry["name"])
+
+    def _remember(self, digest, data):
+        if len(data) > self.memory_limit // 4:
+            return
+        with self.lock:
+            if digest in self.memory:
+                return
+            self.memory[digest] = data
+            self.memory_size += len(data)
+            while self.memory_size > self.memory_limit:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_size -= len(evicted)
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("[MediaCache] failed to load index {}: {}".format(self.index_path, e))
+            return {}
+
+    def _save_entry(self, url, entry):
+        with self.lock:
+            self.entries[url] = entry
+            data = json.dumps(self.entries, ensure_ascii=False, indent=2)
+            tmp_path = "{}.{}.tmp".format(self.index_path, threading.get_ident())
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.index_path)
+            except OSError as e:
+                logger.warning("[MediaCache] failed to save index: {}".format(e))
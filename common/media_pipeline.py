@@ -0,0 +1,195 @@
+"""
+回复媒体的下载、转码、上传流水线
+
+通道发送图片、语音、视频时需要先把内容上传到平台换取media_id。流水线把这三步放到各自的线程池中，
+多段语音可以并行上传，一个回复在上传时另一个回复的下载也不必等待。
+相同内容(按下载后内容的sha256)在有效期内直接复用之前上传得到的media_id，并发的相同上传只会执行一次。
+上传和消息发送按接口限速，速率来自 wechat_api_rpm 配置，代替原来固定的sleep。
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from common.expired_dict import ExpiredDict
+from common.http_client import get_session
+from common.log import logger
+from common.token_bucket import TokenBucket
+from config import conf
+
+# 各接口每分钟的默认调用次数，可以通过 wechat_api_rpm 配置覆盖
+DEFAULT_API_RPM = {
+    "media.upload": 600,
+    "material.add": 60,
+    "message.send": 600,
+}
+
+
+_pacers = {}
+_pacers_lock = threading.Lock()
+
+
+def pace(endpoint):
+    """
+    按接口的调用频率等待，直到可以调用该接口
+    令牌桶容量为1，连续的调用会被均匀地隔开，同一用户的多条消息也不会因为发送过快而乱序
+    """
+    if endpoint not in _pacers:
+        with _pacers_lock:
+            if endpoint not in _pacers:
+                rpm = dict(DEFAULT_API_RPM, **(conf().get("wechat_api_rpm") or {})).get(endpoint)
+                _pacers[endpoint] = TokenBucket(rpm, capacity=1) if rpm else None
+    bucket = _pacers[endpoint]
+    if bucket is not None:
+        bucket.get_token()
+
+
+def _chain(future: Future, callback, result: Future):
+    """future完成后调用callback(future的结果)，异常直接传给result"""
+
+    def on_done(f: Future):
+        try:
+            callback(f.result())
+        except Exception as e:
+            result.set_exception(e)
+
+    future.add_done_callback(on_done)
+
+
+class MediaPipeline(object):
+    """
+    :param name: 名称，用于日志和线程名
+    :param upload: 上传函数 upload(media_type, filename, storage: BytesIO) -> media_id，filename可能为None
+    :param upload_endpoint: 上传接口名，用于限速，见 DEFAULT_API_RPM
+    :param dedupe_ttl: 相同内容复用media_id的有效期，单位秒，0表示不复用
+    :param permanent: 是否为永久素材。永久素材使用后会被删除，需要记录引用，最后一个引用释放后才能删除
+    """
+
+    def __init__(self, name, upload, upload_endpoint, dedupe_ttl=0, permanent=False, download_workers=4, transcode_workers=2, upload_workers=4):
+        self.name = name
+        self.upload = upload
+        self.upload_endpoint = upload_endpoint
+        self.permanent = permanent
+        self.download_pool = ThreadPoolExecutor(download_workers, thread_name_prefix="{}_download".format(name))
+        self.transcode_pool = ThreadPoolExecutor(transcode_workers, thread_name_prefix="{}_transcode".format(name))
+        self.upload_pool = ThreadPoolExecutor(upload_workers, thread_name_prefix="{}_upload".format(name))
+        self.media_ids = ExpiredDict(dedupe_ttl) if dedupe_ttl else None  # 内容hash -> media_id
+        self.hashes = {}  # media_id -> 内容hash，释放永久素材时从media_ids中移除
+        self.holders = Counter()  # media_id -> 尚未发送的引用数，只对永久素材记录
+        self.inflight = {}  # 内容hash -> 正在上传的Future
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def submit(self, source, media_type, filename=None, transcode=None) -> Future:
+        """
+        提交一个媒体
+        :param source: 网络url、本地文件路径、文件对象或bytes
+        :param media_type: image/voice/video
+        :param filename: 上传时使用的文件名，为空时取本地文件路径的文件名
+        :param transcode: 可选的转码函数 transcode(BytesIO) -> BytesIO，相同内容只会转码一次
+        :return: 结果为media_id的Future
+        """
+        if filename is None and isinstance(source, str) and not source.startswith("http"):
+            filename = os.path.basename(source)
+        result = Future()
+        _chain(self.download_pool.submit(self._load, source), lambda data: self._dedupe(data, media_type, filename, transcode, result), result)
+        return result
+
+    def release(self, media_id) -> bool:
+        """
+        释放一个永久素材的引用
+        :return: 没有其他引用时返回True，此时可以删除该素材
+        """
+        with self.lock:
+            self.holders[media_id] -= 1
+            if self.holders[media_id] > 0:
+                return False
+            del self.holders[media_id]
+            digest = self.hashes.pop(media_id, None)
+            if digest and self.media_ids is not None:
+                self.media_ids.pop(digest, None)
+        return True
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return dict(self.stats)
+
+    def _load(self, source) -> bytes:
+        if isinstance(source, bytes):
+            return source
+        if isinstance(source, str):
+            if source.startswith("http://") or source.startswith("https://"):
+                res = get_session().get(source, stream=True)
+                res.raise_for_status()
+                return b"".join(res.iter_content(64 * 1024))
+            with open(source, "rb") as f:
+                return f.read()
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return source.read()
+
+    def _dedupe(self, data: bytes, media_type, filename, transcode, result: Future):
+        digest = "{}:{}".format(media_type, hashlib.sha256(data).hexdigest())
+        with self.lock:
+            media_id = self.media_ids.get(digest) if self.media_ids is not None else None
+            if media_id is not None:
+                self._hold(media_id)
+                self.stats["reused"] += 1
+            else:
+                upload = self.inflight.get(digest)
+                if upload is None:
+                    upload = Future()
+                    # 先于等待者的回调执行，保证拿到media_id时已经记录
+                    upload.add_done_callback(lambda f: self._uploaded(digest, f))
+                    self.inflight[digest] = upload
+                    start = True
+                else:
+                    self.stats["joined"] += 1
+                    start = False
+        if media_id is not None:
+            logger.debug("[{}] reuse media_id {} for same {}".format(self.name, media_id, media_type))
+            result.set_result(media_id)
+            return
+        _chain(upload, lambda media_id: self._joined(media_id, result), result)
+        if not start:
+            return
+        storage = io.BytesIO(data)
+        if transcode:
+            _chain(self.transcode_pool.submit(transcode, storage), lambda out: self._submit_upload(media_type, filename, out, upload), upload)
+        else:
+            self._submit_upload(media_type, filename, storage, upload)
+
+    def _joined(self, media_id, result: Future):
+        with self.lock:
+            self._hold(media_id)
+        result.set_result(media_id)
+
+    def _submit_upload(self, media_type, filename, storage, upload: Future):
+        _chain(self.upload_pool.submit(self._upload, media_type, filename, storage), upload.set_result, upload)
+
+    def _upload(self, media_type, filename, storage):
+        storage.seek(0)
+        pace(self.upload_endpoint)
+        media_id = self.upload(media_type, filename, storage)
+        logger.debug("[{}] {} uploaded, size={}, media_id={}".format(self.name, media_type, storage.getbuffer().nbytes, media_id))
+        return media_id
+
+    def _uploaded(self, digest, upload: Future):
+        with self.lock:
+            self.inflight.pop(digest, None)
+            if upload.exception() is not None:
+                self.stats["failed"] += 1
+                return
+            self.stats["uploaded"] += 1
+            if self.media_ids is not None:
+                media_id = upload.result()
+                self.media_ids[digest] = media_id
+                if self.permanent:
+                    self.hashes[media_id] = digest
+
+    def _hold(self, media_id):
+        if self.permanent:
+            self.holders[media_id] += 1
+
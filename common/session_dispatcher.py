@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class _Task:
+    __slots__ = ("context", "handler", "future", "enqueue_time")
+
+    def __init__(self, context, handler):
+        self.context = context
+        self.handler = handler
+        self.future = Future()
+        self.enqueue_time = time.monotonic()
+
+
+class _SessionState:
+    __slots__ = ("queue", "running")
+
+    def __init__(self):
+        self.queue = deque()  # 等待处理的任务，按到达顺序排列
+        self.running = 0  # 正在线程池中处理的任务数
+
+
+class SessionDispatcher:
+    """
+    会话级消息调度器
+    同一会话内的消息按FIFO顺序处理，且同时最多有concurrency_in_session条在处理中；
+    不同会话共享同一个线程池并行处理。任务完成时直接调度该会话的下一条，不需要轮询线程。
+    """
+
+    def __init__(self, handler, max_workers=8, concurrency_in_session=1, stats_window=1024):
+        self.handler = handler
+        self.max_workers = max(1, int(max_workers))
+        self.concurrency = max(1, int(concurrency_in_session))
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="chat_handler")
+        self.lock = threading.Lock()
+        self.sessions = {}  # session_id -> _SessionState
+        # 统计信息
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.peak_queue_depth = 0
+        self.wait_times = deque(maxlen=stats_window)  # 最近任务从入队到开始处理的等待时间(秒)
+        self.handle_times = deque(maxlen=stats_window)  # 最近任务的处理耗时(秒)
+
+    def submit(self, session_id, context, priority=False, handler=None) -> Future:
+        """
+        提交一条消息到会话队列
+        :param priority: 为True时插入队首，用于管理命令等需要优先处理的消息
+        :param handler: 仅用于本条消息的处理函数，默认使用构造时传入的handler
+        :return: Future，结果为handler的返回值
+        """
+        task = _Task(context, handler or self.handler)
+        with self.lock:
+            state = self.sessions.get(session_id)
+            if state is None:
+                state = _SessionState()
+                self.sessions[session_id] = state
+            if priority:
+                state.queue.appendleft(task)
+            else:
+                state.queue.append(task)
+            self.submitted += 1
+            self.peak_queue_depth = max(self.peak_queue_depth, len(state.queue))
+            ready = self._pop_ready(state)
+        self._start(session_id, ready)
+        return task.future
+
+    def _pop_ready(self, state):
+        """取出当前可以开始处理的任务，需持有self.lock"""
+        ready = []
+        while state.queue and state.running < self.concurrency:
+            task = state.queue.popleft()
+            if not task.future.set_running_or_notify_cancel():
+                self.cancelled += 1
+                continue
+            state.running += 1
+            self.wait_times.append(time.monotonic() - task.enqueue_time)
+            ready.append(task)
+        return ready
+
+    def _start(self, session_id, tasks):
+        for task in tasks:
+            self.pool.submit(self._run, session_id, task)
+
+    def _run(self, session_id, task):
+        start = time.monotonic()
+        try:
+            result = task.handler(task.context)
+        except BaseException as e:
+            with self.lock:
+                self.failed += 1
+            task.future.set_exception(e)
+        else:
+            task.future.set_result(result)
+        finally:
+            self._finish(session_id, time.monotonic() - start)
+
+    def _finish(self, session_id, handle_time):
+        with self.lock:
+            self.completed += 1
+            self.handle_times.append(handle_time)
+            state = self.sessions.get(session_id)
+            if state is None:
+                return
+            state.running -= 1
+            ready = self._pop_ready(state)
+            if state.running == 0 and not state.queue:
+                del self.sessions[session_id]
+        self._start(session_id, ready)
+
+    def cancel_session(self, session_id):
+        """取消会话中尚未开始处理的消息，正在处理的不会被取消"""
+        with self.lock:
+            state = self.sessions.get(session_id)
+            if state is None:
+                return 0
+            tasks = list(state.queue)
+            state.queue.clear()
+            if state.running == 0:
+                del self.sessions[session_id]
+        for task in tasks:
+            task.future.cancel()
+        with self.lock:
+            self.cancelled += len(tasks)
+        return len(tasks)
+
+    def cancel_all_session(self):
+        with self.lock:
+            session_ids = list(self.sessions.keys())
+        return sum(self.cancel_session(session_id) for session_id in session_ids)
+
+    def queue_depth(self, session_id=None):
+        with self.lock:
+            if session_id is not None:
+                state = self.sessions.get(session_id)
+                return len(state.queue) if state else 0
+            return sum(len(state.queue) for state in self.sessions.values())
+
+    def stats(self) -> dict:
+        """
+        调度统计，用于在真实群聊负载下评估线程池大小
+        wait_* 为消息从入队到开始处理的等待时间，handle_* 为处理耗时，单位毫秒
+        """
+        with self.lock:
+            queued = [len(state.queue) for state in self.sessions.values()]
+            running = sum(state.running for state in self.sessions.values())
+            wait_times = sorted(self.wait_times)
+            handle_times = sorted(self.handle_times)
+            stats = {
+                "max_workers": self.max_workers,
+                "concurrency_in_session": self.concurrency,
+                "active_sessions": len(self.sessions),
+                "running": running,
+                "queued": sum(queued),
+                "max_session_queue_depth": max(queued) if queued else 0,
+                "peak_session_queue_depth": self.peak_queue_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+            }
+        stats.update(_summarize("wait", wait_times))
+        stats.update(_summarize("handle", handle_times))
+        return stats
+
+    def shutdown(self, wait=True):
+        self.cancel_all_session()
+        self.pool.shutdown(wait=wait)
+
+
+def _summarize(prefix, sorted_values):
+    if not sorted_values:
+        return {f"{prefix}_avg_ms": 0.0, f"{prefix}_p95_ms": 0.0, f"{prefix}_max_ms": 0.0}
+    p95 = sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * 0.95))]
+    return {
+        f"{prefix}_avg_ms": round(sum(sorted_values) / len(sorted_values) * 1000, 2),
+        f"{prefix}_p95_ms": round(p95 * 1000, 2),
+        f"{prefix}_max_ms": round(sorted_values[-1] * 1000, 2),
+    }
@@ -1,39 +1,187 @@
+import asyncio
 import threading
 import time
 
 
 class TokenBucket:
-    def __init__(self, tpm, timeout=None):
-        self.capacity = int(tpm)  # 令牌桶容量
-        self.tokens = 0  # 初始令牌数为0
-        self.rate = int(tpm) / 60  # 令牌每秒生成速率
+    """
+    令牌桶，按距离上次计算的时间懒惰补充令牌，不需要后台线程
+    :param tpm: 每分钟生成的令牌数
+    :param timeout: 获取令牌的默认超时时间，None表示一直等待
+    :param capacity: 桶容量，默认为tpm，即最多允许一分钟的突发量
+    """
+
+    def __init__(self, tpm, timeout=None, capacity=None):
+        self.rate = float(tpm) / 60  # 令牌每秒生成速率
+        self.capacity = float(capacity if capacity is not None else tpm)  # 令牌桶容量
         self.timeout = timeout  # 等待令牌超时时间
-        self.cond = threading.Condition()  # 条件变量
-        self.is_running = True
-        # 开启令牌生成线程
-        threading.Thread(target=self._generate_tokens).start()
-
-    def _generate_tokens(self):
-        """生成令牌"""
-        while self.is_running:
-            with self.cond:
-                if self.tokens < self.capacity:
-                    self.tokens += 1
-                self.cond.notify()  # 通知获取令牌的线程
-            time.sleep(1 / self.rate)
-
-    def get_token(self):
-        """获取令牌"""
-        with self.cond:
-            while self.tokens <= 0:
-                flag = self.cond.wait(self.timeout)
-                if not flag:  # 超时
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.last_time = now
+
+    def try_get_token(self, amount=1):
+        """
+        尝试立即获取令牌
+        :return: (是否成功, 失败时还需等待的秒数)
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True, 0.0
+            if self.rate <= 0:
+                return False, None
+            return False, (amount - self.tokens) / self.rate
+
+    def get_token(self, amount=1, timeout=-1):
+        """
+        获取令牌，令牌不足时阻塞等待
+        :param timeout: 超时时间，默认使用构造时的timeout，None表示一直等待
+        :return: 是否获取成功
+        """
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ok, wait = self.try_get_token(amount)
+            if ok:
+                return True
+            if wait is None:
+                return False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
                     return False
-            self.tokens -= 1
-        return True
+            time.sleep(wait)
+
+    async def get_token_async(self, amount=1, timeout=-1):
+        """get_token的异步版本，等待期间不阻塞事件循环"""
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ok, wait = self.try_get_token(amount)
+            if ok:
+                return True
+            if wait is None:
+                return False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+            await asyncio.sleep(wait)
+
+    def consume(self, amount):
+        """按实际用量扣除令牌，允许透支，透支部分由后续补充抵消"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+    def available(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens
 
     def close(self):
-        self.is_running = False
+        # 不再有令牌生成线程，保留该方法兼容旧调用
+        pass
+
+
+class RateLimiter:
+    """
+    同时限制每分钟请求数(RPM)和每分钟模型token数(TPM)
+    请求前调用acquire，得到响应后调用record_usage按实际的usage.total_tokens扣除TPM额度
+    :param rpm: 每分钟请求数，为空则不限制
+    :param tpm: 每分钟token数，为空则不限制
+    :param timeout: 等待额度的默认超时时间，None表示一直等待
+    """
+
+    def __init__(self, rpm=None, tpm=None, timeout=None):
+        self.timeout = timeout
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, estimated_tokens=0, timeout=-1):
+        """
+        获取一次请求的额度
+        :param estimated_tokens: 预估本次请求消耗的token数，TPM额度不低于该值时才放行
+        :return: 是否获取成功
+        """
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.token_bucket and not self._wait_tokens(estimated_tokens, deadline):
+            return False
+        if self.request_bucket:
+            return self.request_bucket.get_token(1, timeout=_remaining(deadline))
+        return True
+
+    async def acquire_async(self, estimated_tokens=0, timeout=-1):
+        """acquire的异步版本"""
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.token_bucket:
+            while self.token_bucket.available() < max(estimated_tokens, 1):
+                wait = self._token_wait(estimated_tokens)
+                remaining = _remaining(deadline)
+                if wait is None or (remaining is not None and wait > remaining):
+                    return False
+                await asyncio.sleep(wait)
+        if self.request_bucket:
+            return await self.request_bucket.get_token_async(1, timeout=_remaining(deadline))
+        return True
+
+    def record_usage(self, total_tokens):
+        """按实际消耗扣除TPM额度"""
+        if self.token_bucket and total_tokens:
+            self.token_bucket.consume(total_tokens)
+
+    def _wait_tokens(self, estimated_tokens, deadline):
+        # TPM额度只在拿到响应后扣除，这里只等待额度恢复到足够的水平
+        while self.token_bucket.available() < max(estimated_tokens, 1):
+            wait = self._token_wait(estimated_tokens)
+            remaining = _remaining(deadline)
+            if wait is None or (remaining is not None and wait > remaining):
+                return False
+            time.sleep(wait)
+        return True
+
+    def _token_wait(self, estimated_tokens):
+        bucket = self.token_bucket
+        if bucket.rate <= 0:
+            return None
+        return max(max(estimated_tokens, 1) - bucket.available(), 0) / bucket.rate
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(key, rpm=None, tpm=None, timeout=None) -> RateLimiter:
+    """
+    按key(如 bot类型 + 模型名)获取共享的限流器，同一key在进程内只创建一次
+    """
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = RateLimiter(rpm=rpm, tpm=tpm, timeout=timeout)
+                _limiters[key] = limiter
+    return limiter
 
 
 if __name__ == "__main__":
@@ -43,3 +191,8 @@ if __name__ == "__main__":
         if token_bucket.get_token():
             print(f"第{i+1}次请求成功")
     token_bucket.close()
+
+    limiter = RateLimiter(rpm=60, tpm=1000, timeout=0.5)
+    print("acquire:", limiter.acquire(estimated_tokens=100))
+    limiter.record_usage(1200)
+    print("acquire after overspending tpm:", limiter.acquire(estimated_tokens=100))
@@ -1,4 +1,5 @@
 import io
+import json
 import os
 import re
 from urllib.parse import urlparse
@@ -52,6 +53,30 @@ def split_string_by_utf8_length(string, max_length, max_split=0):
     return result
 
 
+def iter_sse_chat_deltas(response):
+    """
+    解析OpenAI兼容接口的SSE流式响应，逐个产出增量文本
+    :param response: requests的流式响应对象(stream=True)
+    """
+    for line in response.iter_lines():
+        if not line:
+            continue
+        decoded_line = line.decode("utf-8") if isinstance(line, bytes) else line
+        if not decoded_line.startswith("data:"):
+            continue
+        data = decoded_line[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            json_data = json.loads(data)
+        except json.JSONDecodeError:
+            continue
+        choices = json_data.get("choices") or [{}]
+        delta_content = (choices[0].get("delta") or {}).get("content")
+        if delta_content:
+            yield delta_content
+
+
 def get_path_suffix(path):
     path = urlparse(path).path
     return os.path.splitext(path)[-1].lstrip('.')
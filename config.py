@@ -49,6 +49,7 @@ available_setting = {
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    "handler_pool_size": 8,  # 处理消息的线程池大小，所有会话共享
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "group_chat_exit_group": False,
     # chatgpt会话参数
@@ -56,8 +57,10 @@ available_setting = {
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
+    "preload_tokenizer": False,  # 启动时预加载计算token用的tiktoken编码文件，避免首条消息等待加载
     # chatgpt限流配置
     "rate_limit_chatgpt": 20,  # chatgpt的调用频率限制
+    "rate_limit_chatgpt_tpm": 0,  # chatgpt每分钟消耗的token数限制，按接口返回的实际用量扣除，0为不限制
     "rate_limit_dalle": 50,  # openai dalle的调用频率限制
     # chatgpt api参数 参考https://platform.openai.com/docs/api-reference/chat/create
     "temperature": 0.9,
@@ -66,6 +69,24 @@ available_setting = {
     "presence_penalty": 0,
     "request_timeout": 180,  # chatgpt请求超时时间，openai接口默认设置为600，对于难问题一般需要较长时间
     "timeout": 120,  # chatgpt重试超时时间，在这个时间内，将会自动重试
+    # 共享HTTP连接池配置，bot、语音、翻译和通道模块的http请求复用长连接
+    "http_pool_size": 10,  # 每个服务地址保持的最大连接数
+    "http_max_retries": 2,  # 连接失败或502/503/504时的重试次数
+    "http_connect_timeout": 5,  # 建立连接超时时间，单位秒
+    "http_read_timeout": 180,  # 未指定超时的请求的默认读取超时时间，单位秒
+    # 模型回复缓存，相同的bot类型、模型、温度和会话内容直接返回缓存的回复
+    "reply_cache_enabled": False,  # 是否开启回复缓存
+    "reply_cache_ttl": 3600,  # 缓存有效期，单位秒
+    "reply_cache_max_entries": 1000,  # 内存中最多缓存的回复数，超出后淘汰最久未使用的
+    "reply_cache_max_reply_length": 4000,  # 超过该长度的回复不缓存
+    "reply_cache_max_temperature": 0,  # 温度不高于该值的请求才缓存，插件可通过context["reply_cache"]单独开启或关闭
+    "reply_cache_sqlite_path": "",  # 持久化缓存的SQLite文件路径，为空则只缓存在内存中
+    # 有回复时限的通道(如公众号被动回复)按剩余时间调整请求
+    "deadline_fast_model": "",  # 剩余时间不足时改用的更快模型，为空则不切换
+    "deadline_fast_model_seconds": 8,  # 剩余时间低于该值时切换模型并限制回复长度
+    "deadline_max_tokens": 0,  # 剩余时间不足时的最大回复token数，0表示不限制
+    "deadline_partial_reply": True,  # 到达截止时间时先回复已生成的部分，剩余部分作为续篇
+    "deadline_reserve_seconds": 1,  # 截止时间前预留给通道发送回复的时间，单位秒
     # Baidu 文心一言参数
     "baidu_wenxin_model": "eb-instant",  # 默认使用ERNIE-Bot-turbo模型
     "baidu_wenxin_api_key": "",  # Baidu api key
@@ -77,6 +98,7 @@ available_setting = {
     "xunfei_api_secret": "",  # 讯飞 API secret
     "xunfei_domain": "",  # 讯飞模型对应的domain参数，Spark4.0 Ultra为 4.0Ultra，其他模型详见: https://www.xfyun.cn/doc/spark/Web.html
     "xunfei_spark_url": "",  # 讯飞模型对应的请求地址，Spark4.0 Ultra为 wss://spark-api.xf-yun.com/v4.0/chat，其他模型参考详见: https://www.xfyun.cn/doc/spark/Web.html
+    "xunfei_max_sessions": 8,  # 同时打开的星火websocket会话数上限
     # claude 配置
     "claude_api_cookie": "",
     "claude_uuid": "",
@@ -126,6 +148,7 @@ available_setting = {
     "baidu_translate_app_key": "",  # 百度翻译api的秘钥
     # itchat的配置
     "hot_reload": False,  # 是否开启热重载
+    "wechat_async_transport": False,  # 个人微信通道是否使用itchat的asyncio内核，所有请求共用一个aiohttp会话，需要安装aiohttp
     # wechaty的配置
     "wechaty_puppet_service_token": "",  # wechaty的token
     # wechatmp的配置
@@ -134,6 +157,9 @@ available_setting = {
     "wechatmp_app_id": "",  # 微信公众平台的appID
     "wechatmp_app_secret": "",  # 微信公众平台的appsecret
     "wechatmp_aes_key": "",  # 微信公众平台的EncodingAESKey，加密模式需要
+    "wechatmp_max_waiting_requests": 8,  # 被动回复模式下同时等待回复的请求数上限，每个等待的请求占用一个web服务线程
+    "wechat_media_dedupe_ttl": 86400,  # 公众号和企业微信应用中相同的图片、语音在该时间内复用已上传的media_id，单位秒，0表示不复用
+    "wechat_api_rpm": {},  # 微信接口每分钟调用次数，用于上传和发送限速，如 {"material.add": 60, "media.upload": 600, "message.send": 600}
     # wechatcom的通用配置
     "wechatcom_corp_id": "",  # 企业微信公司的corpID
     # wechatcomapp的配置
@@ -164,6 +190,7 @@ available_setting = {
     "plugin_trigger_prefix": "$",  # 规范插件提供聊天相关指令的前缀，建议不要和管理员指令前缀"#"冲突
     # 是否使用全局插件配置
     "use_global_plugin_config": False,
+    "plugin_timeout": 0,  # 插件处理单个事件的默认超时秒数，超时后跳过该插件，0为不限制，可在plugins/plugins.json中为单个插件设置timeout
     "max_media_send_count": 3,  # 单次最大发送媒体资源的个数
     "media_send_interval": 1,  # 发送图片的事件间隔，单位秒
     # 智谱AI 平台配置
@@ -183,6 +210,15 @@ available_setting = {
     "Minimax_group_id": "",
     "Minimax_base_url": "",
     "web_port": 9899,
+    "web_server": "threaded",  # web通道的服务方式，threaded: 内置线程池服务，waitress: 需要安装waitress，dev: Flask开发服务器
+    "web_threads": 32,  # web服务处理连接的线程数
+    "web_max_concurrency": 24,  # 同时处理的请求数上限，超过时返回503，应小于web_threads
+    "web_max_pending": 32,  # threaded服务方式下线程都在忙时最多排队的连接数，超过时直接返回503
+    "web_keepalive_timeout": 15,  # keep-alive连接空闲或读取请求超过该秒数时关闭，有连接排队时空闲的连接立即关闭
+    "web_request_timeout": 120,  # /chat等待回复的最长秒数，超时返回504
+    "web_batch_max_size": 32,  # /chat/batch单次最多的消息数，也是单个WebSocket连接同时处理的消息上限
+    "web_websocket_timeout": 300,  # WebSocket连接超过该秒数没有收到消息(含ping)时关闭
+    "web_max_websockets": 4,  # 同时保持的WebSocket连接数上限，超过时返回503；每个连接占用一个服务线程，web_max_concurrency与该值之和应小于web_threads
 }
 
 
@@ -20,8 +20,11 @@ def load_async_itchat() -> Core:
         Core: the abstract interface of itchat
     """
     from .async_components import load_components
+    from .async_components.session import AsyncSession
     load_components(Core)
-    return Core()
+    core = Core()
+    core.s = AsyncSession()
+    return core
 
 
 def load_sync_itchat() -> Core:
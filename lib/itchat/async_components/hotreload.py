@@ -1,12 +1,12 @@
 import pickle, os
 import logging
 
-import requests  # type: ignore
-
+from .. import utils
 from ..config import VERSION
 from ..returnvalues import ReturnValue
 from ..storage import templates
 from .contact import update_local_chatrooms, update_local_friends
+from .login import put_msg
 from .messages import produce_msg
 
 logger = logging.getLogger('itchat')
@@ -53,14 +53,15 @@ async def load_login_status(self, fileDir,
     self.loginInfo = j['loginInfo']
     self.loginInfo['User'] = templates.User(self.loginInfo['User'])
     self.loginInfo['User'].core = self
-    self.s.cookies = requests.utils.cookiejar_from_dict(j['cookies'])
+    self.s.cookies.clear()
+    self.s.cookies.update(j['cookies'])
     self.storageClass.loads(j['storage'])
     try:
-        msgList, contactList = self.get_msg()
+        msgList, contactList = await self.get_msg()
     except:
         msgList = contactList = None
     if (msgList or contactList) is None:
-        self.logout()
+        await self.logout()
         await load_last_login_status(self.s, j['cookies'])
         logger.debug('server refused, loading login status failed.')
         return ReturnValue({'BaseResponse': {
@@ -74,19 +75,19 @@ async def load_login_status(self, fileDir,
                 else:
                     update_local_friends(self, [contact])
         if msgList:
-            msgList = produce_msg(self, msgList)
-            for msg in msgList: self.msgList.put(msg)
+            msgList = await produce_msg(self, msgList)
+            for msg in msgList: await put_msg(self, msg)
         await self.start_receiving(exitCallback)
         logger.debug('loading login status succeeded.')
         if hasattr(loginCallback, '__call__'):
-            await loginCallback(self.storageClass.userName)
+            await utils.maybe_await(loginCallback(self.storageClass.userName))
         return ReturnValue({'BaseResponse': {
             'ErrMsg': 'loading login status succeeded.',
             'Ret': 0, }})
 
 async def load_last_login_status(session, cookiesDict):
     try:
-        session.cookies = requests.utils.cookiejar_from_dict({
+        session.cookies.update({
             'webwxuvid': cookiesDict['webwxuvid'],
             'webwx_auth_ticket': cookiesDict['webwx_auth_ticket'],
             'login_frequency': '2',
@@ -1,16 +1,9 @@
 import asyncio
 import os, time, re, io
-import threading
 import json
 import random
 import traceback
 import logging
-try:
-    from httplib import BadStatusLine
-except ImportError:
-    from http.client import BadStatusLine
-
-import requests  # type: ignore
 from pyqrcode import QRCode
 
 from .. import config, utils
@@ -18,6 +11,7 @@ from ..returnvalues import ReturnValue
 from ..storage.templates import wrap_user_dict
 from .contact import update_local_chatrooms, update_local_friends
 from .messages import produce_msg
+from .session import ClientResponseError, ReadTimeout
 
 logger = logging.getLogger('itchat')
 
@@ -43,22 +37,18 @@ async def login(self, enableCmdQR=False, picDir=None, qrCallback=None, EventScan
     while self.isLogging:
         uuid = await push_login(self)
         if uuid:
-            payload = EventScanPayload(
-                status=ScanStatus.Waiting,
-                qrcode=f"qrcode/https://login.weixin.qq.com/l/{uuid}"
-            )
-            event_stream.emit('scan', payload)
-            await asyncio.sleep(0.1)
+            await emit_scan(event_stream, EventScanPayload, ScanStatus, 'Waiting',
+                f"qrcode/https://login.weixin.qq.com/l/{uuid}")
         else:
             logger.info('Getting uuid of QR code.')
-            self.get_QRuuid()
-            payload = EventScanPayload(
-                status=ScanStatus.Waiting,
-                qrcode=f"https://login.weixin.qq.com/l/{self.uuid}"
-            )
-            print(f"https://wechaty.js.org/qrcode/https://login.weixin.qq.com/l/{self.uuid}")
-            event_stream.emit('scan', payload)
-            await asyncio.sleep(0.1)
+            while not await self.get_QRuuid():
+                await asyncio.sleep(1)
+            if event_stream is None:
+                await self.get_QR(enableCmdQR=enableCmdQR, picDir=picDir, qrCallback=qrCallback)
+            else:
+                print(f"https://wechaty.js.org/qrcode/https://login.weixin.qq.com/l/{self.uuid}")
+                await emit_scan(event_stream, EventScanPayload, ScanStatus, 'Waiting',
+                    f"https://login.weixin.qq.com/l/{self.uuid}")
             # logger.info('Please scan the QR code to log in.')
         isLoggedIn = False
         while not isLoggedIn:
@@ -67,54 +57,34 @@ async def login(self, enableCmdQR=False, picDir=None, qrCallback=None, EventScan
                 # await qrCallback(uuid=self.uuid, status=status, qrcode=self.qrStorage.getvalue())
             if status == '200':
                 isLoggedIn = True
-                payload = EventScanPayload(
-                    status=ScanStatus.Scanned,
-                    qrcode=f"https://login.weixin.qq.com/l/{self.uuid}"
-                )
-                event_stream.emit('scan', payload)
-                await asyncio.sleep(0.1)
+                await emit_scan(event_stream, EventScanPayload, ScanStatus, 'Scanned',
+                    f"https://login.weixin.qq.com/l/{self.uuid}")
             elif status == '201':
                 if isLoggedIn is not None:
                     logger.info('Please press confirm on your phone.')
                     isLoggedIn = None
-                    payload = EventScanPayload(
-                        status=ScanStatus.Waiting,
-                        qrcode=f"https://login.weixin.qq.com/l/{self.uuid}"
-                    )
-                    event_stream.emit('scan', payload)
-                    await asyncio.sleep(0.1)
+                    await emit_scan(event_stream, EventScanPayload, ScanStatus, 'Waiting',
+                        f"https://login.weixin.qq.com/l/{self.uuid}")
             elif status != '408':
-                payload = EventScanPayload(
-                    status=ScanStatus.Cancel,
-                    qrcode=f"https://login.weixin.qq.com/l/{self.uuid}"
-                )
-                event_stream.emit('scan', payload)
-                await asyncio.sleep(0.1)
+                await emit_scan(event_stream, EventScanPayload, ScanStatus, 'Cancel',
+                    f"https://login.weixin.qq.com/l/{self.uuid}")
                 break
         if isLoggedIn:
-            payload = EventScanPayload(
-                status=ScanStatus.Confirmed,
-                qrcode=f"https://login.weixin.qq.com/l/{self.uuid}"
-            )
-            event_stream.emit('scan', payload)
-            await asyncio.sleep(0.1)
+            await emit_scan(event_stream, EventScanPayload, ScanStatus, 'Confirmed',
+                f"https://login.weixin.qq.com/l/{self.uuid}")
             break
         elif self.isLogging:
             logger.info('Log in time out, reloading QR code.')
-            payload = EventScanPayload(
-                status=ScanStatus.Timeout,
-                qrcode=f"https://login.weixin.qq.com/l/{self.uuid}"
-            )
-            event_stream.emit('scan', payload)
-            await asyncio.sleep(0.1)
+            await emit_scan(event_stream, EventScanPayload, ScanStatus, 'Timeout',
+                f"https://login.weixin.qq.com/l/{self.uuid}")
     else:
         return
     logger.info('Loading the contact, this may take a little while.')
     await self.web_init()
     await self.show_mobile_login()
-    self.get_contact(True)
+    await self.get_contact(True)
     if hasattr(loginCallback, '__call__'):
-        r = await loginCallback(self.storageClass.userName)
+        r = await utils.maybe_await(loginCallback(self.storageClass.userName))
     else:
         utils.clear_screen()
         if os.path.exists(picDir or config.DEFAULT_QR):
@@ -123,19 +93,26 @@ async def login(self, enableCmdQR=False, picDir=None, qrCallback=None, EventScan
     await self.start_receiving(exitCallback)
     self.isLogging = False
 
+async def emit_scan(event_stream, EventScanPayload, ScanStatus, status, qrcode):
+    ''' scan events are emitted to wechaty puppets, there is no event_stream for other callers '''
+    if event_stream is None:
+        return
+    event_stream.emit('scan', EventScanPayload(status=getattr(ScanStatus, status), qrcode=qrcode))
+    await asyncio.sleep(0.1)
+
 async def push_login(core):
     cookiesDict = core.s.cookies.get_dict()
     if 'wxuin' in cookiesDict:
         url = '%s/cgi-bin/mmwebwx-bin/webwxpushloginurl?uin=%s' % (
             config.BASE_URL, cookiesDict['wxuin'])
         headers = { 'User-Agent' : config.USER_AGENT}
-        r = core.s.get(url, headers=headers).json()
+        r = (await core.s.get(url, headers=headers)).json()
         if 'uuid' in r and r.get('ret') in (0, '0'):
             core.uuid = r['uuid']
             return r['uuid']
     return False
 
-def get_QRuuid(self):
+async def get_QRuuid(self):
     url = '%s/jslogin' % config.BASE_URL
     params = {
         'appid' : 'wx782c26e4c19acffb',
@@ -143,7 +120,7 @@ def get_QRuuid(self):
         'redirect_uri' : 'https://wx.qq.com/cgi-bin/mmwebwx-bin/webwxnewloginpage?mod=desktop',
         'lang'  : 'zh_CN' }
     headers = { 'User-Agent' : config.USER_AGENT}
-    r = self.s.get(url, params=params, headers=headers)
+    r = await self.s.get(url, params=params, headers=headers)
     regx = r'window.QRLogin.code = (\d+); window.QRLogin.uuid = "(\S+?)";'
     data = re.search(regx, r.text)
     if data and data.group(1) == '200':
@@ -157,7 +134,7 @@ async def get_QR(self, uuid=None, enableCmdQR=False, picDir=None, qrCallback=Non
     qrCode = QRCode('https://login.weixin.qq.com/l/' + uuid)
     qrCode.png(qrStorage, scale=10)
     if hasattr(qrCallback, '__call__'):
-        await qrCallback(uuid=uuid, status='0', qrcode=qrStorage.getvalue())
+        await utils.maybe_await(qrCallback(uuid=uuid, status='0', qrcode=qrStorage.getvalue()))
     else:
         with open(picDir, 'wb') as f:
             f.write(qrStorage.getvalue())
@@ -174,7 +151,7 @@ async def check_login(self, uuid=None):
     params = 'loginicon=true&uuid=%s&tip=1&r=%s&_=%s' % (
         uuid, int(-localTime / 1579), localTime)
     headers = { 'User-Agent' : config.USER_AGENT}
-    r = self.s.get(url, params=params, headers=headers)
+    r = await self.s.get(url, params=params, headers=headers)
     regx = r'window.code=(\d+)'
     data = re.search(regx, r.text)
     if data and data.group(1) == '200':
@@ -200,7 +177,7 @@ async def process_login_info(core, loginContent):
                 'extspam' : config.UOS_PATCH_EXTSPAM,
                 'referer' : 'https://wx.qq.com/?&lang=zh_CN&target=t'
               }
-    r = core.s.get(core.loginInfo['url'], headers=headers, allow_redirects=False)
+    r = await core.s.get(core.loginInfo['url'], headers=headers, allow_redirects=False)
     core.loginInfo['url'] = core.loginInfo['url'][:core.loginInfo['url'].rfind('/')]
     for indexUrl, detailedUrl in (
             ("wx2.qq.com"      , ("file.wx2.qq.com", "webpush.wx2.qq.com")),
@@ -254,7 +231,7 @@ async def web_init(self):
     headers = {
         'ContentType': 'application/json; charset=UTF-8',
         'User-Agent' : config.USER_AGENT, }
-    r = self.s.post(url, params=params, data=json.dumps(data), headers=headers)
+    r = await self.s.post(url, params=params, data=json.dumps(data), headers=headers)
     dic = json.loads(r.content.decode('utf-8', 'replace'))
     # deal with login info
     utils.emoji_formatter(dic['User'], 'NickName')
@@ -296,26 +273,28 @@ async def show_mobile_login(self):
     headers = {
         'ContentType': 'application/json; charset=UTF-8',
         'User-Agent' : config.USER_AGENT, }
-    r = self.s.post(url, data=json.dumps(data), headers=headers)
+    r = await self.s.post(url, data=json.dumps(data), headers=headers)
     return ReturnValue(rawResponse=r)
 
 async def start_receiving(self, exitCallback=None, getReceivingFnOnly=False):
+    ''' the receiving loop is a task of the running event loop, sync_check long-polls
+        wait on it while replies, downloads and sends of other tasks go on '''
     self.alive = True
-    def maintain_loop():
+    async def maintain_loop():
         retryCount = 0
         while self.alive:
             try:
-                i = sync_check(self)
+                i = await sync_check(self)
                 if i is None:
                     self.alive = False
                 elif i == '0':
                     pass
                 else:
-                    msgList, contactList = self.get_msg()
+                    msgList, contactList = await self.get_msg()
                     if msgList:
-                        msgList = produce_msg(self, msgList)
+                        msgList = await produce_msg(self, msgList)
                         for msg in msgList:
-                            self.msgList.put(msg)
+                            await put_msg(self, msg)
                     if contactList:
                         chatroomList, otherList = [], []
                         for contact in contactList:
@@ -325,31 +304,41 @@ async def start_receiving(self, exitCallback=None, getReceivingFnOnly=False):
                                 otherList.append(contact)
                         chatroomMsg = update_local_chatrooms(self, chatroomList)
                         chatroomMsg['User'] = self.loginInfo['User']
-                        self.msgList.put(chatroomMsg)
+                        await put_msg(self, chatroomMsg)
                         update_local_friends(self, otherList)
                 retryCount = 0
-            except requests.exceptions.ReadTimeout:
+            except ReadTimeout:
                 pass
+            except asyncio.CancelledError:
+                raise
             except:
                 retryCount += 1
                 logger.error(traceback.format_exc())
                 if self.receivingRetryCount < retryCount:
                     self.alive = False
                 else:
-                    time.sleep(1)
-        self.logout()
+                    await asyncio.sleep(1)
+        await self.logout()
         if hasattr(exitCallback, '__call__'):
-            exitCallback(self.storageClass.userName)
+            await utils.maybe_await(exitCallback(self.storageClass.userName))
         else:
             logger.info('LOG OUT!')
     if getReceivingFnOnly:
         return maintain_loop
     else:
-        maintainThread = threading.Thread(target=maintain_loop)
-        maintainThread.setDaemon(True)
-        maintainThread.start()
+        self.receivingTask = asyncio.get_running_loop().create_task(maintain_loop())
+
+async def put_msg(core, msg):
+    ''' put a message without blocking the loop, wait while msgList is full '''
+    if core.msgList.full():
+        logger.warning('%s messages are waiting for replying, receiving is paused.' % core.msgList.qsize())
+        while core.msgList.full():
+            await asyncio.sleep(0.1)
+    core.msgList.put(msg)
+    if core.msgArrived is not None:
+        core.msgArrived.set()
 
-def sync_check(self):
+async def sync_check(self):
     url = '%s/synccheck' % self.loginInfo.get('syncUrl', self.loginInfo['url'])
     params = {
         'r'        : int(time.time() * 1000),
@@ -362,10 +351,10 @@ def sync_check(self):
     headers = { 'User-Agent' : config.USER_AGENT}
     self.loginInfo['logintime'] += 1
     try:
-        r = self.s.get(url, params=params, headers=headers, timeout=config.TIMEOUT)
-    except requests.exceptions.ConnectionError as e:
+        r = await self.s.get(url, params=params, headers=headers, timeout=config.TIMEOUT)
+    except ClientResponseError as e:
         try:
-            if not isinstance(e.args[0].args[1], BadStatusLine):
+            if 'BadStatusLine' not in repr(e):
                 raise
             # will return a package with status '0 -'
             # and value like:
@@ -382,7 +371,7 @@ def sync_check(self):
         return None
     return pm.group(2)
 
-def get_msg(self):
+async def get_msg(self):
     self.loginInfo['deviceid'] = 'e' + repr(random.random())[2:17]
     url = '%s/webwxsync?sid=%s&skey=%s&pass_ticket=%s' % (
         self.loginInfo['url'], self.loginInfo['wxsid'],
@@ -394,7 +383,7 @@ def get_msg(self):
     headers = {
         'ContentType': 'application/json; charset=UTF-8',
         'User-Agent' : config.USER_AGENT }
-    r = self.s.post(url, data=json.dumps(data), headers=headers, timeout=config.TIMEOUT)
+    r = await self.s.post(url, data=json.dumps(data), headers=headers, timeout=config.TIMEOUT)
     dic = json.loads(r.content.decode('utf-8', 'replace'))
     if dic['BaseResponse']['Ret'] != 0: return None, None
     self.loginInfo['SyncKey'] = dic['SyncKey']
@@ -402,7 +391,7 @@ def get_msg(self):
         for item in dic['SyncCheckKey']['List']])
     return dic['AddMsgList'], dic['ModContactList']
 
-def logout(self):
+async def logout(self):
     if self.alive:
         url = '%s/webwxlogout' % self.loginInfo['url']
         params = {
@@ -410,7 +399,7 @@ def logout(self):
             'type'     : 1,
             'skey'     : self.loginInfo['skey'], }
         headers = { 'User-Agent' : config.USER_AGENT}
-        self.s.get(url, params=params, headers=headers)
+        await self.s.get(url, params=params, headers=headers)
         self.alive = False
     self.isLogging = False
     self.s.cookies.clear()
@@ -1,6 +1,6 @@
 import os, time, re, io
 import json
-import mimetypes, hashlib
+import mimetypes
 import logging
 from collections import OrderedDict
 
@@ -9,6 +9,7 @@ from .. import config, utils
 from ..returnvalues import ReturnValue
 from ..storage import templates
 from .contact import update_local_uin
+from .session import save_response
 
 logger = logging.getLogger('itchat')
 
@@ -22,28 +23,23 @@ def load_messages(core):
     core.send         = send
     core.revoke       = revoke
 
-async def get_download_fn(core, url, msgId):
+def get_download_fn(core, url, msgId):
     async def download_fn(downloadDir=None):
         params = {
             'msgid': msgId,
             'skey': core.loginInfo['skey'],}
         headers = { 'User-Agent' : config.USER_AGENT}
-        r = core.s.get(url, params=params, stream=True, headers = headers)
-        tempStorage = io.BytesIO()
-        for block in r.iter_content(1024):
-            tempStorage.write(block)
+        r = await core.s.get(url, params=params, stream=True, headers = headers)
         if downloadDir is None:
-            return tempStorage.getvalue()
-        with open(downloadDir, 'wb') as f:
-            f.write(tempStorage.getvalue())
-        tempStorage.seek(0)
+            return await save_response(r)
+        head = await save_response(r, downloadDir)
         return ReturnValue({'BaseResponse': {
             'ErrMsg': 'Successfully downloaded',
             'Ret': 0, },
-            'PostFix': utils.get_image_postfix(tempStorage.read(20)), })
+            'PostFix': utils.get_image_postfix(head), })
     return download_fn
 
-def produce_msg(core, msgList):
+async def produce_msg(core, msgList):
     ''' for messages types
      * 40 msg, 43 videochat, 50 VOIPMSG, 52 voipnotifymsg
      * 53 webwxvoipnotifymsg, 9999 sysnotice
@@ -58,7 +54,7 @@ def produce_msg(core, msgList):
             actualOpposite = m['FromUserName']
         # produce basic message
         if '@@' in m['FromUserName'] or '@@' in m['ToUserName']:
-            produce_group_chat(core, m)
+            await produce_group_chat(core, m)
         else:
             utils.msg_formatter(m, 'Content')
         # set user of msg
@@ -124,14 +120,10 @@ def produce_msg(core, msgList):
                     'msgid': msgId,
                     'skey': core.loginInfo['skey'],}
                 headers = {'Range': 'bytes=0-', 'User-Agent' : config.USER_AGENT}
-                r = core.s.get(url, params=params, headers=headers, stream=True)
-                tempStorage = io.BytesIO()
-                for block in r.iter_content(1024):
-                    tempStorage.write(block)
+                r = await core.s.get(url, params=params, headers=headers, stream=True)
                 if videoDir is None:
-                    return tempStorage.getvalue()
-                with open(videoDir, 'wb') as f:
-                    f.write(tempStorage.getvalue())
+                    return await save_response(r)
+                await save_response(r, videoDir)
                 return ReturnValue({'BaseResponse': {
                     'ErrMsg': 'Successfully downloaded',
                     'Ret': 0, }})
@@ -157,14 +149,10 @@ def produce_msg(core, msgList):
                         'pass_ticket': 'undefined',
                         'webwx_data_ticket': cookiesList['webwx_data_ticket'],}
                     headers = { 'User-Agent' : config.USER_AGENT}
-                    r = core.s.get(url, params=params, stream=True, headers=headers)
-                    tempStorage = io.BytesIO()
-                    for block in r.iter_content(1024):
-                        tempStorage.write(block)
+                    r = await core.s.get(url, params=params, stream=True, headers=headers)
                     if attaDir is None:
-                        return tempStorage.getvalue()
-                    with open(attaDir, 'wb') as f:
-                        f.write(tempStorage.getvalue())
+                        return await save_response(r)
+                    await save_response(r, attaDir)
                     return ReturnValue({'BaseResponse': {
                         'ErrMsg': 'Successfully downloaded',
                         'Ret': 0, }})
@@ -198,7 +186,7 @@ def produce_msg(core, msgList):
                     'Type': 'Sharing',
                     'Text': m['FileName'], }
         elif m['MsgType'] == 51: # phone init
-            msg = update_local_uin(core, m)
+            msg = await update_local_uin(core, m)
         elif m['MsgType'] == 10000:
             msg = {
                 'Type': 'Note',
@@ -223,7 +211,7 @@ def produce_msg(core, msgList):
         rl.append(m)
     return rl
 
-def produce_group_chat(core, msg):
+async def produce_group_chat(core, msg):
     r = re.match('(@[0-9a-z]*?):<br/>(.*)$', msg['Content'])
     if r:
         actualUserName, content = r.groups()
@@ -242,7 +230,7 @@ def produce_group_chat(core, msg):
     member = utils.search_dict_list((chatroom or {}).get(
         'MemberList') or [], 'UserName', actualUserName)
     if member is None:
-        chatroom = core.update_chatroom(chatroomUserName)
+        chatroom = await core.update_chatroom(chatroomUserName)
         member = utils.search_dict_list((chatroom or {}).get(
             'MemberList') or [], 'UserName', actualUserName)
     if member is None:
@@ -273,7 +261,7 @@ async def send_raw_msg(self, msgType, content, toUserName):
             },
         'Scene': 0, }
     headers = { 'ContentType': 'application/json; charset=UTF-8', 'User-Agent' : config.USER_AGENT}
-    r = self.s.post(url, headers=headers,
+    r = await self.s.post(url, headers=headers,
         data=json.dumps(data, ensure_ascii=False).encode('utf8'))
     return ReturnValue(rawResponse=r)
 
@@ -283,10 +271,14 @@ async def send_msg(self, msg='Test Message', toUserName=None):
     return r
 
 def _prepare_file(fileDir, file_=None):
+    ''' md5 the file without loading it, chunks are read from file_ when uploading
+        * files opened here are closed by _close_file, file_ given by callers is left open '''
     fileDict = {}
     if file_:
         if hasattr(file_, 'read'):
-            file_ = file_.read()
+            if not (hasattr(file_, 'seekable') and file_.seekable()):
+                file_ = io.BytesIO(file_.read())
+            fileDict['closeFile'] = False
         else:
             return ReturnValue({'BaseResponse': {
                 'ErrMsg': 'file_ param should be opened file',
@@ -296,14 +288,17 @@ def _prepare_file(fileDir, file_=None):
             return ReturnValue({'BaseResponse': {
                 'ErrMsg': 'No file found in specific dir',
                 'Ret': -1002, }})
-        with open(fileDir, 'rb') as f:
-            file_ = f.read()
-    fileDict['fileSize'] = len(file_)
-    fileDict['fileMd5'] = hashlib.md5(file_).hexdigest()
-    fileDict['file_'] = io.BytesIO(file_)
+        file_ = open(fileDir, 'rb')
+        fileDict['closeFile'] = True
+    fileDict['fileSize'], fileDict['fileMd5'] = utils.file_md5(file_)
+    fileDict['file_'] = file_
     return fileDict
 
-def upload_file(self, fileDir, isPicture=False, isVideo=False,
+def _close_file(preparedFile):
+    if preparedFile.get('closeFile'):
+        preparedFile['file_'].close()
+
+async def upload_file(self, fileDir, isPicture=False, isVideo=False,
         toUserName='filehelper', file_=None, preparedFile=None):
     logger.debug('Request to upload a %s: %s' % (
         'picture' if isPicture else 'video' if isVideo else 'file', fileDir))
@@ -314,7 +309,7 @@ def upload_file(self, fileDir, isPicture=False, isVideo=False,
     fileSize, fileMd5, file_ = \
         preparedFile['fileSize'], preparedFile['fileMd5'], preparedFile['file_']
     fileSymbol = 'pic' if isPicture else 'video' if isVideo else'doc'
-    chunks = int((fileSize - 1) / 524288) + 1
+    chunks = int((fileSize - 1) / config.UPLOAD_CHUNK_SIZE) + 1
     clientMediaId = int(time.time() * 1e4)
     uploadMediaRequest = json.dumps(OrderedDict([
         ('UploadType', 2),
@@ -329,15 +324,17 @@ def upload_file(self, fileDir, isPicture=False, isVideo=False,
         ('FileMd5', fileMd5)]
         ), separators = (',', ':'))
     r = {'BaseResponse': {'Ret': -1005, 'ErrMsg': 'Empty file detected'}}
-    for chunk in range(chunks):
-        r = upload_chunk_file(self, fileDir, fileSymbol, fileSize,
-            file_, chunk, chunks, uploadMediaRequest)
-    file_.close()
+    try:
+        for chunk in range(chunks):
+            r = await upload_chunk_file(self, fileDir, fileSymbol, fileSize,
+                file_, chunk, chunks, uploadMediaRequest)
+    finally:
+        _close_file(preparedFile)
     if isinstance(r, dict):
         return ReturnValue(r)
     return ReturnValue(rawResponse=r)
 
-def upload_chunk_file(core, fileDir, fileSymbol, fileSize,
+async def upload_chunk_file(core, fileDir, fileSymbol, fileSize,
         file_, chunk, chunks, uploadMediaRequest):
     url = core.loginInfo.get('fileUrl', core.loginInfo['url']) + \
         '/webwxuploadmedia?f=json'
@@ -357,13 +354,13 @@ def upload_chunk_file(core, fileDir, fileSymbol, fileSize,
         ('uploadmediarequest', (None, uploadMediaRequest)),
         ('webwx_data_ticket', (None, cookiesList['webwx_data_ticket'])),
         ('pass_ticket', (None, core.loginInfo['pass_ticket'])),
-        ('filename' , (fileName, file_.read(524288), 'application/octet-stream'))])
+        ('filename' , (fileName, file_.read(config.UPLOAD_CHUNK_SIZE), 'application/octet-stream'))])
     if chunks == 1:
         del files['chunk']; del files['chunks']
     else:
         files['chunk'], files['chunks'] = (None, str(chunk)), (None, str(chunks))
     headers = { 'User-Agent' : config.USER_AGENT}
-    return core.s.post(url, files=files, headers=headers, timeout=config.TIMEOUT)
+    return await core.s.post(url, files=files, headers=headers, timeout=config.TIMEOUT)
 
 async def send_file(self, fileDir, toUserName=None, mediaId=None, file_=None):
     logger.debug('Request to send a file(mediaId: %s) to %s: %s' % (
@@ -379,11 +376,13 @@ async def send_file(self, fileDir, toUserName=None, mediaId=None, file_=None):
         return preparedFile
     fileSize = preparedFile['fileSize']
     if mediaId is None:
-        r = self.upload_file(fileDir, preparedFile=preparedFile)
+        r = await self.upload_file(fileDir, preparedFile=preparedFile)
         if r:
             mediaId = r['MediaId']
         else:
             return r
+    else:
+        _close_file(preparedFile)
     url = '%s/webwxsendappmsg?fun=async&f=json' % self.loginInfo['url']
     data = {
         'BaseRequest': self.loginInfo['BaseRequest'],
@@ -401,7 +400,7 @@ async def send_file(self, fileDir, toUserName=None, mediaId=None, file_=None):
     headers = {
         'User-Agent': config.USER_AGENT,
         'Content-Type': 'application/json;charset=UTF-8', }
-    r = self.s.post(url, headers=headers,
+    r = await self.s.post(url, headers=headers,
         data=json.dumps(data, ensure_ascii=False).encode('utf8'))
     return ReturnValue(rawResponse=r)
 
@@ -420,7 +419,7 @@ async def send_image(self, fileDir=None, toUserName=None, mediaId=None, file_=No
     if toUserName is None:
         toUserName = self.storageClass.userName
     if mediaId is None:
-        r = self.upload_file(fileDir, isPicture=not fileDir[-4:] == '.gif', file_=file_)
+        r = await self.upload_file(fileDir, isPicture=not fileDir[-4:] == '.gif', file_=file_)
         if r:
             mediaId = r['MediaId']
         else:
@@ -443,7 +442,7 @@ async def send_image(self, fileDir=None, toUserName=None, mediaId=None, file_=No
     headers = {
         'User-Agent': config.USER_AGENT,
         'Content-Type': 'application/json;charset=UTF-8', }
-    r = self.s.post(url, headers=headers,
+    r = await self.s.post(url, headers=headers,
         data=json.dumps(data, ensure_ascii=False).encode('utf8'))
     return ReturnValue(rawResponse=r)
 
@@ -462,7 +461,7 @@ async def send_video(self, fileDir=None, toUserName=None, mediaId=None, file_=No
     if toUserName is None:
         toUserName = self.storageClass.userName
     if mediaId is None:
-        r = self.upload_file(fileDir, isVideo=True, file_=file_)
+        r = await self.upload_file(fileDir, isVideo=True, file_=file_)
         if r:
             mediaId = r['MediaId']
         else:
@@ -482,7 +481,7 @@ async def send_video(self, fileDir=None, toUserName=None, mediaId=None, file_=No
     headers = {
         'User-Agent' : config.USER_AGENT,
         'Content-Type': 'application/json;charset=UTF-8', }
-    r = self.s.post(url, headers=headers,
+    r = await self.s.post(url, headers=headers,
         data=json.dumps(data, ensure_ascii=False).encode('utf8'))
     return ReturnValue(rawResponse=r)
 
@@ -522,6 +521,6 @@ async def revoke(self, msgId, toUserName, localId=None):
     headers = {
         'ContentType': 'application/json; charset=UTF-8',
         'User-Agent' : config.USER_AGENT }
-    r = self.s.post(url, headers=headers,
+    r = await self.s.post(url, headers=headers,
         data=json.dumps(data, ensure_ascii=False).encode('utf8'))
     return ReturnValue(rawResponse=r)
@@ -1,11 +1,13 @@
-import logging, traceback, sys, threading
+import asyncio, logging, traceback, sys
 try:
     import Queue
 except ImportError:
     import queue as Queue  # type: ignore
 
+from .. import config
+from ..dispatcher import AsyncMessageDispatcher
 from ..log import set_logging
-from ..utils import test_connect
+from ..utils import test_connect, maybe_await
 from ..storage import templates
 
 logger = logging.getLogger('itchat')
@@ -36,7 +38,7 @@ async def auto_login(self, EventScanPayload=None,ScanStatus=None,event_stream=No
         await self.login(enableCmdQR=enableCmdQR, picDir=picDir, qrCallback=qrCallback, EventScanPayload=EventScanPayload, ScanStatus=ScanStatus, event_stream=event_stream,
             loginCallback=loginCallback, exitCallback=exitCallback)
 
-async def configured_reply(self, event_stream, payload, message_container):
+async def configured_reply(self):
     ''' determine the type of message and reply if its method is defined
         however, I use a strange way to determine whether a msg is from massive platform
         I haven't found a better solution here
@@ -44,27 +46,36 @@ async def configured_reply(self, event_stream, payload, message_container):
         If you have any good idea, pleeeease report an issue. I will be more than grateful.
     '''
     try:
-        msg = self.msgList.get(timeout=1)
-        if 'MsgId' in msg.keys():
-            message_container[msg['MsgId']] = msg
+        msg = self.msgList.get_nowait()
     except Queue.Empty:
-        pass
+        # receiving loop runs on the same loop and sets msgArrived after putting messages
+        self.msgArrived.clear()
+        try:
+            await asyncio.wait_for(self.msgArrived.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
     else:
-        if isinstance(msg['User'], templates.User):
-            replyFn = self.functionDict['FriendChat'].get(msg['Type'])
-        elif isinstance(msg['User'], templates.MassivePlatform):
-            replyFn = self.functionDict['MpChat'].get(msg['Type'])
-        elif isinstance(msg['User'], templates.Chatroom):
-            replyFn = self.functionDict['GroupChat'].get(msg['Type'])
-        if replyFn is None:
-            r = None
+        if self.msgDispatcher is None:
+            await reply_msg(self, msg)
         else:
-            try:
-                r = await replyFn(msg)
-                if r is not None:
-                    await self.send(r, msg.get('FromUserName'))
-            except:
-                logger.warning(traceback.format_exc())
+            await self.msgDispatcher.dispatch(msg)
+
+async def reply_msg(self, msg):
+    if isinstance(msg['User'], templates.User):
+        replyFn = self.functionDict['FriendChat'].get(msg['Type'])
+    elif isinstance(msg['User'], templates.MassivePlatform):
+        replyFn = self.functionDict['MpChat'].get(msg['Type'])
+    elif isinstance(msg['User'], templates.Chatroom):
+        replyFn = self.functionDict['GroupChat'].get(msg['Type'])
+    if replyFn is None:
+        r = None
+    else:
+        try:
+            r = await maybe_await(replyFn(msg))
+            if r is not None:
+                await self.send(r, msg.get('FromUserName'))
+        except:
+            logger.warning(traceback.format_exc())
 
 def msg_register(self, msgType, isFriendChat=False, isGroupChat=False, isMpChat=False):
     ''' a decorator constructor
@@ -84,11 +95,18 @@ def msg_register(self, msgType, isFriendChat=False, isGroupChat=False, isMpChat=
         return fn
     return _msg_register
 
-async def run(self, debug=False, blockThread=True):
+async def run(self, debug=False, blockThread=True, workers=config.REPLY_WORKERS):
+    ''' replies are tasks of the running loop, blockThread=False returns after they are scheduled '''
     logger.info('Start auto replying.')
     if debug:
         set_logging(loggingLevel=logging.DEBUG)
+    if self.msgArrived is None:
+        self.msgArrived = asyncio.Event()
+    if workers and self.msgDispatcher is None:
+        self.msgDispatcher = AsyncMessageDispatcher(lambda msg: reply_msg(self, msg), workers)
     async def reply_fn():
+        if self.msgDispatcher is not None:
+            self.msgDispatcher.start()
         try:
             while self.alive:
                 await self.configured_reply()
@@ -98,9 +116,10 @@ async def run(self, debug=False, blockThread=True):
             self.alive = False
             logger.debug('itchat received an ^C and exit.')
             logger.info('Bye~')
+        finally:
+            if self.msgDispatcher is not None:
+                self.msgDispatcher.stop()
     if blockThread:
         await reply_fn()
     else:
-        replyThread = threading.Thread(target=reply_fn)
-        replyThread.setDaemon(True)
-        replyThread.start()
+        self.replyTask = asyncio.get_running_loop().create_task(reply_fn())
@@ -0,0 +1,136 @@
+''' an asyncio http session for the async core
+    * it looks like the part of requests.Session used by components, but get and post are coroutines
+    * all requests of a core share one aiohttp session and its connection pool,
+        so sync_check long-polls, downloads and sends wait on one event loop instead of threads
+    * aiohttp is only needed when the async core is used
+'''
+import asyncio, json, logging
+
+from .. import config
+
+try:
+    import aiohttp
+    from aiohttp import ClientResponseError
+except ImportError:
+    aiohttp = None
+    class ClientResponseError(Exception):
+        pass
+
+logger = logging.getLogger('itchat')
+
+# raised when a request times out, the counterpart of requests.exceptions.ReadTimeout
+ReadTimeout = asyncio.TimeoutError
+
+class Cookies(object):
+    ''' the cookies of a session, kept in a dict until the aiohttp session is created '''
+    def __init__(self):
+        self.jar = None
+        self.pending = {}
+    def bind(self, jar):
+        self.jar = jar
+        if self.pending:
+            jar.update_cookies(self.pending)
+            self.pending = {}
+    def get_dict(self):
+        if self.jar is None:
+            return dict(self.pending)
+        return dict((morsel.key, morsel.value) for morsel in self.jar)
+    def items(self):
+        return self.get_dict().items()
+    def update(self, cookiesDict):
+        if self.jar is None:
+            self.pending.update(cookiesDict)
+        else:
+            self.jar.update_cookies(cookiesDict)
+    def clear(self):
+        self.pending = {}
+        if self.jar is not None:
+            self.jar.clear()
+
+class Response(object):
+    ''' body of a response is read before it is returned, unless it is requested with stream '''
+    def __init__(self, raw, content=None):
+        self.raw = raw
+        self.status_code = raw.status
+        self.headers = raw.headers
+        self.url = str(raw.url)
+        self.content = content
+    @property
+    def text(self):
+        return self.content.decode(self.raw.charset or 'utf-8', 'replace')
+    def json(self):
+        return json.loads(self.content.decode('utf-8', 'replace'))
+    def raise_for_status(self):
+        self.raw.raise_for_status()
+    async def iter_content(self, chunkSize):
+        try:
+            async for block in self.raw.content.iter_chunked(chunkSize):
+                yield block
+        finally:
+            self.raw.release()
+
+class AsyncSession(object):
+    def __init__(self):
+        self.session = None
+        self.cookies = Cookies()
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            if aiohttp is None:
+                raise ImportError('aiohttp is required by the async itchat core, pip install aiohttp')
+            # unsafe jar keeps cookies of ip hosts as well, the same as requests does
+            jar = aiohttp.CookieJar(unsafe=True)
+            self.cookies.bind(jar)
+            self.session = aiohttp.ClientSession(cookie_jar=jar)
+        return self.session
+    async def request(self, method, url, params=None, data=None, json=None, files=None,
+            headers=None, timeout=None, allow_redirects=True, stream=False):
+        if files is not None:
+            data = _form_data(files)
+        if isinstance(timeout, tuple):
+            timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        elif timeout is not None:
+            timeout = aiohttp.ClientTimeout(total=timeout)
+        kwargs = {'params': params, 'data': data, 'json': json, 'headers': headers,
+            'allow_redirects': allow_redirects}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        raw = await self._get_session().request(method, url, **kwargs)
+        if stream:
+            return Response(raw)
+        try:
+            return Response(raw, await raw.read())
+        finally:
+            raw.release()
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+    async def post(self, url, data=None, **kwargs):
+        return await self.request('POST', url, data=data, **kwargs)
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+def _form_data(files):
+    ''' files in the format of requests: name -> (filename, value[, content type]) '''
+    form = aiohttp.FormData()
+    for name, field in files.items():
+        if field[1] is None:
+            continue
+        if field[0] is None:
+            form.add_field(name, field[1])
+        else:
+            form.add_field(name, field[1], filename=field[0],
+                content_type=field[2] if 2 < len(field) else 'application/octet-stream')
+    return form
+
+async def save_response(r, fileDir=None):
+    ''' the same as utils.save_response for a streamed Response '''
+    if fileDir is None:
+        return b''.join([block async for block in r.iter_content(config.DOWNLOAD_CHUNK_SIZE)])
+    head = b''
+    with open(fileDir, 'wb') as f:
+        async for block in r.iter_content(config.DOWNLOAD_CHUNK_SIZE):
+            if len(head) < 20:
+                head += block[:20 - len(head)]
+            f.write(block)
+    return head
@@ -0,0 +1,202 @@
+''' compare the sync core with the asyncio core against a local fake web wechat server
+    python -m lib.itchat.benchmark [messages] [conversations] [handleSeconds] [workers]
+    * the server runs in another process, it pushes messages through synccheck and webwxsync
+        and measures the latency from a message pushed to its reply received by webwxsendmsg
+    * every handler waits handleSeconds like a slow plugin, then replies through core.send
+    * threads of the benchmark process are sampled while running, the async core needs aiohttp
+'''
+import asyncio, json, multiprocessing, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse
+except ImportError:
+    pass
+
+import requests
+
+from .core import Core
+from .content import TEXT
+
+SYNC_CHECK_HOLD = 1.0
+SEND_DELAY = 0.02
+
+def serve(port, messages, conversations, rate, ready):
+    lock = threading.Condition()
+    state = {'pending': [], 'pushed': {}, 'latency': [], 'started': None}
+    def generate():
+        for i in range(messages):
+            with lock:
+                state['pending'].append({
+                    'MsgId': str(i), 'NewMsgId': i, 'MsgType': 1, 'Url': '',
+                    'FromUserName': '@friend%d' % (i % conversations), 'ToUserName': '@self',
+                    'Content': 'msg%d' % i, 'CreateTime': int(time.time()), })
+                state['pushed'][i] = time.time()
+                lock.notify_all()
+            time.sleep(1.0 / rate)
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        def reply(self, body, contentType='application/json'):
+            body = body.encode('utf8')
+            self.send_response(200)
+            self.send_header('Content-Type', contentType)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path.endswith('/synccheck'):
+                with lock:
+                    if state['started'] is None:
+                        state['started'] = time.time()
+                        threading.Thread(target=generate, daemon=True).start()
+                    if not state['pending']:
+                        lock.wait(SYNC_CHECK_HOLD)
+                    selector = '2' if state['pending'] else '0'
+                self.reply('window.synccheck={retcode:"0",selector:"%s"}' % selector, 'text/javascript')
+            elif path.endswith('/stats'):
+                with lock:
+                    self.reply(json.dumps({'latency': state['latency'],
+                        'done': len(state['latency']) == messages}))
+            else:
+                self.reply('{}')
+        def do_POST(self):
+            path = urlparse(self.path).path
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if path.endswith('/webwxsync'):
+                with lock:
+                    msgList, state['pending'] = state['pending'], []
+                self.reply(json.dumps({'BaseResponse': {'Ret': 0}, 'SyncKey': {'List': []},
+                    'SyncCheckKey': {'List': []}, 'AddMsgList': msgList, 'ModContactList': []}))
+            elif path.endswith('/webwxsendmsg'):
+                time.sleep(SEND_DELAY)
+                i = int(json.loads(body.decode('utf8'))['Msg']['Content'].split('msg')[-1])
+                with lock:
+                    state['latency'].append(time.time() - state['pushed'][i])
+                self.reply(json.dumps({'BaseResponse': {'Ret': 0}, 'MsgID': str(i)}))
+            else:
+                self.reply('{}')
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    ready.set()
+    server.serve_forever()
+
+def prepare_core(core, url, conversations):
+    core.loginInfo = {
+        'url': url, 'syncUrl': url, 'fileUrl': url,
+        'skey': 'skey', 'wxsid': 'sid', 'wxuin': '1', 'pass_ticket': 'ticket',
+        'deviceid': 'e1', 'logintime': 0, 'synckey': '', 'SyncKey': {'List': []},
+        'BaseRequest': {}, 'User': {'UserName': '@self'}, }
+    core.storageClass.userName, core.storageClass.nickName = '@self', 'self'
+    for i in range(conversations):
+        core.memberList.append({'UserName': '@friend%d' % i, 'NickName': 'friend%d' % i, 'VerifyFlag': 0})
+
+def wait_done(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        stats = requests.get(url + '/stats').json()
+        if stats['done']:
+            return stats['latency']
+        time.sleep(0.2)
+    return requests.get(url + '/stats').json()['latency']
+
+def count_threads():
+    # threads of the benchmark itself are named bench_*
+    return len([t for t in threading.enumerate() if not t.name.startswith('bench_')])
+
+def sample_threads(stop, samples):
+    while not stop.is_set():
+        samples.append(count_threads())
+        time.sleep(0.05)
+
+def run_sync(url, conversations, handleSeconds, workers, timeout):
+    from .components import load_components
+    class SyncCore(Core):
+        pass
+    load_components(SyncCore)
+    core = SyncCore()
+    prepare_core(core, url, conversations)
+    @core.msg_register(TEXT)
+    def reply(msg):
+        time.sleep(handleSeconds)
+        return 'reply ' + msg.text
+    stop, samples = threading.Event(), []
+    threading.Thread(target=sample_threads, args=(stop, samples), name='bench_sampler', daemon=True).start()
+    core.start_receiving()
+    core.run(blockThread=False, workers=workers)
+    latency = wait_done(url, timeout)
+    stop.set()
+    core.alive = False
+    # let the receiving thread finish its last synccheck before the server goes away
+    time.sleep(SYNC_CHECK_HOLD + 0.5)
+    return latency, max(samples)
+
+def run_async(url, conversations, handleSeconds, workers, timeout):
+    from .async_components import load_components
+    from .async_components.session import AsyncSession
+    class AsyncCore(Core):
+        pass
+    load_components(AsyncCore)
+    core = AsyncCore()
+    core.s = AsyncSession()
+    prepare_core(core, url, conversations)
+    @core.msg_register(TEXT)
+    async def reply(msg):
+        await asyncio.sleep(handleSeconds)
+        return 'reply ' + msg.text
+    stop, samples = threading.Event(), []
+    threading.Thread(target=sample_threads, args=(stop, samples), name='bench_sampler', daemon=True).start()
+    async def main():
+        await core.start_receiving()
+        await core.run(blockThread=False, workers=workers)
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(1, thread_name_prefix='bench_wait') as executor:
+            latency = await loop.run_in_executor(executor, wait_done, url, timeout)
+        core.alive = False
+        await asyncio.sleep(SYNC_CHECK_HOLD + 0.5)
+        await core.s.close()
+        return latency
+    latency = asyncio.run(main())
+    stop.set()
+    return latency, max(samples)
+
+def percentile(sortedValues, p):
+    return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * p))] * 1000
+
+def report(label, latency, threads, baseline):
+    latency.sort()
+    if not latency:
+        print('%-6s no reply received' % label)
+        return
+    print('%-6s replied %4d  threads %3d  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  max %7.1fms' % (
+        label, len(latency), threads - baseline, percentile(latency, 0.5),
+        percentile(latency, 0.95), percentile(latency, 0.99), latency[-1] * 1000))
+
+def bench(label, fn, port, messages, conversations, handleSeconds, workers):
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve,
+        args=(port, messages, conversations, 50, ready), daemon=True)
+    server.start()
+    ready.wait()
+    baseline = count_threads()
+    try:
+        latency, threads = fn('http://127.0.0.1:%d' % port, conversations, handleSeconds,
+            workers, messages / 50.0 + 60)
+        report(label, latency, threads, baseline)
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    messages, conversations, handleSeconds, workers = (
+        [int(a) for a in sys.argv[1:3]] + [float(a) for a in sys.argv[3:4]] + [int(a) for a in sys.argv[4:5]] +
+        [200, 20, 0.2, 16][len(sys.argv[1:5]):])
+    print('%d messages from %d conversations at 50/s, handler takes %.2fs, %d workers, extra threads of the core:' % (
+        messages, conversations, handleSeconds, workers))
+    bench('sync', run_sync, 18731, messages, conversations, handleSeconds, workers)
+    try:
+        import aiohttp
+    except ImportError:
+        print('async  skipped, aiohttp is not installed')
+    else:
+        bench('async', run_async, 18732, messages, conversations, handleSeconds, workers)
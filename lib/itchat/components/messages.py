@@ -1,6 +1,6 @@
 import os, time, re, io
 import json
-import mimetypes, hashlib
+import mimetypes
 import logging
 from collections import OrderedDict
 
@@ -30,18 +30,13 @@ def get_download_fn(core, url, msgId):
             'skey': core.loginInfo['skey'],}
         headers = { 'User-Agent' : config.USER_AGENT }
         r = core.s.get(url, params=params, stream=True, headers = headers)
-        tempStorage = io.BytesIO()
-        for block in r.iter_content(1024):
-            tempStorage.write(block)
         if downloadDir is None:
-            return tempStorage.getvalue()
-        with open(downloadDir, 'wb') as f:
-            f.write(tempStorage.getvalue())
-        tempStorage.seek(0)
+            return utils.save_response(r)
+        head = utils.save_response(r, downloadDir)
         return ReturnValue({'BaseResponse': {
             'ErrMsg': 'Successfully downloaded',
             'Ret': 0, },
-            'PostFix': utils.get_image_postfix(tempStorage.read(20)), })
+            'PostFix': utils.get_image_postfix(head), })
     return download_fn
 
 def produce_msg(core, msgList):
@@ -126,13 +121,9 @@ def produce_msg(core, msgList):
                     'skey': core.loginInfo['skey'],}
                 headers = {'Range': 'bytes=0-', 'User-Agent' : config.USER_AGENT }
                 r = core.s.get(url, params=params, headers=headers, stream=True)
-                tempStorage = io.BytesIO()
-                for block in r.iter_content(1024):
-                    tempStorage.write(block)
                 if videoDir is None:
-                    return tempStorage.getvalue()
-                with open(videoDir, 'wb') as f:
-                    f.write(tempStorage.getvalue())
+                    return utils.save_response(r)
+                utils.save_response(r, videoDir)
                 return ReturnValue({'BaseResponse': {
                     'ErrMsg': 'Successfully downloaded',
                     'Ret': 0, }})
@@ -159,13 +150,9 @@ def produce_msg(core, msgList):
                         'webwx_data_ticket': cookiesList['webwx_data_ticket'],}
                     headers = { 'User-Agent' : config.USER_AGENT }
                     r = core.s.get(url, params=params, stream=True, headers=headers)
-                    tempStorage = io.BytesIO()
-                    for block in r.iter_content(1024):
-                        tempStorage.write(block)
                     if attaDir is None:
-                        return tempStorage.getvalue()
-                    with open(attaDir, 'wb') as f:
-                        f.write(tempStorage.getvalue())
+                        return utils.save_response(r)
+                    utils.save_response(r, attaDir)
                     return ReturnValue({'BaseResponse': {
                         'ErrMsg': 'Successfully downloaded',
                         'Ret': 0, }})
@@ -284,10 +271,14 @@ def send_msg(self, msg='Test Message', toUserName=None):
     return r
 
 def _prepare_file(fileDir, file_=None):
+    ''' md5 the file without loading it, chunks are read from file_ when uploading
+        * files opened here are closed by _close_file, file_ given by callers is left open '''
     fileDict = {}
     if file_:
         if hasattr(file_, 'read'):
-            file_ = file_.read()
+            if not (hasattr(file_, 'seekable') and file_.seekable()):
+                file_ = io.BytesIO(file_.read())
+            fileDict['closeFile'] = False
         else:
             return ReturnValue({'BaseResponse': {
                 'ErrMsg': 'file_ param should be opened file',
@@ -297,13 +288,16 @@ def _prepare_file(fileDir, file_=None):
             return ReturnValue({'BaseResponse': {
                 'ErrMsg': 'No file found in specific dir',
                 'Ret': -1002, }})
-        with open(fileDir, 'rb') as f:
-            file_ = f.read()
-    fileDict['fileSize'] = len(file_)
-    fileDict['fileMd5'] = hashlib.md5(file_).hexdigest()
-    fileDict['file_'] = io.BytesIO(file_)
+        file_ = open(fileDir, 'rb')
+        fileDict['closeFile'] = True
+    fileDict['fileSize'], fileDict['fileMd5'] = utils.file_md5(file_)
+    fileDict['file_'] = file_
     return fileDict
 
+def _close_file(preparedFile):
+    if preparedFile.get('closeFile'):
+        preparedFile['file_'].close()
+
 def upload_file(self, fileDir, isPicture=False, isVideo=False,
         toUserName='filehelper', file_=None, preparedFile=None):
     logger.debug('Request to upload a %s: %s' % (
@@ -315,7 +309,7 @@ def upload_file(self, fileDir, isPicture=False, isVideo=False,
     fileSize, fileMd5, file_ = \
         preparedFile['fileSize'], preparedFile['fileMd5'], preparedFile['file_']
     fileSymbol = 'pic' if isPicture else 'video' if isVideo else'doc'
-    chunks = int((fileSize - 1) / 524288) + 1
+    chunks = int((fileSize - 1) / config.UPLOAD_CHUNK_SIZE) + 1
     clientMediaId = int(time.time() * 1e4)
     uploadMediaRequest = json.dumps(OrderedDict([
         ('UploadType', 2),
@@ -330,10 +324,12 @@ def upload_file(self, fileDir, isPicture=False, isVideo=False,
         ('FileMd5', fileMd5)]
         ), separators = (',', ':'))
     r = {'BaseResponse': {'Ret': -1005, 'ErrMsg': 'Empty file detected'}}
-    for chunk in range(chunks):
-        r = upload_chunk_file(self, fileDir, fileSymbol, fileSize,
-            file_, chunk, chunks, uploadMediaRequest)
-    file_.close()
+    try:
+        for chunk in range(chunks):
+            r = upload_chunk_file(self, fileDir, fileSymbol, fileSize,
+                file_, chunk, chunks, uploadMediaRequest)
+    finally:
+        _close_file(preparedFile)
     if isinstance(r, dict):
         return ReturnValue(r)
     return ReturnValue(rawResponse=r)
@@ -358,7 +354,7 @@ def upload_chunk_file(core, fileDir, fileSymbol, fileSize,
         ('uploadmediarequest', (None, uploadMediaRequest)),
         ('webwx_data_ticket', (None, cookiesList['webwx_data_ticket'])),
         ('pass_ticket', (None, core.loginInfo['pass_ticket'])),
-        ('filename' , (fileName, file_.read(524288), 'application/octet-stream'))])
+        ('filename' , (fileName, file_.read(config.UPLOAD_CHUNK_SIZE), 'application/octet-stream'))])
     if chunks == 1:
         del files['chunk']; del files['chunks']
     else:
@@ -385,6 +381,8 @@ def send_file(self, fileDir, toUserName=None, mediaId=None, file_=None):
             mediaId = r['MediaId']
         else:
             return r
+    else:
+        _close_file(preparedFile)
     url = '%s/webwxsendappmsg?fun=async&f=json' % self.loginInfo['url']
     data = {
         'BaseRequest': self.loginInfo['BaseRequest'],
@@ -4,6 +4,8 @@ try:
 except ImportError:
     import queue as Queue
 
+from .. import config
+from ..dispatcher import MessageDispatcher
 from ..log import set_logging
 from ..utils import test_connect
 from ..storage import templates
@@ -50,21 +52,27 @@ def configured_reply(self):
     except Queue.Empty:
         pass
     else:
-        if isinstance(msg['User'], templates.User):
-            replyFn = self.functionDict['FriendChat'].get(msg['Type'])
-        elif isinstance(msg['User'], templates.MassivePlatform):
-            replyFn = self.functionDict['MpChat'].get(msg['Type'])
-        elif isinstance(msg['User'], templates.Chatroom):
-            replyFn = self.functionDict['GroupChat'].get(msg['Type'])
-        if replyFn is None:
-            r = None
+        if self.msgDispatcher is None:
+            reply_msg(self, msg)
         else:
-            try:
-                r = replyFn(msg)
-                if r is not None:
-                    self.send(r, msg.get('FromUserName'))
-            except:
-                logger.warning(traceback.format_exc())
+            self.msgDispatcher.dispatch(msg)
+
+def reply_msg(self, msg):
+    if isinstance(msg['User'], templates.User):
+        replyFn = self.functionDict['FriendChat'].get(msg['Type'])
+    elif isinstance(msg['User'], templates.MassivePlatform):
+        replyFn = self.functionDict['MpChat'].get(msg['Type'])
+    elif isinstance(msg['User'], templates.Chatroom):
+        replyFn = self.functionDict['GroupChat'].get(msg['Type'])
+    if replyFn is None:
+        r = None
+    else:
+        try:
+            r = replyFn(msg)
+            if r is not None:
+                self.send(r, msg.get('FromUserName'))
+        except:
+            logger.warning(traceback.format_exc())
 
 def msg_register(self, msgType, isFriendChat=False, isGroupChat=False, isMpChat=False):
     ''' a decorator constructor
@@ -84,11 +92,15 @@ def msg_register(self, msgType, isFriendChat=False, isGroupChat=False, isMpChat=
         return fn
     return _msg_register
 
-def run(self, debug=False, blockThread=True):
+def run(self, debug=False, blockThread=True, workers=config.REPLY_WORKERS):
     logger.info('Start auto replying.')
     if debug:
         set_logging(loggingLevel=logging.DEBUG)
+    if workers and self.msgDispatcher is None:
+        self.msgDispatcher = MessageDispatcher(lambda msg: reply_msg(self, msg), workers)
     def reply_fn():
+        if self.msgDispatcher is not None:
+            self.msgDispatcher.start()
         try:
             while self.alive:
                 self.configured_reply()
@@ -98,6 +110,9 @@ def run(self, debug=False, blockThread=True):
             self.alive = False
             logger.debug('itchat received an ^C and exit.')
             logger.info('Bye~')
+        finally:
+            if self.msgDispatcher is not None:
+                self.msgDispatcher.stop()
     if blockThread:
         reply_fn()
     else:
@@ -10,6 +10,18 @@ OS = platform.system() # Windows, Linux, Darwin
 DIR = os.getcwd()
 DEFAULT_QR = 'QR.png'
 TIMEOUT = (10, 60)
+# media are streamed to disk and uploaded in chunks of these sizes, the web api accepts 512KB per chunk
+DOWNLOAD_CHUNK_SIZE = 512 * 1024
+UPLOAD_CHUNK_SIZE = 512 * 1024
+# messages are replied by a pool of threads, one conversation at a time in order
+# 0 workers replies in the receiving thread of run like before
+REPLY_WORKERS = 4
+# messages taken by workers but not replied, and messages waiting in msgList (0 is unbounded)
+# when both are full the receiving loop waits for replying
+MAX_PENDING_MSG = 100
+MSG_QUEUE_SIZE = 1000
+# log a warning when a message waits longer than this before replying, in seconds
+MSG_LAG_WARNING = 30
 
 USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/54.0.2840.71 Safari/537.36'
 
@@ -24,6 +24,8 @@ class Core(object):
         self.s = requests.Session()
         self.uuid = None
         self.functionDict = {'FriendChat': {}, 'GroupChat': {}, 'MpChat': {}}
+        self.msgDispatcher = None
+        self.msgArrived = None # set by the async core when a message is put into msgList
         self.useHotReload, self.hotReloadDir = False, 'itchat.pkl'
         self.receivingRetryCount = 5
     def login(self, enableCmdQR=False, picDir=None, qrCallback=None,
@@ -439,10 +441,13 @@ class Core(object):
             return a specific decorator based on information given
         '''
         raise NotImplementedError()
-    def run(self, debug=True, blockThread=True):
+    def run(self, debug=True, blockThread=True, workers=4):
         ''' start auto respond
             for option
                 - debug: if set, debug info will be shown on screen
+                - workers: number of threads replying messages, 0 replies in the running thread
+                    - messages of one conversation are still replied in order
+                    - msgDispatcher.stats() shows pending messages and queue lag
             it is defined in components/register.py
         '''
         raise NotImplementedError()
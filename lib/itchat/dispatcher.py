@@ -0,0 +1,159 @@
+import asyncio, logging, threading, time, traceback
+from collections import deque
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+from . import config
+
+logger = logging.getLogger('itchat')
+
+class MessageDispatcher(object):
+    ''' hand messages of msgList to a pool of worker threads
+        * messages of one conversation are handled one by one in the order received
+        * different conversations are handled in parallel, so a slow handler only holds its own chat
+        * at most maxPending messages are taken out of msgList and not yet handled,
+            when it is reached dispatch blocks, msgList fills up and then the receiving loop waits
+        * lag is the time between a message put into msgList and its handler started
+    '''
+    def __init__(self, handler, workers=config.REPLY_WORKERS,
+            maxPending=config.MAX_PENDING_MSG, lagWarning=config.MSG_LAG_WARNING):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.lagWarning = lagWarning
+        self.pending = threading.BoundedSemaphore(max(1, int(maxPending)))
+        self.lock = threading.Lock()
+        self.conversations = {} # conversation -> deque of messages, present while it has messages
+        self.ready = Queue.Queue() # conversations waiting for a worker
+        self.threads = []
+        self.generation = 0 # workers of a stopped generation quit even if started again soon
+        self.pendingCount, self.handledCount = 0, 0
+        self.lastLag, self.maxLag, self.totalLag = 0, 0, 0
+        self.lastWarning = 0
+    def start(self):
+        if self.threads:
+            return
+        self.threads = [threading.Thread(target=self._work, args=(self.generation,),
+            name='itchat-reply-%d' % i) for i in range(self.workers)]
+        for t in self.threads:
+            t.setDaemon(True)
+            t.start()
+    def stop(self):
+        ''' workers quit after their current message, the rest are kept for next start '''
+        self.generation += 1
+        self.threads = []
+    def dispatch(self, msg):
+        self.pending.acquire()
+        conversation = get_conversation(msg)
+        with self.lock:
+            self.pendingCount += 1
+            if conversation in self.conversations:
+                # a worker is handling or going to handle this conversation, it takes this one after
+                self.conversations[conversation].append(msg)
+                return
+            self.conversations[conversation] = deque([msg])
+        self.ready.put(conversation)
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'pending': self.pendingCount,
+                'conversations': len(self.conversations),
+                'handled': self.handledCount,
+                'lastLag': self.lastLag,
+                'maxLag': self.maxLag,
+                'avgLag': self.totalLag / self.handledCount if self.handledCount else 0, }
+    def _work(self, generation):
+        while self.generation == generation:
+            try:
+                conversation = self.ready.get(timeout=1)
+            except Queue.Empty:
+                continue
+            with self.lock:
+                msg = self.conversations[conversation].popleft()
+            try:
+                self._handle(msg)
+            finally:
+                self._done(conversation)
+    def _done(self, conversation):
+        with self.lock:
+            self.pendingCount -= 1
+            if self.conversations[conversation]:
+                self.ready.put_nowait(conversation)
+            else:
+                del self.conversations[conversation]
+        self.pending.release()
+    def _handle(self, msg):
+        self._record_lag(msg)
+        try:
+            self.handler(msg)
+        except:
+            logger.warning(traceback.format_exc())
+    def _record_lag(self, msg):
+        lag = time.time() - getattr(msg, 'enqueueTime', time.time())
+        with self.lock:
+            self.handledCount += 1
+            self.lastLag = lag
+            self.maxLag = max(self.maxLag, lag)
+            self.totalLag += lag
+        if self.lagWarning and self.lagWarning < lag and 60 < time.time() - self.lastWarning:
+            self.lastWarning = time.time()
+            logger.warning('Messages are handled %.1fs after received, %s' % (lag, self.stats()))
+
+class AsyncMessageDispatcher(MessageDispatcher):
+    ''' the asyncio counterpart of MessageDispatcher for the async core
+        * workers are tasks of the running loop and handler is a coroutine function
+        * dispatch is a coroutine waiting while maxPending messages are not handled
+    '''
+    def __init__(self, handler, workers=config.REPLY_WORKERS,
+            maxPending=config.MAX_PENDING_MSG, lagWarning=config.MSG_LAG_WARNING):
+        MessageDispatcher.__init__(self, handler, workers, maxPending, lagWarning)
+        self.maxPending = max(1, int(maxPending))
+        # created in start, they belong to the loop running the workers
+        self.pending = self.ready = None
+    def start(self):
+        if self.threads:
+            return
+        if self.pending is None:
+            self.pending = asyncio.Semaphore(self.maxPending)
+            self.ready = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self.threads = [loop.create_task(self._work()) for i in range(self.workers)]
+    def stop(self):
+        for task in self.threads:
+            task.cancel()
+        self.threads = []
+    async def dispatch(self, msg):
+        await self.pending.acquire()
+        conversation = get_conversation(msg)
+        with self.lock:
+            self.pendingCount += 1
+            if conversation in self.conversations:
+                self.conversations[conversation].append(msg)
+                return
+            self.conversations[conversation] = deque([msg])
+        self.ready.put_nowait(conversation)
+    async def _work(self):
+        while True:
+            conversation = await self.ready.get()
+            with self.lock:
+                msg = self.conversations[conversation].popleft()
+            try:
+                await self._handle(msg)
+            finally:
+                self._done(conversation)
+    async def _handle(self, msg):
+        self._record_lag(msg)
+        try:
+            await self.handler(msg)
+        except asyncio.CancelledError:
+            raise
+        except:
+            logger.warning(traceback.format_exc())
+
+def get_conversation(msg):
+    ''' messages are ordered by the chat they belong to,
+        User is the friend, chatroom or mp on the other side even for messages sent by self '''
+    user = msg.get('User') or {}
+    return user.get('UserName') or msg.get('FromUserName')
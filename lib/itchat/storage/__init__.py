@@ -1,6 +1,7 @@
-import os, time, copy
+import os, time
 from threading import Lock
 
+from .. import config
 from .messagequeue import Queue
 from .templates import (
     ContactList, AbstractUserDict, User,
@@ -20,7 +21,7 @@ class Storage(object):
         self.memberList        = ContactList()
         self.mpList            = ContactList()
         self.chatroomList      = ContactList()
-        self.msgList           = Queue(-1)
+        self.msgList           = Queue(config.MSG_QUEUE_SIZE)
         self.lastInputUserName = None
         self.memberList.set_default_value(contactClass=User)
         self.memberList.core = core
@@ -28,6 +29,10 @@ class Storage(object):
         self.mpList.core = core
         self.chatroomList.set_default_value(contactClass=Chatroom)
         self.chatroomList.core = core
+        # hash indexes for searches, chatrooms and mps are searched by substring of NickName
+        self.memberList.set_index(('UserName', 'NickName', 'RemarkName', 'Alias'))
+        self.mpList.set_index(('UserName',))
+        self.chatroomList.set_index(('UserName',))
     def dumps(self):
         return {
             'userName'          : self.userName,
@@ -59,16 +64,27 @@ class Storage(object):
                 chatroom['Self'].core = chatroom.core
                 chatroom['Self'].chatroom = chatroom
         self.lastInputUserName = j.get('lastInputUserName', None)
+    def find_contact(self, userName):
+        ''' the stored friend, mp or chatroom with this userName, callers should hold updateLock '''
+        return self.memberList.search('UserName', userName) or \
+            self.mpList.search('UserName', userName) or \
+            self.chatroomList.search('UserName', userName)
+    def reindex(self, contact):
+        ''' refresh indexes after values of a stored contact changed, callers should hold updateLock '''
+        self.memberList.reindex(contact) or self.mpList.reindex(contact) or \
+            self.chatroomList.reindex(contact)
     def search_friends(self, name=None, userName=None, remarkName=None, nickName=None,
             wechatAccount=None):
+        ''' contacts returned are snapshots, nested values like MemberList are shared and read-only '''
         with self.updateLock:
             if (name or userName or remarkName or nickName or wechatAccount) is None:
-                return copy.deepcopy(self.memberList[0]) # my own account
+                return self.memberList[0].snapshot() # my own account
             elif userName: # return the only userName match
-                for m in self.memberList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = self.memberList.search('UserName', userName)
+                if m is not None:
+                    return m.snapshot()
             else:
+                index = self.memberList.index
                 matchDict = {
                     'RemarkName' : remarkName,
                     'NickName'   : nickName,
@@ -77,10 +93,14 @@ class Storage(object):
                     if matchDict[k] is None:
                         del matchDict[k]
                 if name: # select based on name
-                    contact = []
-                    for m in self.memberList:
-                        if any([m.get(k) == name for k in ('RemarkName', 'NickName', 'Alias')]):
-                            contact.append(m)
+                    contact, found = [], set()
+                    for k in ('RemarkName', 'NickName', 'Alias'):
+                        for m in index.get(k, name):
+                            if id(m) not in found:
+                                found.add(id(m))
+                                contact.append(m)
+                elif matchDict: # start from the smallest bucket
+                    contact = min([index.get(k, v) for k, v in matchDict.items()], key=len)
                 else:
                     contact = self.memberList[:]
                 if matchDict: # select again based on matchDict
@@ -88,30 +108,30 @@ class Storage(object):
                     for m in contact:
                         if all([m.get(k) == v for k, v in matchDict.items()]):
                             friendList.append(m)
-                    return copy.deepcopy(friendList)
+                    return [m.snapshot() for m in friendList]
                 else:
-                    return copy.deepcopy(contact)
+                    return [m.snapshot() for m in contact]
     def search_chatrooms(self, name=None, userName=None):
         with self.updateLock:
             if userName is not None:
-                for m in self.chatroomList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = self.chatroomList.search('UserName', userName)
+                if m is not None:
+                    return m.snapshot()
             elif name is not None:
                 matchList = []
                 for m in self.chatroomList:
                     if name in m['NickName']:
-                        matchList.append(copy.deepcopy(m))
+                        matchList.append(m.snapshot())
                 return matchList
     def search_mps(self, name=None, userName=None):
         with self.updateLock:
             if userName is not None:
-                for m in self.mpList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = self.mpList.search('UserName', userName)
+                if m is not None:
+                    return m.snapshot()
             elif name is not None:
                 matchList = []
                 for m in self.mpList:
                     if name in m['NickName']:
-                        matchList.append(copy.deepcopy(m))
+                        matchList.append(m.snapshot())
                 return matchList
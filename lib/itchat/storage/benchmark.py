@@ -0,0 +1,76 @@
+''' compare contact searches of Storage with the old linear scan + deepcopy
+    python -m lib.itchat.storage.benchmark [friends] [chatrooms] [members]
+'''
+import copy, sys, time
+
+from . import Storage
+
+class FakeCore(object):
+    pass
+
+def build_storage(friends, chatrooms, members):
+    core = FakeCore()
+    storage = Storage(core)
+    core.storageClass = storage
+    storage.memberList.append({'UserName': '@self', 'NickName': 'me'})
+    for i in range(friends):
+        storage.memberList.append({
+            'UserName': '@friend%d' % i, 'NickName': 'nick%d' % i,
+            'RemarkName': 'remark%d' % i, 'Alias': 'alias%d' % i, 'VerifyFlag': 0, })
+    for i in range(chatrooms):
+        storage.chatroomList.append({
+            'UserName': '@@room%d' % i, 'NickName': 'room%d' % i,
+            'MemberList': [{'UserName': '@member%d_%d' % (i, j), 'NickName': 'member%d' % j,
+                            'DisplayName': ''} for j in range(members)], })
+    return storage
+
+def legacy_search_friends(storage, userName=None, name=None):
+    with storage.updateLock:
+        if userName:
+            for m in storage.memberList:
+                if m['UserName'] == userName:
+                    return copy.deepcopy(m)
+        contact = [m for m in storage.memberList
+                   if any([m.get(k) == name for k in ('RemarkName', 'NickName', 'Alias')])]
+        return copy.deepcopy(contact)
+
+def legacy_search_chatrooms(storage, userName):
+    with storage.updateLock:
+        for m in storage.chatroomList:
+            if m['UserName'] == userName:
+                return copy.deepcopy(m)
+
+def legacy_search_member(chatroom, userName):
+    for m in chatroom['MemberList']:
+        if m.get('UserName') == userName:
+            return m
+
+def timeit(label, fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    cost = time.perf_counter() - start
+    print('%-36s %8.1f us/op' % (label, cost / n * 1e6))
+
+if __name__ == '__main__':
+    friends, chatrooms, members = [int(a) for a in sys.argv[1:4]] + [5000, 500, 100][len(sys.argv[1:4]):]
+    start = time.perf_counter()
+    storage = build_storage(friends, chatrooms, members)
+    print('%d friends, %d chatrooms x %d members, built in %.2fs' % (
+        friends, chatrooms, members, time.perf_counter() - start))
+    n = 200
+    # a message from a friend: search_mps + search_friends by userName
+    timeit('legacy friend by userName', lambda i: legacy_search_friends(
+        storage, userName='@friend%d' % (i * 7919 % friends)), n)
+    timeit('indexed friend by userName', lambda i: (storage.search_mps(userName='@friend%d' % (i * 7919 % friends)),
+        storage.search_friends(userName='@friend%d' % (i * 7919 % friends))), n)
+    timeit('legacy friend by name', lambda i: legacy_search_friends(
+        storage, name='remark%d' % (i * 7919 % friends)), n)
+    timeit('indexed friend by name', lambda i: storage.search_friends(
+        name='remark%d' % (i * 7919 % friends)), n)
+    # a message in a chatroom: search_chatrooms + member lookup
+    timeit('legacy chatroom + member', lambda i: legacy_search_member(legacy_search_chatrooms(
+        storage, '@@room%d' % (i % chatrooms)), '@member%d_%d' % (i % chatrooms, members - 1)), n)
+    timeit('indexed chatroom + member', lambda i: storage.search_chatrooms(
+        userName='@@room%d' % (i % chatrooms))['MemberList'].search(
+        'UserName', '@member%d_%d' % (i % chatrooms, members - 1)), n)
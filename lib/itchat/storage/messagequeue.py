@@ -1,4 +1,4 @@
-import logging
+import logging, time
 try:
     import Queue as queue
 except ImportError:
@@ -9,8 +9,18 @@ from .templates import AttributeDict
 logger = logging.getLogger('itchat')
 
 class Queue(queue.Queue):
+    ''' received messages waiting for replying
+        * put blocks when the queue is full, so a receiving loop slows down with handlers
+        * enqueueTime of messages is the time they are put, for reporting lag
+    '''
     def put(self, message):
-        queue.Queue.put(self, Message(message))
+        message = Message(message)
+        message.enqueueTime = time.time()
+        try:
+            queue.Queue.put(self, message, block=False)
+        except queue.Full:
+            logger.warning('%s messages are waiting for replying, receiving is paused.' % self.qsize())
+            queue.Queue.put(self, message)
 
 class Message(AttributeDict):
     def download(self, fileName):
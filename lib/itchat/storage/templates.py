@@ -26,8 +26,59 @@ class UnInitializedItchat(object):
     def __getattr__(self, value):
         return self._raise_error
 
+class ContactIndex(object):
+    ''' hash indexes of contacts by the exact value of some keys
+        * several contacts may share a name, so every value maps to a list
+        * contacts are stored as they are, nothing is copied
+        * values changed in place (like update_info_dict) need reindex
+    '''
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.clear()
+    def clear(self):
+        self.maps = dict((k, {}) for k in self.keys)
+        self.indexed = {} # id(contact) -> (contact, {key: indexed value})
+    def add(self, contact):
+        if id(contact) in self.indexed:
+            self.discard(contact)
+        values = {}
+        for k in self.keys:
+            v = contact.get(k)
+            if v is not None:
+                self.maps[k].setdefault(v, []).append(contact)
+                values[k] = v
+        self.indexed[id(contact)] = (contact, values)
+    def discard(self, contact):
+        entry = self.indexed.pop(id(contact), None)
+        if entry is None:
+            return
+        for k, v in entry[1].items():
+            bucket = self.maps[k].get(v, [])
+            for i, c in enumerate(bucket):
+                if c is contact:
+                    del bucket[i]
+                    break
+            if not bucket:
+                self.maps[k].pop(v, None)
+    def reindex(self, contact):
+        ''' refresh a contact after its values changed, return False if it is not indexed '''
+        if id(contact) not in self.indexed:
+            return False
+        self.add(contact)
+        return True
+    def rebuild(self, contacts):
+        self.clear()
+        for c in contacts:
+            self.add(c)
+    def get(self, key, value):
+        return self.maps[key].get(value, [])
+    def first(self, key, value):
+        bucket = self.maps[key].get(value)
+        return bucket[0] if bucket else None
+
 class ContactList(list):
-    ''' when a dict is append, init function will be called to format that dict '''
+    ''' when a dict is append, init function will be called to format that dict
+        * set_index builds hash indexes that are kept up to date on append and del '''
     def __init__(self, *args, **kwargs):
         super(ContactList, self).__init__(*args, **kwargs)
         self.__setstate__(None)
@@ -42,23 +93,50 @@ class ContactList(list):
             self.contactInitFn = initFunction
         if hasattr(contactClass, '__call__'):
             self.contactClass = contactClass
+    def set_index(self, keys):
+        self.index = ContactIndex(keys)
+        self.index.rebuild(self)
     def append(self, value):
         contact = self.contactClass(value)
         contact.core = self.core
         if self.contactInitFn is not None:
             contact = self.contactInitFn(self, contact) or contact
         super(ContactList, self).append(contact)
+        if self.index is not None:
+            self.index.add(contact)
+    def __delitem__(self, key):
+        if self.index is None:
+            return super(ContactList, self).__delitem__(key)
+        if isinstance(key, slice):
+            super(ContactList, self).__delitem__(key)
+            self.index.rebuild(self)
+        else:
+            contact = self[key]
+            super(ContactList, self).__delitem__(key)
+            self.index.discard(contact)
+    def search(self, key, value):
+        ''' return the first contact whose key equals value, use the index if there is one '''
+        if self.index is not None and key in self.index.keys:
+            return self.index.first(key, value)
+        for c in self:
+            if c.get(key) == value:
+                return c
+    def reindex(self, contact):
+        return self.index is not None and self.index.reindex(contact)
     def __deepcopy__(self, memo):
         r = self.__class__([copy.deepcopy(v) for v in self])
         r.contactInitFn = self.contactInitFn
         r.contactClass = self.contactClass
         r.core = self.core
+        if self.index is not None:
+            r.set_index(self.index.keys)
         return r
     def __getstate__(self):
         return 1
     def __setstate__(self, state):
         self.contactInitFn = None
         self.contactClass = User
+        self.index = None
     def __str__(self):
         return '[%s]' % ', '.join([repr(v) for v in self])
     def __repr__(self):
@@ -124,6 +202,14 @@ class AbstractUserDict(AttributeDict):
             'Ret': -1006,
             'ErrMsg': '%s do not have members' % \
                 self.__class__.__name__, }, })
+    def snapshot(self):
+        ''' a cheap copy for returning from searches
+            * top level values are copied, so setting a key does not touch the stored contact
+            * nested values like MemberList are shared and should be treated as read-only '''
+        r = self.__class__.__new__(self.__class__)
+        dict.update(r, self)
+        r.__dict__.update(self.__dict__)
+        return r
     def __deepcopy__(self, memo):
         r = self.__class__()
         for k, v in self.items():
@@ -183,6 +269,7 @@ class Chatroom(AbstractUserDict):
             d.chatroom = refSelf() or \
                 parentList.core.search_chatrooms(userName=userName)
         memberList.set_default_value(init_fn, ChatroomMember)
+        memberList.set_index(('UserName',))
         if 'MemberList' in self:
             for member in self.memberList:
                 memberList.append(member)
@@ -216,9 +303,9 @@ class Chatroom(AbstractUserDict):
             if (name or userName or remarkName or nickName or wechatAccount) is None:
                 return None
             elif userName: # return the only userName match
-                for m in self.memberList:
-                    if m.userName == userName:
-                        return copy.deepcopy(m)
+                m = self.memberList.search('UserName', userName)
+                if m is not None:
+                    return m.snapshot()
             else:
                 matchDict = {
                     'RemarkName' : remarkName,
@@ -239,9 +326,9 @@ class Chatroom(AbstractUserDict):
                     for m in contact:
                         if all([m.get(k) == v for k, v in matchDict.items()]):
                             friendList.append(m)
-                    return copy.deepcopy(friendList)
+                    return [m.snapshot() for m in friendList]
                 else:
-                    return copy.deepcopy(contact)
+                    return [m.snapshot() for m in contact]
     def __setstate__(self, state):
         super(Chatroom, self).__setstate__(state)
         if not 'MemberList' in self:
@@ -1,4 +1,5 @@
-import re, os, sys, subprocess, copy, traceback, logging
+import re, os, sys, subprocess, copy, traceback, logging, inspect
+import io, mmap, hashlib
 
 try:
     from HTMLParser import HTMLParser
@@ -114,6 +115,8 @@ def struct_friend_info(knownInfo):
 def search_dict_list(l, key, value):
     ''' Search a list of dict
         * return dict with specific value & key '''
+    if hasattr(l, 'search'): # ContactList, use its index if there is one
+        return l.search(key, value)
     for i in l:
         if i.get(key) == value:
             return i
@@ -142,6 +145,51 @@ def contact_deep_copy(core, contact):
     with core.storageClass.updateLock:
         return copy.deepcopy(contact)
 
+async def maybe_await(value):
+    ''' callbacks given to the async core may be plain functions or coroutine functions '''
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+def save_response(r, fileDir=None):
+    ''' stream a response in large chunks
+        * fileDir is None: return the content
+        * otherwise write it into fileDir chunk by chunk and return its first 20 bytes '''
+    if fileDir is None:
+        return b''.join(r.iter_content(config.DOWNLOAD_CHUNK_SIZE))
+    head = b''
+    with open(fileDir, 'wb') as f:
+        for block in r.iter_content(config.DOWNLOAD_CHUNK_SIZE):
+            if len(head) < 20:
+                head += block[:20 - len(head)]
+            f.write(block)
+    return head
+
+def file_md5(file_):
+    ''' size and md5 of an opened file from its current position, the position is restored
+        * files on disk are hashed through mmap so the content is never copied into memory '''
+    start = file_.tell()
+    try:
+        fileno = file_.fileno()
+    except (AttributeError, io.UnsupportedOperation, OSError):
+        fileno = None
+    if fileno is not None:
+        size = max(os.fstat(fileno).st_size - start, 0)
+        if size == 0:
+            return 0, hashlib.md5().hexdigest()
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as m:
+            with memoryview(m) as view, view[start:] as data:
+                return size, hashlib.md5(data).hexdigest()
+    md5, size = hashlib.md5(), 0
+    while True:
+        block = file_.read(config.UPLOAD_CHUNK_SIZE)
+        if not block:
+            break
+        md5.update(block)
+        size += len(block)
+    file_.seek(start)
+    return size, md5.hexdigest()
+
 def get_image_postfix(data):
     data = data[:20]
     if b'GIF' in data:
@@ -2,6 +2,7 @@
 
 import json
 import os
+import time
 
 import plugins
 from bridge.context import ContextType
@@ -9,7 +10,7 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from plugins import *
 
-from .lib.WordsSearch import WordsSearch
+from .lib.ArrayWordsSearch import ArrayWordsSearch
 
 
 @plugins.register(
@@ -19,6 +20,9 @@ from .lib.WordsSearch import WordsSearch
     desc="判断消息中是否有敏感词、决定是否回复。",
     version="1.0",
     author="lanvent",
+    events=[Event.ON_HANDLE_CONTEXT, Event.ON_DECORATE_REPLY, Event.ON_DECORATE_STREAM],
+    # 回复过滤按回复类型判断，不限制消息类型
+    context_types={Event.ON_HANDLE_CONTEXT: [ContextType.TEXT, ContextType.IMAGE_CREATE]},
 )
 class Banwords(Plugin):
     def __init__(self):
@@ -35,7 +39,7 @@ class Banwords(Plugin):
                     with open(config_path, "w") as f:
                         json.dump(conf, f, indent=4)
 
-            self.searchr = WordsSearch()
+            self.searchr = ArrayWordsSearch()
             self.action = conf["action"]
             banwords_path = os.path.join(curdir, "banwords.txt")
             with open(banwords_path, "r", encoding="utf-8") as f:
@@ -44,10 +48,14 @@ class Banwords(Plugin):
                     word = line.strip()
                     if word:
                         words.append(word)
-            self.searchr.SetKeywords(words)
+            # 词表没有变化时直接加载上次构建的自动机
+            start = time.time()
+            loaded = self.searchr.SetKeywords(words, cache_path=os.path.join(curdir, "banwords.automaton"))
+            logger.debug("[Banwords] %d words %s in %.3fs" % (len(words), "loaded" if loaded else "compiled", time.time() - start))
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             if conf.get("reply_filter", True):
                 self.handlers[Event.ON_DECORATE_REPLY] = self.on_decorate_reply
+                self.handlers[Event.ON_DECORATE_STREAM] = self.on_decorate_stream
                 self.reply_action = conf.get("reply_action", "ignore")
             logger.info("[Banwords] inited")
         except Exception as e:
@@ -96,5 +104,31 @@ class Banwords(Plugin):
                 e_context.action = EventAction.CONTINUE
                 return
 
+    def on_decorate_stream(self, e_context: EventContext):
+        # 流式回复逐段过滤：ignore在敏感词之前停止回复，replace替换敏感词后继续
+        replace_char = "*" if self.reply_action == "replace" else None
+        e_context["filters"].append(BanwordsStreamFilter(self.searchr.Stream(replace_char)))
+
     def get_help_text(self, **kwargs):
         return "过滤消息中的敏感词。"
+
+
+class BanwordsStreamFilter(object):
+    """ON_DECORATE_STREAM的过滤器，自动机状态跨片段保留，只有可能是敏感词开头的内容会被暂缓发出"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    @property
+    def stopped(self):
+        return self.stream.Stopped
+
+    def feed(self, chunk):
+        found = self.stream.Found
+        text = self.stream.Feed(chunk)
+        if found is None and self.stream.Found:
+            logger.info("[Banwords] %s in reply" % self.stream.Found["Keyword"])
+        return text
+
+    def flush(self):
+        return self.stream.Flush()
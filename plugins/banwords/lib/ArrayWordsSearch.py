@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+基于扁平转移表和整数数组的Aho-Corasick多模式匹配，接口与WordsSearch相同(FindFirst/FindAll/ContainsAny/Replace)，结果也相同
+
+- 状态按层编号，自动机的全部转移是一张以 状态*0x110000+码位 为键的表，失败指针和输出(每个状态的匹配结果)都是整数数组，
+  扫描循环里只有查表和下标运算，没有节点对象
+- 文本整段编码为UTF-32后直接按整数读取码位；不含任何关键词首字符的文本不进入循环
+- Stream()返回增量匹配器WordsStream，文本可以分段传入，用于流式回复
+- 构建好的自动机可以保存到文件，按词表的sha256校验，词表不变时直接加载，不必重新构建
+"""
+
+import hashlib
+import os
+import pickle
+from array import array
+
+__all__ = ["ArrayWordsSearch", "WordsStream"]
+
+# 自动机格式变化时加1，旧的缓存文件自动失效
+_FORMAT_VERSION = 2
+# 转移表键中状态的倍数，大于任何字符的码位
+_WIDTH = 0x110000
+_ARRAYS = ("edge_keys", "edge_targets", "fail", "depth", "out_len", "out_start", "out_items")
+
+
+def keywords_digest(keywords):
+    digest = hashlib.sha256("v{}".format(_FORMAT_VERSION).encode("utf-8"))
+    for word in keywords:
+        digest.update(b"\n")
+        digest.update(word.encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+
+class ArrayWordsSearch:
+    def __init__(self):
+        self._keywords = []
+        self._indexs = []
+        self._min_len = 0
+        self._edge_keys = array("q")
+        self._edge_targets = self._fail = self._depth = self._out_len = self._out_start = self._out_items = array("i")
+        self._compile_scanner()
+
+    def SetKeywords(self, keywords, cache_path=None):
+        """
+        :param keywords: 关键词列表，结果中的Index为关键词在列表中的下标
+        :param cache_path: 自动机缓存文件，词表与缓存一致时直接加载，否则构建后写入
+        :return: 是否从缓存加载
+        """
+        keywords = list(keywords)
+        digest = keywords_digest(keywords) if cache_path else None
+        loaded = bool(cache_path) and self._load(cache_path, digest)
+        if not loaded:
+            self._build(keywords)
+        self._keywords = keywords
+        self._indexs = list(range(len(keywords)))
+        self._min_len = min((len(word) for word in keywords if word), default=0)
+        self._compile_scanner()
+        if cache_path and not loaded:
+            self._save(cache_path, digest)
+        return loaded
+
+    def FindFirst(self, text):
+        for index, state in self._matches(text):
+            item = self._out_items[self._out_start[state]]
+            return self._result(item, index)
+        return None
+
+    def FindAll(self, text):
+        out_start, out_items = self._out_start, self._out_items
+        result = []
+        for index, state in self._matches(text):
+            for j in range(out_start[state], out_start[state + 1]):
+                result.append(self._result(out_items[j], index))
+        return result
+
+    def ContainsAny(self, text):
+        for _ in self._matches(text):
+            return True
+        return False
+
+    def Replace(self, text, replaceChar="*"):
+        result = None
+        out_len = self._out_len
+        for index, state in self._matches(text):
+            if result is None:
+                result = list(text)
+            # 与WordsSearch相同，按该位置结束的最长关键词替换
+            start = index + 1 - out_len[state]
+            result[start : index + 1] = [replaceChar] * (index + 1 - start)
+        return text if result is None else "".join(result)
+
+    def Stream(self, replaceChar="*"):
+        """
+        :param replaceChar: 见WordsStream
+        :return: 新的增量匹配器，每段流式文本用一个
+        """
+        return WordsStream(self, replaceChar)
+
+    def _result(self, item, index):
+        keyword = self._keywords[item]
+        return {"Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item]}
+
+    def _matches(self, text):
+        """按顺序产生(结束位置, 状态)，只在有关键词结束的位置产生"""
+        if len(text) < self._min_len or self._first_chars.isdisjoint(text):
+            # 没有任何关键词的首字符时不可能匹配，isdisjoint在C中完成
+            return
+        get, root, fail, out_len = self._goto.get, self._root.get, self._fail_list, self._out_len_list
+        s = 0
+        i = -1
+        # 整段编码为UTF-32后按4字节整数读取，循环内不再逐字符调用ord
+        for c in memoryview(text.encode("utf-32-le", "surrogatepass")).cast("I"):
+            i += 1
+            if s:
+                t = get(s * _WIDTH + c, 0)
+                # 没有c的转移时沿失败指针回退，回到根仍没有则停在根
+                while not t and s:
+                    s = fail[s]
+                    t = get(s * _WIDTH + c, 0)
+                s = t
+            else:
+                s = root(c, 0)
+            if out_len[s]:
+                yield i, s
+
+    def _compile_scanner(self):
+        self._goto = dict(zip(self._edge_keys, self._edge_targets))
+        # 大部分字符在根状态上处理，根的转移单独放一个小表
+        self._root = {key: target for key, target in zip(self._edge_keys, self._edge_targets) if key < _WIDTH}
+        self._first_chars = frozenset(map(chr, self._root))
+        # 扫描用list，下标访问比array快(array每次取值都要新建int对象)；保存到文件的仍是array
+        self._fail_list = self._fail.tolist()
+        self._out_len_list = self._out_len.tolist()
+        self._depth_list = self._depth.tolist()
+
+    def _build(self, keywords):
+        # 字典树，节点编号即加入顺序
+        children = [{}]
+        own = [[]]
+        for i, word in enumerate(keywords):
+            node = 0
+            for ch in word:
+                c = ord(ch)
+                nxt = children[node].get(c)
+                if nxt is None:
+                    nxt = children[node][c] = len(children)
+                    children.append({})
+                    own.append([])
+                node = nxt
+            own[node].append(i)
+
+        # 按层遍历求失败指针和每个节点的匹配结果：自身的关键词在前，失败指针上的(更短的)关键词在后
+        count = len(children)
+        fail = [0] * count
+        results = [None] * count
+        results[0] = []
+        order = [0]
+        for node in order:
+            for c, child in children[node].items():
+                if node:
+                    f = fail[node]
+                    while f and c not in children[f]:
+                        f = fail[f]
+                    fail[child] = children[f].get(c, 0)
+                order.append(child)
+            if node:
+                inherited = results[fail[node]]
+                if own[node]:
+                    seen = set(own[node])
+                    results[node] = own[node] + [item for item in inherited if item not in seen]
+                else:
+                    results[node] = inherited
+
+        # 按层重新编号，所有转移放进一张表：状态s经字符c到状态t记为 s * _WIDTH + ord(c) -> t
+        state_of = [0] * count
+        for state, node in enumerate(order):
+            state_of[node] = state
+        edge_keys = array("q")
+        edge_targets = array("i")
+        fail_arr = array("i", bytes(4 * count))
+        depth = array("i", bytes(4 * count))
+        out_len = array("i", bytes(4 * count))
+        out_start = array("i", bytes(4 * (count + 1)))
+        out_items = array("i")
+        for state, node in enumerate(order):
+            for c, child in children[node].items():
+                edge_keys.append(state * _WIDTH + c)
+                edge_targets.append(state_of[child])
+                depth[state_of[child]] = depth[state] + 1
+            fail_arr[state] = state_of[fail[node]]
+            out_start[state] = len(out_items)
+            if results[node]:
+                out_len[state] = len(keywords[results[node][0]])
+                out_items.extend(results[node])
+        out_start[count] = len(out_items)
+
+        self._edge_keys, self._edge_targets, self._fail, self._depth = edge_keys, edge_targets, fail_arr, depth
+        self._out_len, self._out_start, self._out_items = out_len, out_start, out_items
+
+    def _save(self, path, digest):
+        data = {"version": _FORMAT_VERSION, "digest": digest}
+        for name in _ARRAYS:
+            data[name] = getattr(self, "_" + name)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            # 缓存写不了不影响使用
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _load(self, path, digest):
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError, AttributeError, ValueError):
+            return False
+        if not isinstance(data, dict) or data.get("version") != _FORMAT_VERSION or data.get("digest") != digest:
+            return False
+        for name in _ARRAYS:
+            setattr(self, "_" + name, data[name])
+        return True
+
+
+class WordsStream:
+    """
+    ArrayWordsSearch的增量匹配，文本分段传入，自动机状态跨段保留，结果与对整段文本匹配相同
+
+    每段处理完后只保留可能是关键词开头的最短后缀(长度为当前状态的深度)，之前的内容已确定不会再被匹配，立即返回；
+    所以关键词即使跨段也不会有一部分被提前返回，而不含关键词字符的内容不会被延迟
+    """
+
+    def __init__(self, search, replaceChar="*"):
+        """
+        :param search: 已SetKeywords的ArrayWordsSearch
+        :param replaceChar: 匹配到的关键词替换为该字符，与Replace相同；
+            为None时在第一个匹配处停止，只返回关键词之前的内容，之后Feed不再返回内容
+        """
+        self._search = search
+        self._replaceChar = replaceChar
+        self._state = 0
+        self._pending = []
+        self._offset = 0  # _pending[0]在全部文本中的位置
+        self.Found = None  # 第一个匹配，格式与FindFirst相同，位置为在全部文本中的位置
+        self.Stopped = False
+
+    def Feed(self, text):
+        """
+        传入下一段文本
+        :return: 已确定的内容，可能为空字符串
+        """
+        if self.Stopped or not text:
+            return ""
+        search = self._search
+        get, root, fail, out_len = search._goto.get, search._root.get, search._fail_list, search._out_len_list
+        replaceChar = self._replaceChar
+        pending = self._pending
+        offset = self._offset
+        i = offset + len(pending) - 1
+        pending.extend(text)
+        s = self._state
+        for c in memoryview(text.encode("utf-32-le", "surrogatepass")).cast("I"):
+            i += 1
+            if s:
+                t = get(s * _WIDTH + c, 0)
+                while not t and s:
+                    s = fail[s]
+                    t = get(s * _WIDTH + c, 0)
+                s = t
+            else:
+                s = root(c, 0)
+            if out_len[s]:
+                start = i + 1 - out_len[s]
+                if self.Found is None:
+                    self.Found = search._result(search._out_items[search._out_start[s]], i)
+                if replaceChar is None:
+                    self.Stopped = True
+                    result = "".join(pending[: start - offset])
+                    pending.clear()
+                    return result
+                # 关键词一定还在保留的后缀中
+                pending[start - offset : i + 1 - offset] = [replaceChar] * (i + 1 - start)
+        self._state = s
+        release = len(pending) - search._depth_list[s]
+        if release <= 0:
+            return ""
+        result = "".join(pending[:release])
+        del pending[:release]
+        self._offset = offset + release
+        return result
+
+    def Flush(self):
+        """
+        文本结束，返回保留的后缀
+        """
+        result = "".join(self._pending)
+        self._offset += len(self._pending)
+        self._pending.clear()
+        self._state = 0
+        return result
@@ -4,11 +4,12 @@ import os
 import uuid
 from uuid import getnode as get_mac
 
-import requests
 
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.credential_cache import get_credential
+from common.http_client import get_session
 from common.log import logger
 from plugins import *
 
@@ -24,6 +25,8 @@ from plugins import *
     desc="Baidu unit bot system",
     version="0.1",
     author="jackson",
+    events=[Event.ON_HANDLE_CONTEXT],
+    context_types=[ContextType.TEXT],
 )
 class BDunit(Plugin):
     def __init__(self):
@@ -35,7 +38,8 @@ class BDunit(Plugin):
             self.service_id = conf["service_id"]
             self.api_key = conf["api_key"]
             self.secret_key = conf["secret_key"]
-            self.access_token = self.get_token()
+            # 初始化时先获取一次，配置错误时直接报错
+            self.get_token()
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             logger.info("[BDunit] inited")
         except Exception as e:
@@ -65,20 +69,24 @@ class BDunit(Plugin):
         return help_text
 
     def get_token(self):
-        """获取访问百度UUNIT 的access_token
+        """获取访问百度UUNIT 的access_token，有效期内复用缓存
         #param api_key: UNIT apk_key
         #param secret_key: UNIT secret_key
         Returns:
             string: access_token
         """
+        return get_credential("baidu_unit", self.api_key, self._fetch_token)
+
+    def _fetch_token(self):
         url = "https://aip.baidubce.com/oauth/2.0/token?client_id={}&client_secret={}&grant_type=client_credentials".format(self.api_key, self.secret_key)
         payload = ""
         headers = {"Content-Type": "application/json", "Accept": "application/json"}
 
-        response = requests.request("POST", url, headers=headers, data=payload)
+        response = get_session(url).post(url, headers=headers, data=payload)
 
         # print(response.text)
-        return response.json()["access_token"]
+        res = response.json()
+        return res["access_token"], res.get("expires_in", 2592000)
 
     def getUnit(self, query):
         """
@@ -87,7 +95,6 @@ class BDunit(Plugin):
         :returns: UNIT 解析结果。如果解析失败，返回 None
         """
 
-        url = "https://aip.baidubce.com/rpc/2.0/unit/service/v3/chat?access_token=" + self.access_token
         request = {
             "query": query,
             "user_id": str(get_mac())[:32],
@@ -101,8 +108,9 @@ class BDunit(Plugin):
             "request": request,
         }
         try:
+            url = "https://aip.baidubce.com/rpc/2.0/unit/service/v3/chat?access_token=" + self.get_token()
             headers = {"Content-Type": "application/json"}
-            response = requests.post(url, json=body, headers=headers)
+            response = get_session(url).post(url, json=body, headers=headers)
             return json.loads(response.text)
         except Exception:
             return None
@@ -114,7 +122,6 @@ class BDunit(Plugin):
         :param query: 用户的指令字符串
         :returns: UNIT 解析结果。如果解析失败，返回 None
         """
-        url = "https://aip.baidubce.com/rpc/2.0/unit/service/chat?access_token=" + self.access_token
         request = {"query": query, "user_id": str(get_mac())[:32]}
         body = {
             "log_id": str(uuid.uuid1()),
@@ -124,8 +131,9 @@ class BDunit(Plugin):
             "request": request,
         }
         try:
+            url = "https://aip.baidubce.com/rpc/2.0/unit/service/chat?access_token=" + self.get_token()
             headers = {"Content-Type": "application/json"}
-            response = requests.post(url, json=body, headers=headers)
+            response = get_session(url).post(url, json=body, headers=headers)
             return json.loads(response.text)
         except Exception:
             return None
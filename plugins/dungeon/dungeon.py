@@ -48,6 +48,8 @@ class StoryTeller:
     desc="A plugin to play dungeon game",
     version="1.0",
     author="lanvent",
+    events=[Event.ON_HANDLE_CONTEXT],
+    context_types=[ContextType.TEXT],
 )
 class Dungeon(Plugin):
     def __init__(self):
@@ -26,6 +26,14 @@ class Event(Enum):
 
     # AFTER_SEND_REPLY = 5    # 发送回复后
 
+    ON_DECORATE_STREAM = 6  # 流式回复开始前
+    """
+    e_context = {  "channel": 消息channel, "context" : 本次消息的context, "filters" : 回复片段的过滤器列表，初始为空 }
+    过滤器需实现 feed(chunk) -> str、flush() -> str 和属性 stopped，按加入顺序依次处理每个片段，
+    flush在回复结束时调用，返回过滤器保留的内容；stopped为True时不再生成后续片段，
+    该过滤器放行的内容仍依次经过后面的过滤器，后面的过滤器随即flush
+    """
+
 
 class EventAction(Enum):
     CONTINUE = 1  # 事件未结束，继续交给下个插件处理，如果没有下个插件，则交付给默认的事件处理逻辑
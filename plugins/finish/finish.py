@@ -15,6 +15,8 @@ from plugins import *
     desc="A plugin that check unknown command",
     version="1.0",
     author="js00000",
+    events=[Event.ON_HANDLE_CONTEXT],
+    context_types=[ContextType.TEXT],
 )
 class Finish(Plugin):
     def __init__(self):
@@ -13,6 +13,7 @@ from bridge.bridge import Bridge
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common import const
+from common.http_client import close_all_sessions
 from config import conf, load_config, global_config
 from plugins import *
 
@@ -92,6 +93,10 @@ ADMIN_COMMANDS = {
         "alias": ["plist", "插件"],
         "desc": "打印当前插件列表",
     },
+    "pstats": {
+        "alias": ["pstats", "插件耗时"],
+        "desc": "打印各插件的调用次数和耗时",
+    },
     "setpri": {
         "alias": ["setpri", "设置插件优先级"],
         "args": ["插件名", "优先级"],
@@ -336,6 +341,8 @@ class Godcmd(Plugin):
                             ok, result = True, "服务已恢复"
                         elif cmd == "reconf":
                             load_config()
+                            # 连接池按新的超时、重试配置重建
+                            close_all_sessions()
                             ok, result = True, "配置已重载"
                         elif cmd == "resetall":
                             if bottype in [const.OPEN_AI, const.CHATGPT, const.CHATGPTONAZURE, const.LINKAI,
@@ -363,6 +370,15 @@ class Godcmd(Plugin):
                                     result += "已启用\n"
                                 else:
                                     result += "未启用\n"
+                        elif cmd == "pstats":
+                            stats = PluginManager().get_plugin_stats()
+                            ok = True
+                            result = "插件耗时：\n" if stats else "暂无插件调用记录"
+                            for name, item in sorted(stats.items(), key=lambda kv: kv[1]["total_ms"], reverse=True):
+                                result += f"{name} 调用{item['calls']}次 平均{item['avg_ms']}ms 最长{item['max_ms']}ms"
+                                if item["timeouts"] or item["errors"]:
+                                    result += f" 超时{item['timeouts']}次 异常{item['errors']}次"
+                                result += "\n"
                         elif cmd == "scanp":
                             new_plugins = PluginManager().scan_plugins()
                             ok, result = True, "插件扫描完成"
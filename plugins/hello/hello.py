@@ -14,7 +14,9 @@ from config import conf
     hidden=True,
     desc="A simple plugin that says hello",
     version="0.1",
-    author="lanvent"
+    author="lanvent",
+    events=[Event.ON_HANDLE_CONTEXT],
+    context_types=[ContextType.TEXT, ContextType.JOIN_GROUP, ContextType.PATPAT, ContextType.EXIT_GROUP],
 )
 class Hello(Plugin):
     group_welc_prompt = "请你随机使用一种风格说一句问候语来欢迎新用户\"{nickname}\"加入群聊。"
@@ -1,22 +1,35 @@
 # encoding:utf-8
 
+import io
 import json
 import os
-import requests
+import threading
+
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.http_client import get_session
 from common.log import logger
+from common.media_cache import MediaCache
+from common.tmp_dir import TmpDir
 from plugins import *
 
+from .matcher import build_matcher
+
+_IMAGE_EXTS = (".jpg", ".webp", ".jpeg", ".png", ".gif", ".img")
+_FILE_EXTS = (".pdf", ".doc", ".docx", ".xls", ".xlsx", ".zip", ".rar")
+_VIDEO_EXTS = (".mp4",)
+
 
 @plugins.register(
     name="Keyword",
     desire_priority=900,
     hidden=True,
     desc="关键词匹配过滤",
-    version="0.1",
+    version="0.2",
     author="fengyege.top",
+    events=[Event.ON_HANDLE_CONTEXT],
+    context_types=[ContextType.TEXT],
 )
 class Keyword(Plugin):
     def __init__(self):
@@ -36,8 +49,21 @@ class Keyword(Plugin):
                     conf = json.load(f)
             # 加载关键词
             self.keyword = conf["keyword"]
+            self.matcher = build_matcher(conf)
 
-            logger.info("[keyword] {}".format(self.keyword))
+            # 回复中的图片、视频、文件下载一次后缓存在本地
+            cache_conf = conf.get("media_cache") or {}
+            self.media_cache = None
+            if cache_conf.get("enabled", True):
+                self.media_cache = MediaCache(
+                    os.path.join(TmpDir().path(), "keyword_media"),
+                    revalidate_after=cache_conf.get("revalidate_seconds", 3600),
+                    memory_limit=int(cache_conf.get("memory_mb", 64) * 1024 * 1024),
+                )
+                if cache_conf.get("prefetch", True):
+                    threading.Thread(target=self._prefetch, name="keyword_prefetch", daemon=True).start()
+
+            logger.info("[keyword] {} rules: {}".format(len(self.matcher), self.keyword))
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             logger.info("[keyword] inited.")
         except Exception as e:
@@ -50,47 +76,76 @@ class Keyword(Plugin):
 
         content = e_context["context"].content.strip()
         logger.debug("[keyword] on_handle_context. content: %s" % content)
-        if content in self.keyword:
-            logger.info(f"[keyword] 匹配到关键字【{content}】")
-            reply_text = self.keyword[content]
-
-            # 判断匹配内容的类型
-            if (reply_text.startswith("http://") or reply_text.startswith("https://")) and any(reply_text.endswith(ext) for ext in [".jpg", ".webp", ".jpeg", ".png", ".gif", ".img"]):
-            # 如果是以 http:// 或 https:// 开头，且".jpg", ".jpeg", ".png", ".gif", ".img"结尾，则认为是图片 URL。
-                reply = Reply()
-                reply.type = ReplyType.IMAGE_URL
-                reply.content = reply_text
-                
-            elif (reply_text.startswith("http://") or reply_text.startswith("https://")) and any(reply_text.endswith(ext) for ext in [".pdf", ".doc", ".docx", ".xls", "xlsx",".zip", ".rar"]):
-            # 如果是以 http:// 或 https:// 开头，且".pdf", ".doc", ".docx", ".xls", "xlsx",".zip", ".rar"结尾，则下载文件到tmp目录并发送给用户
-                file_path = "tmp"
-                if not os.path.exists(file_path):
-                    os.makedirs(file_path)
-                file_name = reply_text.split("/")[-1]  # 获取文件名
-                file_path = os.path.join(file_path, file_name)
-                response = requests.get(reply_text)
-                with open(file_path, "wb") as f:
-                    f.write(response.content)
-                #channel/wechat/wechat_channel.py和channel/wechat_channel.py中缺少ReplyType.FILE类型。
-                reply = Reply()
-                reply.type = ReplyType.FILE
-                reply.content = file_path
-            
-            elif (reply_text.startswith("http://") or reply_text.startswith("https://")) and any(reply_text.endswith(ext) for ext in [".mp4"]):
-            # 如果是以 http:// 或 https:// 开头，且".mp4"结尾，则下载视频到tmp目录并发送给用户
-                reply = Reply()
-                reply.type = ReplyType.VIDEO_URL
-                reply.content = reply_text
-                
-            else:
-            # 否则认为是普通文本
-                reply = Reply()
-                reply.type = ReplyType.TEXT
-                reply.content = reply_text
-            
-            e_context["reply"] = reply
+        rule = self.matcher.match(content)
+        if rule:
+            rule_type, match, reply_text = rule
+            logger.info(f"[keyword] 匹配到关键字【{match}】({rule_type})")
+            e_context["reply"] = self._build_reply(reply_text, e_context["channel"])
             e_context.action = EventAction.BREAK_PASS  # 事件结束，并跳过处理context的默认逻辑
-            
+
+    def _build_reply(self, reply_text, channel) -> Reply:
+        if not reply_text.startswith(("http://", "https://")):
+            # 否则认为是普通文本
+            return Reply(ReplyType.TEXT, reply_text)
+
+        if reply_text.endswith(_IMAGE_EXTS):
+            # 通道能直接发送图片内容时从缓存读取，webp需要通道自己转换格式，仍按URL发送
+            if not reply_text.endswith(".webp") and self._supports(channel, ReplyType.IMAGE):
+                data = self._cached_bytes(reply_text)
+                if data is not None:
+                    return Reply(ReplyType.IMAGE, io.BytesIO(data))
+            return Reply(ReplyType.IMAGE_URL, reply_text)
+
+        if reply_text.endswith(_FILE_EXTS):
+            # 文件下载到本地后发送给用户
+            # channel/wechat/wechat_channel.py和channel/wechat_channel.py中缺少ReplyType.FILE类型。
+            try:
+                if self.media_cache:
+                    file_path = self.media_cache.get_path(reply_text)
+                else:
+                    file_path = self._download_to_tmp(reply_text)
+            except Exception as e:
+                logger.error("[keyword] download file failed, url={}, error={}".format(reply_text, e))
+                return Reply(ReplyType.TEXT, reply_text)
+            return Reply(ReplyType.FILE, file_path)
+
+        if reply_text.endswith(_VIDEO_EXTS):
+            if self._supports(channel, ReplyType.VIDEO):
+                data = self._cached_bytes(reply_text)
+                if data is not None:
+                    return Reply(ReplyType.VIDEO, io.BytesIO(data))
+            return Reply(ReplyType.VIDEO_URL, reply_text)
+
+        return Reply(ReplyType.TEXT, reply_text)
+
+    def _supports(self, channel, reply_type) -> bool:
+        return self.media_cache is not None and channel is not None and reply_type not in getattr(channel, "NOT_SUPPORT_REPLYTYPE", [])
+
+    def _cached_bytes(self, url):
+        try:
+            return self.media_cache.get_bytes(url)
+        except Exception as e:
+            # 下载失败时退回到发送URL，由通道自己下载
+            logger.warning("[keyword] fetch media failed, url={}, error={}".format(url, e))
+            return None
+
+    def _download_to_tmp(self, url) -> str:
+        file_path = os.path.join(TmpDir().path(), url.split("/")[-1])
+        response = get_session().get(url)
+        response.raise_for_status()
+        with open(file_path, "wb") as f:
+            f.write(response.content)
+        return file_path
+
+    def _prefetch(self):
+        # 启动后在后台下载规则中的媒体，第一次命中时也不必等待下载
+        for _, _, reply_text in self.matcher.rules:
+            if isinstance(reply_text, str) and reply_text.startswith(("http://", "https://")) and reply_text.endswith(_IMAGE_EXTS + _FILE_EXTS + _VIDEO_EXTS):
+                try:
+                    self.media_cache.get_path(reply_text)
+                except Exception as e:
+                    logger.warning("[keyword] prefetch failed, url={}, error={}".format(reply_text, e))
+
     def get_help_text(self, **kwargs):
         help_text = "关键词过滤"
         return help_text
@@ -0,0 +1,124 @@
+# encoding:utf-8
+"""
+关键词规则匹配
+
+规则类型：
+- exact: 消息与关键词完全相同
+- prefix: 消息以关键词开头
+- contains: 消息中包含关键词
+- regex: 正则表达式能在消息中找到匹配(re.search)
+
+多条规则都能匹配时，按规则的先后顺序取第一条。
+exact/prefix/contains三类关键词放在同一棵字典树中，从消息开头走一遍即可得到全部exact和prefix规则，
+只有contains规则才需要从其他位置开始再走；正则只检查排在已匹配规则之前的，按顺序找到一条就停止。
+"""
+import re
+
+from common.log import logger
+
+RULE_TYPES = ("exact", "prefix", "contains", "regex")
+
+
+class _Node(object):
+    __slots__ = ("children", "exact", "prefix", "contains")
+
+    def __init__(self):
+        self.children = {}
+        # 以该节点结尾的各类规则中最靠前的序号
+        self.exact = None
+        self.prefix = None
+        self.contains = None
+
+
+class KeywordMatcher(object):
+    def __init__(self):
+        self.root = _Node()
+        self.rules = []  # 序号 -> (类型, 关键词或正则, 回复)
+        self.regexes = []  # (序号, 编译后的正则)，按序号排列
+        self.first_contains = None  # 最靠前的contains规则序号
+
+    def add(self, rule_type, match, reply):
+        """
+        按顺序添加规则，无效的规则会抛出ValueError
+        """
+        if rule_type not in RULE_TYPES:
+            raise ValueError("unknown rule type: {}".format(rule_type))
+        if not match or not isinstance(match, str):
+            raise ValueError("empty match")
+        if reply is None:
+            raise ValueError("empty reply")
+        index = len(self.rules)
+        if rule_type == "regex":
+            try:
+                self.regexes.append((index, re.compile(match)))
+            except re.error as e:
+                raise ValueError("invalid regex {}: {}".format(match, e))
+        else:
+            node = self.root
+            for ch in match:
+                child = node.children.get(ch)
+                if child is None:
+                    child = node.children[ch] = _Node()
+                node = child
+            if getattr(node, rule_type) is None:
+                setattr(node, rule_type, index)
+            if rule_type == "contains" and self.first_contains is None:
+                self.first_contains = index
+        self.rules.append((rule_type, match, reply))
+
+    def match(self, content):
+        """
+        :return: 匹配到的第一条规则 (类型, 关键词或正则, 回复)，没有匹配时返回None
+        """
+        best = len(self.rules)
+        # 从开头走一遍：exact、prefix，以及从开头开始的contains
+        node = self.root
+        last = len(content) - 1
+        for i, ch in enumerate(content):
+            node = node.children.get(ch)
+            if node is None:
+                break
+            for index in (node.prefix, node.contains, node.exact if i == last else None):
+                if index is not None and index < best:
+                    best = index
+        # 从其他位置开始的contains
+        if self.first_contains is not None and self.first_contains < best:
+            children = self.root.children
+            for start in range(1, len(content)):
+                node = children.get(content[start])
+                i = start
+                while node is not None:
+                    if node.contains is not None and node.contains < best:
+                        best = node.contains
+                    i += 1
+                    if i > last:
+                        break
+                    node = node.children.get(content[i])
+                if best <= self.first_contains:
+                    break
+        for index, regex in self.regexes:
+            if index >= best:
+                break
+            if regex.search(content):
+                best = index
+                break
+        return self.rules[best] if best < len(self.rules) else None
+
+    def __len__(self):
+        return len(self.rules)
+
+
+def build_matcher(conf) -> KeywordMatcher:
+    """
+    由插件配置构建：先是keyword中的完全匹配规则，再按顺序加入rules中的规则
+    :param conf: {"keyword": {关键词: 回复}, "rules": [{"type": 类型, "match": 关键词或正则, "reply": 回复}]}
+    """
+    matcher = KeywordMatcher()
+    for keyword, reply in (conf.get("keyword") or {}).items():
+        matcher.add("exact", keyword, reply)
+    for rule in conf.get("rules") or []:
+        try:
+            matcher.add(rule.get("type", "exact"), rule.get("match"), rule.get("reply"))
+        except (ValueError, AttributeError) as e:
+            logger.warning("[keyword] skip invalid rule {}: {}".format(rule, e))
+    return matcher
@@ -1,4 +1,4 @@
-import requests
+from common.http_client import get_session
 from config import conf
 from common.log import logger
 import os
@@ -19,7 +19,7 @@ class LinkSummary:
         }
         url = self.base_url() + "/v1/summary/file"
         logger.info(f"[LinkSum] file summary, app_code={app_code}")
-        res = requests.post(url, headers=self.headers(), files=file_body, data=body, timeout=(5, 300))
+        res = get_session(url).post(url, headers=self.headers(), files=file_body, data=body, timeout=(5, 300))
         return self._parse_summary_res(res)
 
     def summary_url(self, url: str, app_code: str):
@@ -29,14 +29,14 @@ class LinkSummary:
             "app_code": app_code
         }
         logger.info(f"[LinkSum] url summary, app_code={app_code}")
-        res = requests.post(url=self.base_url() + "/v1/summary/url", headers=self.headers(), json=body, timeout=(5, 180))
+        res = get_session(self.base_url()).post(url=self.base_url() + "/v1/summary/url", headers=self.headers(), json=body, timeout=(5, 180))
         return self._parse_summary_res(res)
 
     def summary_chat(self, summary_id: str):
         body = {
             "summary_id": summary_id
         }
-        res = requests.post(url=self.base_url() + "/v1/summary/chat", headers=self.headers(), json=body, timeout=(5, 180))
+        res = get_session(self.base_url()).post(url=self.base_url() + "/v1/summary/chat", headers=self.headers(), json=body, timeout=(5, 180))
         if res.status_code == 200:
             res = res.json()
             logger.debug(f"[LinkSum] chat open, res={res}")
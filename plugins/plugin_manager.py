@@ -5,7 +5,12 @@ import importlib.util
 import json
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
+from bridge.context import Context, ContextType
+from bridge.reply import Reply
 from common.log import logger
 from common.singleton import singleton
 from common.sorted_dict import SortedDict
@@ -23,8 +28,20 @@ class PluginManager:
         self.pconf = {}
         self.current_plugin_path = None
         self.loaded = {}
+        # (事件, 消息类型) -> 按优先级排列的插件名，以及每个事件下插件的排名
+        self._dispatch = ({}, {})
+        self.stats = {}  # 插件名 -> _PluginStats
+        self.stats_lock = threading.Lock()
+        self._timeout_pool = None
+        self._timeout_pool_lock = threading.Lock()
 
     def register(self, name: str, desire_priority: int = 0, **kwargs):
+        """
+        :param events: 插件处理的事件列表，为空时按插件实例的handlers
+        :param context_types: 插件处理的消息类型列表，或 {事件: 消息类型列表}，为空时处理所有类型
+        :param timeout: 插件处理单个事件的超时秒数，超时后跳过该插件，可被plugins.json中的timeout覆盖
+        """
+
         def wrapper(plugincls):
             plugincls.name = name
             plugincls.priority = desire_priority
@@ -34,6 +51,9 @@ class PluginManager:
             plugincls.version = kwargs.get("version") if kwargs.get("version") != None else "1.0"
             plugincls.namecn = kwargs.get("namecn") if kwargs.get("namecn") != None else name
             plugincls.hidden = kwargs.get("hidden") if kwargs.get("hidden") != None else False
+            plugincls.events = kwargs.get("events")
+            plugincls.context_types = kwargs.get("context_types")
+            plugincls.timeout = kwargs.get("timeout")
             plugincls.enabled = True
             if self.current_plugin_path == None:
                 raise Exception("Plugin path not set")
@@ -128,6 +148,7 @@ class PluginManager:
             else:
                 self.plugins[name].enabled = pconf["plugins"][rawname]["enabled"]
                 self.plugins[name].priority = pconf["plugins"][rawname]["priority"]
+                self.plugins[name].timeout = pconf["plugins"][rawname].get("timeout", plugincls.timeout)
                 self.plugins._update_heap(name)  # 更新下plugins中的顺序
         if modified:
             self.save_config()
@@ -136,6 +157,36 @@ class PluginManager:
     def refresh_order(self):
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
+        self._rebuild_dispatch_table()
+
+    def _rebuild_dispatch_table(self):
+        """
+        预先算好每个(事件, 消息类型)需要调用的插件，emit_event时直接查表，不再逐个调用插件判断类型
+        插件启用、禁用、调整优先级、重载和卸载后都需要重建
+        """
+        table, rank = {}, {}
+        for event, names in self.listening_plugins.items():
+            rank[event] = {name: i for i, name in enumerate(names)}
+            for ctype in list(ContextType) + [None]:
+                table[(event, ctype)] = self._dispatch_list(event, ctype, names)
+        self._dispatch = (table, rank)
+
+    def _dispatch_list(self, event, ctype, names=None) -> tuple:
+        if names is None:
+            names = self.listening_plugins.get(event, [])
+        return tuple(name for name in names if self._handles(name, event, ctype))
+
+    def _handles(self, name, event, ctype) -> bool:
+        plugincls = self.plugins.get(name)
+        instance = self.instances.get(name)
+        if plugincls is None or instance is None or not plugincls.enabled or event not in instance.handlers:
+            return False
+        if plugincls.events is not None and event not in plugincls.events:
+            return False
+        context_types = plugincls.context_types
+        if isinstance(context_types, dict):
+            context_types = context_types.get(event)
+        return context_types is None or ctype in context_types
 
     def activate_plugins(self):  # 生成新开启的插件实例
         failed_plugins = []
@@ -157,7 +208,9 @@ class PluginManager:
                 for event in instance.handlers:
                     if event not in self.listening_plugins:
                         self.listening_plugins[event] = []
-                    self.listening_plugins[event].append(name)
+                    # 重新激活的插件已在列表中
+                    if name not in self.listening_plugins[event]:
+                        self.listening_plugins[event].append(name)
         self.refresh_order()
         return failed_plugins
 
@@ -188,17 +241,119 @@ class PluginManager:
         self.activate_plugins()
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
-        if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
-                if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
-                    if e_context.is_break():
-                        e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+        table, rank = self._dispatch
+        event = e_context.event
+        context = e_context.econtext.get("context")
+        ctype = getattr(context, "type", None)
+        names = table.get((event, ctype))
+        if names is None:
+            names = self._dispatch_list(event, ctype)
+        i = 0
+        while i < len(names) and e_context.action == EventAction.CONTINUE:
+            name = names[i]
+            i += 1
+            logger.debug("Plugin %s triggered by event %s" % (name, event))
+            self._call_plugin(name, e_context, *args, **kwargs)
+            if e_context.is_break():
+                e_context["breaked_by"] = name
+                logger.debug("Plugin %s breaked event %s" % (name, event))
+            elif getattr(context, "type", None) != ctype:
+                # 插件修改了消息类型，剩下的插件按新类型重新查表
+                ctype = context.type
+                event_rank = rank.get(event, {})
+                names = table.get((event, ctype)) or self._dispatch_list(event, ctype)
+                names = [n for n in names if event_rank.get(n, -1) > event_rank.get(name, -1)]
+                i = 0
         return e_context
 
+    def _call_plugin(self, name, e_context: EventContext, *args, **kwargs):
+        """调用插件并记录耗时，插件抛出异常或超时都只跳过该插件，不影响后续插件和默认处理"""
+        handler = self.instances[name].handlers[e_context.event]
+        timeout = self.plugins[name].timeout or conf().get("plugin_timeout", 0)
+        status = "ok"
+        start = time.monotonic()
+        try:
+            if timeout:
+                status = self._call_with_timeout(name, handler, timeout, e_context, *args, **kwargs)
+            else:
+                handler(e_context, *args, **kwargs)
+        except Exception:
+            status = "error"
+            logger.exception("Plugin %s failed on event %s, skipped" % (name, e_context.event))
+        finally:
+            self._record(name, time.monotonic() - start, status)
+
+    def _call_with_timeout(self, name, handler, timeout, e_context: EventContext, *args, **kwargs):
+        """
+        插件在副本上执行，超时后仍在运行的插件不会再改动本次事件：
+        e_context的各项、context(含kwargs)、reply和列表(如filters)都是浅拷贝，插件正常结束后才写回；
+        channel和kwargs中的对象(如msg)仍是共享的
+        """
+        context = e_context.econtext.get("context")
+        shadow = EventContext(e_context.event, {key: self._shadow_value(value) for key, value in e_context.econtext.items()})
+        shadow.action = e_context.action
+        future = self._get_timeout_pool().submit(handler, shadow, *args, **kwargs)
+        try:
+            future.result(timeout=timeout)
+        except TimeoutError:
+            logger.warning("Plugin %s timed out after %ss on event %s, skipped" % (name, timeout, e_context.event))
+            return "timeout"
+        shadow_context = shadow.econtext.get("context")
+        if isinstance(context, Context) and isinstance(shadow_context, Context):
+            # 调用方持有的是原context对象，需原地写回
+            context.type, context.content = shadow_context.type, shadow_context.content
+            context.kwargs.clear()
+            context.kwargs.update(shadow_context.kwargs)
+            shadow["context"] = context
+        e_context.econtext = shadow.econtext
+        e_context.action = shadow.action
+        return "ok"
+
+    @staticmethod
+    def _shadow_value(value):
+        if isinstance(value, Context):
+            return Context(value.type, value.content, dict(value.kwargs))
+        if isinstance(value, Reply):
+            return Reply(value.type, value.content)
+        if isinstance(value, list):
+            return list(value)
+        return value
+
+    def _get_timeout_pool(self):
+        if self._timeout_pool is None:
+            with self._timeout_pool_lock:
+                if self._timeout_pool is None:
+                    self._timeout_pool = ThreadPoolExecutor(max_workers=conf().get("handler_pool_size", 8), thread_name_prefix="plugin")
+        return self._timeout_pool
+
+    def _record(self, name, elapsed, status):
+        with self.stats_lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = _PluginStats()
+            stats.calls += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            if status == "timeout":
+                stats.timeouts += 1
+            elif status == "error":
+                stats.errors += 1
+
+    def get_plugin_stats(self) -> dict:
+        """各插件的调用次数、耗时(毫秒)、超时和异常次数，超时的调用按等待的时间计"""
+        with self.stats_lock:
+            return {
+                name: {
+                    "calls": stats.calls,
+                    "avg_ms": round(stats.total_time / stats.calls * 1000, 2) if stats.calls else 0.0,
+                    "max_ms": round(stats.max_time * 1000, 2),
+                    "total_ms": round(stats.total_time * 1000, 2),
+                    "timeouts": stats.timeouts,
+                    "errors": stats.errors,
+                }
+                for name, stats in self.stats.items()
+            }
+
     def set_plugin_priority(self, name: str, priority: int):
         name = name.upper()
         if name not in self.plugins:
@@ -238,6 +393,7 @@ class PluginManager:
             rawname = self.plugins[name].name
             self.pconf["plugins"][rawname]["enabled"] = False
             self.save_config()
+            self._rebuild_dispatch_table()
             return True
         return True
 
@@ -339,7 +495,19 @@ class PluginManager:
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
             self.save_config()
+            self._rebuild_dispatch_table()
             return True, "卸载插件成功"
         except Exception as e:
             logger.error("Failed to uninstall plugin, {}".format(e))
             return False, "卸载插件失败，请手动删除文件夹完成卸载，" + str(e)
+
+
+class _PluginStats:
+    __slots__ = ("calls", "total_time", "max_time", "timeouts", "errors")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.timeouts = 0
+        self.errors = 0
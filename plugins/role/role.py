@@ -1,7 +1,9 @@
 # encoding:utf-8
 
+import difflib
 import json
 import os
+from collections import Counter
 
 import plugins
 from bridge.bridge import Bridge
@@ -32,6 +34,45 @@ class RolePlay:
         return prompt
 
 
+class RoleIndex:
+    """
+    角色名的字符倒排索引，用于模糊查找角色
+
+    SequenceMatcher.ratio() = 2*M/(len(a)+len(b))，M为匹配上的字符数，不会超过两个字符串共有的字符数(按次数计)。
+    通过索引找出与输入有共同字符的角色并算出这个上界，按上界从高到低只对可能超过当前最高分的角色计算ratio，
+    结果与对所有角色逐个计算相同：取相似度最高的，相同时取靠后的，低于min_sim时返回None
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.counts = [Counter(name) for name in self.names]
+        self.postings = {}  # 字符 -> 包含该字符的角色序号
+        for i, counts in enumerate(self.counts):
+            for ch in counts:
+                self.postings.setdefault(ch, []).append(i)
+
+    def closest(self, name, min_sim):
+        if min_sim <= 0:
+            # 没有共同字符的角色也可能达到阈值，只能逐个计算
+            candidates = [(1.0, i) for i in range(len(self.names) - 1, -1, -1)]
+        else:
+            common = {}
+            for ch, count in Counter(name).items():
+                for i in self.postings.get(ch, ()):
+                    common[i] = common.get(i, 0) + min(count, self.counts[i][ch])
+            candidates = sorted(((2.0 * c / (len(name) + len(self.names[i])), i) for i, c in common.items()), reverse=True)
+        max_sim, max_index = min_sim, -1
+        for bound, i in candidates:
+            if bound < max_sim:
+                break
+            if bound == max_sim and i < max_index:
+                continue
+            sim = difflib.SequenceMatcher(None, name, self.names[i]).ratio()
+            if sim > max_sim or (sim == max_sim and i > max_index):
+                max_sim, max_index = sim, i
+        return self.names[max_index] if max_index >= 0 else None
+
+
 @plugins.register(
     name="Role",
     desire_priority=0,
@@ -39,6 +80,8 @@ class RolePlay:
     desc="为你的Bot设置预设角色",
     version="1.0",
     author="lanvent",
+    events=[Event.ON_HANDLE_CONTEXT],
+    context_types=[ContextType.TEXT],
 )
 class Role(Plugin):
     def __init__(self):
@@ -61,6 +104,8 @@ class Role(Plugin):
                     if len(self.tags[tag][1]) == 0:
                         logger.debug(f"[Role] no role found for tag {tag} ")
                         del self.tags[tag]
+                self.index = RoleIndex(self.roles)
+                self._cache_tag_listings()
 
             if len(self.roles) == 0:
                 raise Exception("no role found")
@@ -74,25 +119,22 @@ class Role(Plugin):
                 logger.warn("[Role] init failed, ignore or see https://github.com/zhayujie/chatgpt-on-wechat/tree/master/plugins/role .")
             raise e
 
+    def _cache_tag_listings(self):
+        # 角色类型的列表在加载后不再变化，预先生成
+        self.tag_names = "，".join([self.tags[tag][0] for tag in self.tags])
+        self.tag_keys = {}  # 类型名称 -> tag
+        for key, value in self.tags.items():
+            self.tag_keys.setdefault(value[0], key)
+        self.tag_listings = {tag: "".join(f"{role['title']}: {role['remark']}\n" for role in value[1]) for tag, value in self.tags.items()}
+        self.tag_listings["所有"] = "".join(f"{role['title']}: {role['remark']}\n" for role in self.roles.values())
+
     def get_role(self, name, find_closest=True, min_sim=0.35):
         name = name.lower()
         found_role = None
         if name in self.roles:
             found_role = name
         elif find_closest:
-            import difflib
-
-            def str_simularity(a, b):
-                return difflib.SequenceMatcher(None, a, b).ratio()
-
-            max_sim = min_sim
-            max_role = None
-            for role in self.roles:
-                sim = str_simularity(name, role)
-                if sim >= max_sim:
-                    max_sim = sim
-                    max_role = role
-            found_role = max_role
+            found_role = self.index.closest(name, min_sim)
         return found_role
 
     def on_handle_context(self, e_context: EventContext):
@@ -126,25 +168,17 @@ class Role(Plugin):
         elif clist[0] == f"{trigger_prefix}角色类型":
             if len(clist) > 1:
                 tag = clist[1].strip()
-                help_text = "角色列表：\n"
-                for key, value in self.tags.items():
-                    if value[0] == tag:
-                        tag = key
-                        break
-                if tag == "所有":
-                    for role in self.roles.values():
-                        help_text += f"{role['title']}: {role['remark']}\n"
-                elif tag in self.tags:
-                    for role in self.tags[tag][1]:
-                        help_text += f"{role['title']}: {role['remark']}\n"
+                tag = self.tag_keys.get(tag, tag)
+                if tag in self.tag_listings:
+                    help_text = "角色列表：\n" + self.tag_listings[tag]
                 else:
                     help_text = f"未知角色类型。\n"
                     help_text += "目前的角色类型有: \n"
-                    help_text += "，".join([self.tags[tag][0] for tag in self.tags]) + "\n"
+                    help_text += self.tag_names + "\n"
             else:
                 help_text = f"请输入角色类型。\n"
                 help_text += "目前的角色类型有: \n"
-                help_text += "，".join([self.tags[tag][0] for tag in self.tags]) + "\n"
+                help_text += self.tag_names + "\n"
             reply = Reply(ReplyType.INFO, help_text)
             e_context["reply"] = reply
             e_context.action = EventAction.BREAK_PASS
@@ -196,7 +230,7 @@ class Role(Plugin):
         help_text += f"{trigger_prefix}停止扮演: 清除设定的角色。\n"
         help_text += f"{trigger_prefix}角色类型" + " 角色类型: 查看某类{角色类型}的所有预设角色，为所有时输出所有预设角色。\n"
         help_text += "\n目前的角色类型有: \n"
-        help_text += "，".join([self.tags[tag][0] for tag in self.tags]) + "。\n"
+        help_text += self.tag_names + "。\n"
         help_text += f"\n命令例子: \n{trigger_prefix}角色 写作助理\n"
         help_text += f"{trigger_prefix}角色类型 所有\n"
         help_text += f"{trigger_prefix}停止扮演\n"
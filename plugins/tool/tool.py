@@ -17,6 +17,8 @@ from plugins import *
     version="0.5",
     author="goldfishh",
     desire_priority=0,
+    events=[Event.ON_HANDLE_CONTEXT],
+    context_types=[ContextType.TEXT],
 )
 class Tool(Plugin):
     def __init__(self):
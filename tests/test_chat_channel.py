@@ -0,0 +1,60 @@
+import unittest
+
+from channel.chat_channel import ChatChannel
+
+
+class _Holdback(object):
+    """把a替换为*，总是保留最后一个字符"""
+
+    stopped = False
+
+    def __init__(self):
+        self.held = ""
+
+    def feed(self, chunk):
+        text = self.held + chunk.replace("a", "*")
+        self.held = text[-1:]
+        return text[:-1]
+
+    def flush(self):
+        text, self.held = self.held, ""
+        return text
+
+
+class _StopAt(object):
+    """遇到!时停止，只放行!之前的内容"""
+
+    def __init__(self):
+        self.stopped = False
+
+    def feed(self, chunk):
+        if "!" in chunk:
+            self.stopped = True
+            return chunk[: chunk.index("!")]
+        return chunk
+
+    def flush(self):
+        return ""
+
+
+class FilterChunkTest(unittest.TestCase):
+    def run_filters(self, chunks, filters):
+        out = []
+        for chunk in chunks:
+            chunk, stopped = ChatChannel._filter_chunk(chunk, filters)
+            out.append(chunk)
+            if stopped:
+                return "".join(out), True
+        chunk, _ = ChatChannel._filter_chunk("", filters, final=True)
+        out.append(chunk)
+        return "".join(out), False
+
+    def test_filters_run_in_order(self):
+        self.assertEqual(self.run_filters(["xa", "ba", "cd"], [_Holdback(), _Holdback()]), ("x*b*cd", False))
+
+    def test_stop_still_runs_later_filters(self):
+        self.assertEqual(self.run_filters(["xa", "ba", "c!zz", "more"], [_StopAt(), _Holdback()]), ("x*b*c", True))
+
+
+if __name__ == "__main__":
+    unittest.main()
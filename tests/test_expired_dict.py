@@ -0,0 +1,47 @@
+import copy
+import pickle
+import time
+import unittest
+
+from common.expired_dict import ExpiredDict
+
+
+class ExpiredDictCopyTest(unittest.TestCase):
+    def setUp(self):
+        self.d = ExpiredDict(60, max_size=3)
+        self.d["a"] = [1]
+        self.d["b"] = [2]
+        self.d["c"] = [3]
+        self.d["a"]  # a成为最近使用
+
+    def test_copy_is_independent(self):
+        c = copy.copy(self.d)
+        self.assertEqual(c.keys(), ["b", "c", "a"])
+        self.assertIs(c.get("a"), self.d.get("a"))
+        c["x"] = [4]
+        self.assertEqual(c.keys(), ["c", "a", "x"])
+        self.assertEqual(self.d.keys(), ["b", "c", "a"])
+
+    def test_deepcopy(self):
+        c = copy.deepcopy(self.d)
+        c["b"].append(9)
+        self.assertEqual(self.d["b"], [2])
+        self.assertEqual(c.max_size, 3)
+
+    def test_pickle(self):
+        c = pickle.loads(pickle.dumps(self.d))
+        self.assertEqual(c.items(), [("b", [2]), ("c", [3]), ("a", [1])])
+
+    def test_copy_keeps_remaining_ttl(self):
+        d = ExpiredDict(0.2, sweep_interval=0)
+        d["a"] = 1
+        time.sleep(0.1)
+        for c in (copy.copy(d), copy.deepcopy(d), pickle.loads(pickle.dumps(d))):
+            self.assertIn("a", c)
+        time.sleep(0.15)
+        for c in (copy.copy(d), copy.deepcopy(d), d):
+            self.assertEqual(len(c), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from lib.itchat.async_components.session import AsyncSession, ReadTimeout, save_response
+
+_PAYLOAD = os.urandom(3 * 1024 * 1024 + 17)
+
+
+def _app():
+    app = web.Application()
+
+    async def login(request):
+        response = web.json_response({"ok": True})
+        response.set_cookie("wxsid", "sid-1")
+        return response
+
+    async def check(request):
+        return web.json_response({"cookies": dict(request.cookies), "query": dict(request.query)})
+
+    async def upload(request):
+        form = await request.post()
+        media = form["filename"]
+        return web.json_response({
+            "name": form["name"],
+            "filename": media.filename,
+            "content_type": media.content_type,
+            "size": len(media.file.read()),
+        })
+
+    async def download(request):
+        response = web.StreamResponse()
+        response.content_length = len(_PAYLOAD)
+        await response.prepare(request)
+        for i in range(0, len(_PAYLOAD), 256 * 1024):
+            await response.write(_PAYLOAD[i : i + 256 * 1024])
+            await asyncio.sleep(0)
+        return response
+
+    async def slow(request):
+        await asyncio.sleep(2)
+        return web.Response(text="late")
+
+    app.router.add_get("/login", login)
+    app.router.add_get("/check", check)
+    app.router.add_post("/upload", upload)
+    app.router.add_get("/download", download)
+    app.router.add_get("/slow", slow)
+    return app
+
+
+@unittest.skipIf(web is None, "aiohttp is not installed")
+class AsyncSessionTest(unittest.TestCase):
+    def run_with_server(self, test):
+        async def main():
+            runner = web.AppRunner(_app())
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            session = AsyncSession()
+            try:
+                return await test(session, "http://127.0.0.1:{}".format(port))
+            finally:
+                await session.close()
+                await runner.cleanup()
+
+        return asyncio.run(main())
+
+    def test_get_with_cookies(self):
+        async def test(s, url):
+            # 创建aiohttp会话之前设置的cookie在绑定cookie jar后发出
+            s.cookies.update({"webwx_data_ticket": "ticket"})
+            await s.get(url + "/login")
+            self.assertEqual(s.cookies.get_dict(), {"webwx_data_ticket": "ticket", "wxsid": "sid-1"})
+            r = await s.get(url + "/check", params={"r": "1"}, timeout=(5, 5))
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.json(), {"cookies": {"webwx_data_ticket": "ticket", "wxsid": "sid-1"}, "query": {"r": "1"}})
+
+        self.run_with_server(test)
+
+    def test_multipart_upload(self):
+        async def test(s, url):
+            files = {
+                "id": (None, "WU_FILE_0"),
+                "name": (None, "a.png"),
+                "skipped": (None, None),
+                "filename": ("a.png", b"\x89PNG" + b"0" * 1000, "image/png"),
+            }
+            r = await s.post(url + "/upload", files=files)
+            self.assertEqual(r.json(), {"name": "a.png", "filename": "a.png", "content_type": "image/png", "size": 1004})
+
+        self.run_with_server(test)
+
+    def test_streamed_download(self):
+        async def test(s, url):
+            r = await s.get(url + "/download", stream=True)
+            self.assertIsNone(r.content)
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "media")
+                head = await save_response(r, path)
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), _PAYLOAD)
+            self.assertEqual(head, _PAYLOAD[:20])
+            r = await s.get(url + "/download", stream=True)
+            self.assertEqual(await save_response(r), _PAYLOAD)
+
+        self.run_with_server(test)
+
+    def test_read_timeout(self):
+        async def test(s, url):
+            with self.assertRaises(ReadTimeout):
+                await s.get(url + "/slow", timeout=(5, 0.2))
+            with self.assertRaises(ReadTimeout):
+                await s.get(url + "/slow", timeout=0.2)
+
+        self.run_with_server(test)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import os
+import unittest
+
+from bot.bot import Bot
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from bridge.reply_cache import ReplyCache
+
+
+def _context(query, session_id="user-a"):
+    context = Context(ContextType.TEXT, query)
+    context["session_id"] = session_id
+    return context
+
+
+class _StubBot(Bot):
+    args = {"model": "gpt-test", "temperature": 0}
+
+
+class _Counter(object):
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.replies.pop(0)
+
+
+class ReplyCacheErrorTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ReplyCache()
+        self.bot = _StubBot()
+
+    def fetch(self, query, compute, session_id="user-a"):
+        return self.cache.fetch("chatGPT", self.bot, query, _context(query, session_id), compute)
+
+    def test_text_reply_is_cached(self):
+        compute = _Counter(Reply(ReplyType.TEXT, "答案"))
+        self.assertEqual(self.fetch("问题", compute).content, "答案")
+        self.assertEqual(self.fetch("问题", compute, "user-b").content, "答案")
+        self.assertEqual(compute.calls, 1)
+
+    def test_error_reply_is_not_cached(self):
+        compute = _Counter(Reply(ReplyType.ERROR, "请求过于频繁，请稍后再试"), Reply(ReplyType.TEXT, "答案"))
+        self.assertEqual(self.fetch("问题", compute).type, ReplyType.ERROR)
+        self.assertEqual(self.fetch("问题", compute, "user-b").content, "答案")
+        self.assertEqual(compute.calls, 2)
+        self.assertEqual(self.cache.stats()["stores"], 1)
+
+    def test_reply_flagged_as_error_is_not_cached(self):
+        def compute():
+            # 流式回复出错时bot在context上标记
+            context["reply_error"] = True
+            return Reply(ReplyType.TEXT, "网络连接异常")
+
+        context = _context("问题")
+        self.cache.fetch("chatGPT", self.bot, "问题", context, compute)
+        self.assertEqual(self.cache.stats()["stores"], 0)
+
+
+class ReplyCacheSessionTest(unittest.TestCase):
+    def setUp(self):
+        from bot.chatgpt.chat_gpt_session import ChatGPTSession
+        from bot.session_manager import SessionManager
+
+        self.cache = ReplyCache()
+        self.bot = _StubBot()
+        self.bot.sessions = SessionManager(ChatGPTSession, model="gpt-test")
+
+    def fetch(self, query, compute):
+        return self.cache.fetch("chatGPT", self.bot, query, _context(query), compute)
+
+    def test_sessions_ignored_without_session_history(self):
+        compute = _Counter(Reply(ReplyType.TEXT, "答案"))
+        for _ in range(6):
+            self.assertEqual(self.fetch("问题", compute).content, "答案")
+        self.assertEqual(compute.calls, 1)
+        self.assertNotIn("user-a", self.bot.sessions.sessions)
+
+    def test_session_history_recorded_on_hit(self):
+        self.bot.session_history = True
+        compute = _Counter(Reply(ReplyType.TEXT, "答案"), Reply(ReplyType.TEXT, "另一个答案"))
+        self.fetch("问题", compute)
+        self.fetch("问题", compute)
+        messages = self.bot.sessions.sessions["user-a"].messages
+        self.assertEqual([m["content"] for m in messages[-2:]], ["问题", "答案"])
+        # 会话记录变化后缓存键不同
+        self.assertEqual(self.fetch("问题", compute).content, "另一个答案")
+        self.assertEqual(compute.calls, 2)
+
+
+class ReplyCacheLinkAITest(unittest.TestCase):
+    def setUp(self):
+        from bot.linkai.link_ai_bot import LinkAIBot
+
+        self.cache = ReplyCache()
+        self.bot = LinkAIBot()
+        self.bot.args = {"model": "gpt-test", "temperature": 0}
+        for session_id, query, reply in (("user-a", "你好", "你好呀"), ("user-b", "天气", "晴"), ("user-c", "你好", "你好呀")):
+            self.bot.sessions.session_reply(reply, session_id, query=query)
+
+    def fetch(self, session_id, compute, **kwargs):
+        context = _context("继续", session_id)
+        for key, value in kwargs.items():
+            context[key] = value
+
+        def reply():
+            # 与LinkAIBot._chat相同，请求成功后写入会话记录
+            result = compute()
+            self.bot.sessions.session_reply(result.content, session_id, query="继续")
+            return result
+
+        return self.cache.fetch("linkai", self.bot, "继续", context, reply)
+
+    def test_sessions_with_different_history_do_not_share_replies(self):
+        compute = _Counter(Reply(ReplyType.TEXT, "接着聊你好"), Reply(ReplyType.TEXT, "接着聊天气"))
+        self.assertEqual(self.fetch("user-a", compute).content, "接着聊你好")
+        self.assertEqual(self.fetch("user-b", compute).content, "接着聊天气")
+        self.assertEqual(compute.calls, 2)
+
+    def test_hit_is_recorded_in_session(self):
+        compute = _Counter(Reply(ReplyType.TEXT, "接着聊你好"))
+        self.fetch("user-a", compute)
+        # user-c的对话与user-a相同，命中缓存
+        self.cache.fetch("linkai", self.bot, "继续", _context("继续", "user-c"), None)
+        messages = self.bot.sessions.sessions["user-c"].messages
+        self.assertEqual([m["content"] for m in messages[-2:]], ["继续", "接着聊你好"])
+
+    def test_app_code_is_part_of_key(self):
+        compute = _Counter(Reply(ReplyType.TEXT, "应用一"), Reply(ReplyType.TEXT, "应用二"))
+        self.assertEqual(self.fetch("user-a", compute, app_code="app-1").content, "应用一")
+        self.assertEqual(self.fetch("user-c", compute, app_code="app-2").content, "应用二")
+        self.assertEqual(compute.calls, 2)
+
+
+class ChatGPTBotErrorTest(unittest.TestCase):
+    def setUp(self):
+        os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+        from bot.chatgpt.chat_gpt_bot import ChatGPTBot
+
+        self.bot = ChatGPTBot()
+
+        def fail(**kwargs):
+            raise RuntimeError("boom")
+
+        self.bot.client.chat.completions.create = fail
+
+    def test_failure_returns_error_reply(self):
+        reply = self.bot.reply("问题", _context("问题"))
+        self.assertEqual(reply.type, ReplyType.ERROR)
+
+    def test_stream_failure_marks_context(self):
+        context = _context("问题")
+        chunks = list(self.bot.reply_stream("问题", context))
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(context.get("reply_error"))
+
+    def test_failure_is_not_served_from_cache(self):
+        self.bot.args["temperature"] = 0
+        cache = ReplyCache()
+        cache.fetch("chatGPT", self.bot, "问题", _context("问题"), lambda: self.bot.reply("问题", _context("问题")))
+        self.assertEqual(cache.stats()["stores"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,10 +8,8 @@ Description:
 
 """
 
-import http.client
 import json
 import time
-import requests
 import datetime
 import hashlib
 import hmac
@@ -19,6 +17,7 @@ import base64
 import urllib.parse
 import uuid
 
+from common.http_client import get_session
 from common.log import logger
 from common.tmp_dir import TmpDir
 
@@ -47,7 +46,7 @@ def text_to_speech_aliyun(url, text, appkey, token):
         "format": "wav"
     }
 
-    response = requests.post(url, headers=headers, data=json.dumps(data))
+    response = get_session(url).post(url, headers=headers, data=json.dumps(data))
 
     if response.status_code == 200 and response.headers['Content-Type'] == 'audio/mpeg':
         output_file = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".wav"
@@ -95,20 +94,15 @@ def speech_to_text_aliyun(url, audioContent, appkey, token):
     if enableVoiceDetection :
         request = request + '&enable_voice_detection=' + 'true'
         
-    host = 'nls-gateway-cn-shanghai.aliyuncs.com'
-
     # 设置HTTPS请求头部
     httpHeaders = {
         'X-NLS-Token': token,
         'Content-type': 'application/octet-stream',
-        'Content-Length': len(audioContent)
         }
 
-    conn = http.client.HTTPSConnection(host)
-    conn.request(method='POST', url=request, body=audioContent, headers=httpHeaders)
-
-    response = conn.getresponse()
-    body = response.read()
+    # 复用共享连接池中的长连接，不再每次新建HTTPSConnection
+    response = get_session(url).post(request, data=audioContent, headers=httpHeaders)
+    body = response.content
     try:
         body = json.loads(body)
         status = body['status']
@@ -116,13 +110,11 @@ def speech_to_text_aliyun(url, audioContent, appkey, token):
             result = body['result']
             if result :
                 logger.info(f"阿里云语音识别到了：{result}")
-            conn.close()
             return result
         else :
             logger.error(f"语音识别失败，状态码: {status}")
     except ValueError:
         logger.error(f"语音识别失败，收到非JSON格式的数据: {body}")
-    conn.close()
     return None
 
 
@@ -211,6 +203,6 @@ class AliyunTokenGenerator:
         url = 'http://nls-meta.cn-shanghai.aliyuncs.com/?' + urllib.parse.urlencode(params)
 
         # 发送请求
-        response = requests.get(url)
+        response = get_session(url).get(url)
 
         return response.text
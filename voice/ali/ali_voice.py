@@ -14,6 +14,7 @@ import re
 import time
 
 from bridge.reply import Reply, ReplyType
+from common.credential_cache import get_credential
 from common.log import logger
 from voice.audio_convert import get_pcm_from_wav
 from voice.voice import Voice
@@ -31,8 +32,6 @@ class AliVoice(Voice):
             config_path = os.path.join(curdir, "config.json")
             with open(config_path, "r") as fr:
                 config = json.load(fr)
-            self.token = None
-            self.token_expire_time = 0
             # 默认复用阿里云千问的 access_key 和 access_secret
             self.api_url_voice_to_text = config.get("api_url_voice_to_text")
             self.api_url_text_to_voice = config.get("api_url_text_to_voice")
@@ -83,19 +82,19 @@ class AliVoice(Voice):
 
     def get_valid_token(self):
         """
-        获取有效的阿里云token。
+        获取有效的阿里云token，有效期内复用缓存，过期前由后台提前刷新。
 
         :return: 返回有效的token字符串。
         """
-        current_time = time.time()
-        if self.token is None or current_time >= self.token_expire_time:
-            get_token = AliyunTokenGenerator(self.access_key_id, self.access_key_secret)
-            token_str = get_token.get_token()
-            token_data = json.loads(token_str)
-            self.token = token_data["Token"]["Id"]
-            # 将过期时间减少一小段时间（例如5分钟），以避免在边界条件下的过期
-            self.token_expire_time = token_data["Token"]["ExpireTime"] - 300
-            logger.debug(f"新获取的阿里云token：{self.token}")
-        else:
-            logger.debug("使用缓存的token")
-        return self.token
+        return get_credential("ali_nls", self.access_key_id, self._create_token)
+
+    def _create_token(self):
+        """
+        请求新的阿里云token。
+
+        :return: (token, 剩余有效期秒数)
+        """
+        get_token = AliyunTokenGenerator(self.access_key_id, self.access_key_secret)
+        token_data = json.loads(get_token.get_token())
+        # ExpireTime为过期时刻的时间戳，换算成剩余有效期
+        return token_data["Token"]["Id"], token_data["Token"]["ExpireTime"] - time.time()
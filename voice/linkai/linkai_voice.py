@@ -2,9 +2,9 @@
 google voice service
 """
 import random
-import requests
 from voice import audio_convert
 from bridge.reply import Reply, ReplyType
+from common.http_client import get_session
 from common.log import logger
 from config import conf
 from voice.voice import Voice
@@ -38,7 +38,7 @@ class LinkAIVoice(Voice):
             data = {
                 "model": model
             }
-            res = requests.post(url, files=file_body, headers=headers, data=data, timeout=(5, 60))
+            res = get_session(url).post(url, files=file_body, headers=headers, data=data, timeout=(5, 60))
             if res.status_code == 200:
                 text = res.json().get("text")
             else:
@@ -65,7 +65,7 @@ class LinkAIVoice(Voice):
                 "voice": conf().get("tts_voice_id"),
                 "app_code": conf().get("linkai_app_code")
             }
-            res = requests.post(url, headers=headers, json=data, timeout=(5, 120))
+            res = get_session(url).post(url, headers=headers, json=data, timeout=(5, 120))
             if res.status_code == 200:
                 tmp_file_name = "tmp/" + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3"
                 with open(tmp_file_name, 'wb') as f:
@@ -6,10 +6,10 @@ import json
 import openai
 
 from bridge.reply import Reply, ReplyType
+from common.http_client import get_session
 from common.log import logger
 from config import conf
 from voice.voice import Voice
-import requests
 from common import const
 import datetime, random
 
@@ -33,7 +33,7 @@ class OpenaiVoice(Voice):
             data = {
                 "model": "whisper-1",
             }
-            response = requests.post(url, headers=headers, files=files, data=data)
+            response = get_session(api_base).post(url, headers=headers, files=files, data=data)
             response_data = response.json()
             text = response_data['text']
             reply = Reply(ReplyType.TEXT, text)
@@ -57,7 +57,7 @@ class OpenaiVoice(Voice):
                 'input': text,
                 'voice': conf().get("tts_voice_id") or "alloy"
             }
-            response = requests.post(url, headers=headers, json=data)
+            response = get_session(api_base).post(url, headers=headers, json=data)
             file_name = "tmp/" + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3"
             logger.debug(f"[OPENAI] text_to_Voice file_name={file_name}, input={text}")
             with open(file_name, 'wb') as f: